@@ -1,7 +1,20 @@
 
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context
 import os
+import json
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import contextmanager
 from code_agent.code_agent import CodeAgent
+from jobs.batch import BATCH_MAX_TASKS, submit_batch, task_key
+from jobs.job_queue import JOB_QUEUE_BACKEND, JobQueueUnavailable, get_job_queue
+from jobs.worker import start_worker_threads
+from code_agent.sandbox import get_sandbox_pool, shutdown_sandbox_pool
+from metrics import tracing
+from metrics.metrics import render_metrics
+from models.resilience import DeadlineExceeded
+from sessions.session_store import SessionStoreUnavailable, finish_turn, start_turn
 import logging
 import traceback
 
@@ -20,6 +33,123 @@ REDIS_HOST = os.getenv("REDIS_HOST", "redis")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 REDIS_DB = int(os.getenv("REDIS_DB", 0))
 
+# Seconds between keep-alive comments on idle agent event streams
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+
+# With the in-memory job queue there are no separate worker processes: consume it from threads here
+JOB_WORKER_THREADS = int(os.getenv("JOB_WORKER_THREADS", 2))
+
+IMPORT_LIBRARIES = [
+    {
+        "lib_name": ["numpy"]
+    },
+    {
+        "lib_name": ["geopy"],
+        "instructions": "A library to get the coordinates of a given location.",
+        "code_example": """
+            from geopy.geocoders import Nominatim
+            from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+
+            def get_coordinates({{user_agent, location}}):
+            
+                user_agent = "my-app/1.0"
+                location = "Rome, Italy"
+            
+                geolocator = Nominatim(user_agent=user_agent)
+
+                try:
+                    # Geocode the location
+                    geo_location = geolocator.geocode(location)
+                    
+                    if geo_location:
+                        return (geo_location.latitude, geo_location.longitude)
+                    else:
+                        print(f"Location '{{location}}' not found.")
+                        return None
+
+                except GeocoderTimedOut:
+                    print("Geocoding service timed out.")
+                    return None
+                except GeocoderServiceError as e:
+                    print(f"Geocoding service error: {{e}}")
+                    return None
+
+        """
+    }
+]
+
+
+class InFlightRuns:
+    """Counts agent runs in progress so a shutting-down worker can wait for them to drain."""
+
+    def __init__(self):
+        self.count = 0
+        self.draining = False
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def track(self):
+        with self._condition:
+            self.count += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.count -= 1
+                self._condition.notify_all()
+
+    def wait_idle(self, timeout: float) -> bool:
+        with self._condition:
+            return self._condition.wait_for(lambda: self.count == 0, timeout=timeout)
+
+
+in_flight_runs = InFlightRuns()
+_job_worker_stop = None
+
+
+def start_background_workers(warm_sandbox: bool = False):
+    """
+    Start what must live in each serving process rather than in a preloading parent:
+    job worker threads for the in-memory queue and, optionally, a warm sandbox pool.
+    """
+    global _job_worker_stop
+    if JOB_QUEUE_BACKEND == "memory" and _job_worker_stop is None:
+        _job_worker_stop = start_worker_threads(JOB_WORKER_THREADS)
+    if warm_sandbox:
+        get_sandbox_pool(IMPORT_LIBRARIES)
+
+
+def shutdown(timeout: float):
+    """Stop taking queued jobs, wait up to timeout seconds for in-flight agent runs, then stop the sandbox."""
+    in_flight_runs.draining = True
+    if _job_worker_stop is not None:
+        _job_worker_stop.set()
+    if not in_flight_runs.wait_idle(timeout):
+        logging.warning("Shutting down with %d agent runs still in flight", in_flight_runs.count)
+    shutdown_sandbox_pool()
+
+
+def resolve_chat_history(data):
+    """
+    Return (chat_history, session_id) for a run request. Clients that send `message` with
+    their `session_id` have the conversation kept server-side: only the new message crosses
+    the wire and the agent gets the session's bounded history. Clients that send the whole
+    `session_chat_history` keep working as before, without a session.
+    """
+    if 'message' not in data:
+        return data.get('session_chat_history', []), None
+    session_id = data.get('session_id')
+    return start_turn(session_id, data.get('message')), session_id
+
+
+def client_request_id():
+    """
+    The caller's X-Request-ID, recorded on the run's trace. Traces are stored under ids
+    the server generates, so a reused or guessed header cannot overwrite or read another run's.
+    """
+    request_id = request.headers.get('X-Request-ID')
+    return request_id if tracing.valid_request_id(request_id) else None
+
 
 @app.route('/')
 def index():
@@ -28,70 +158,296 @@ def index():
 
 @app.route('/run-code-agent', methods=['POST'])
 def run_code_agent():
+    trace_id, client_id = tracing.new_request_id(), client_request_id()
     try:
         data = request.get_json()
         if not data:
             return jsonify({"error": "Request body is empty"}), 400
 
         # Extract necessary fields for initializing CodeAgent
-        chat_history = data.get('session_chat_history', [])
-
-        import_libraries = [
-            {
-                "lib_name": ["numpy"]
-            },
-            {
-                "lib_name": ["geopy"],
-                "instructions": "A library to get the coordinates of a given location.",
-                "code_example": """
-                    from geopy.geocoders import Nominatim
-                    from geopy.exc import GeocoderTimedOut, GeocoderServiceError
-
-                    def get_coordinates({{user_agent, location}}):
-                    
-                        user_agent = "my-app/1.0"
-                        location = "Rome, Italy"
-                    
-                        geolocator = Nominatim(user_agent=user_agent)
-
-                        try:
-                            # Geocode the location
-                            geo_location = geolocator.geocode(location)
-                            
-                            if geo_location:
-                                return (geo_location.latitude, geo_location.longitude)
-                            else:
-                                print(f"Location '{{location}}' not found.")
-                                return None
-
-                        except GeocoderTimedOut:
-                            print("Geocoding service timed out.")
-                            return None
-                        except GeocoderServiceError as e:
-                            print(f"Geocoding service error: {{e}}")
-                            return None
-
-                """
-            }
-        ]
+        chat_history, session_id = resolve_chat_history(data)
 
         code_agent = CodeAgent(
             chat_history=chat_history,
-            import_libraries=import_libraries
+            import_libraries=IMPORT_LIBRARIES,
+            request_id=trace_id,
+            client_request_id=client_id
         )
 
-        final_answer = code_agent.run_agent()
-        return jsonify({"assistant": final_answer}), 200
+        with in_flight_runs.track():
+            final_answer = code_agent.run_agent()
+        finish_turn(session_id, final_answer)
+        return jsonify({"assistant": final_answer}), 200, {'X-Trace-ID': trace_id}
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except SessionStoreUnavailable as e:
+        return jsonify({"error": f"Session store unavailable: {str(e)}"}), 503
+    except DeadlineExceeded as e:
+        return jsonify({"error": f"Agent run exceeded its deadline: {str(e)}"}), 504, {'X-Trace-ID': trace_id}
     
     except Exception as e:
         logging.error("Exception occurred in /run-code-agent: %s", str(e))
         logging.error(traceback.format_exc())
-        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+        return jsonify({"error": f"Internal server error: {str(e)}"}), 500, {'X-Trace-ID': trace_id}
+
+
+def format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.route('/run-code-agent-stream', methods=['POST'])
+def run_code_agent_stream():
+    """
+    Same input as /run-code-agent, answered as Server-Sent Events: plan, iteration,
+    subtask_started, subtask_finished, evaluating, evaluation, answer_token, error
+    and finally done with the complete answer. The run's trace is served at
+    /traces/<X-Trace-ID response header> once it ends.
+    """
+    trace_id, client_id = tracing.new_request_id(), client_request_id()
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Request body is empty"}), 400
+
+    try:
+        chat_history, session_id = resolve_chat_history(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except SessionStoreUnavailable as e:
+        return jsonify({"error": f"Session store unavailable: {str(e)}"}), 503
+    events = queue.Queue()
+    finished = object()
+
+    def run():
+        try:
+            code_agent = CodeAgent(
+                chat_history=chat_history,
+                import_libraries=IMPORT_LIBRARIES,
+                on_event=lambda event, payload: events.put((event, payload)),
+                request_id=trace_id,
+                client_request_id=client_id
+            )
+            with in_flight_runs.track():
+                final_answer = code_agent.run_agent()
+            finish_turn(session_id, final_answer)
+            events.put(("done", {"assistant": final_answer}))
+        except DeadlineExceeded:
+            pass  # Already reported by the agent's own error event
+        except Exception as e:
+            logging.error("Exception occurred in /run-code-agent-stream: %s", str(e))
+            logging.error(traceback.format_exc())
+            events.put(("error", {"error": f"Internal server error: {str(e)}"}))
+        finally:
+            events.put(finished)
+
+    threading.Thread(target=run, name="agent-stream", daemon=True).start()
+
+    def generate():
+        # Flush something immediately so the client sees the first byte before planning ends
+        yield ": stream opened\n\n"
+        while True:
+            try:
+                item = events.get(timeout=SSE_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                # Comment lines keep proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                continue
+            if item is finished:
+                break
+            event, payload = item
+            yield format_sse(event, payload)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            'X-Trace-ID': trace_id
+        }
+    )
+
+
+@app.route('/run-code-agent-batch', methods=['POST'])
+def run_code_agent_batch():
+    """
+    Run a list of tasks, each with the same fields as a /run-code-agent body, answered as
+    Server-Sent Events: result or error for each task (by its index) as soon as it is
+    known, then done. Identical tasks, in this batch or already running for another
+    request, share one agent run; distinct ones run concurrently up to BATCH_MAX_CONCURRENCY.
+    """
+    data = request.get_json(silent=True)
+    tasks = data.get("tasks") if isinstance(data, dict) else None
+    if not isinstance(tasks, list) or not tasks:
+        return jsonify({"error": "Request body must contain a non-empty 'tasks' list"}), 400
+    if len(tasks) > BATCH_MAX_TASKS:
+        return jsonify({"error": f"A batch holds at most {BATCH_MAX_TASKS} tasks"}), 400
+
+    rejected = []
+    accepted = []  # (index, chat_history, session_id)
+    for index, task in enumerate(tasks):
+        try:
+            if not isinstance(task, dict):
+                raise ValueError("Task must be an object")
+            chat_history, session_id = resolve_chat_history(task)
+            accepted.append((index, chat_history, session_id))
+        except ValueError as e:
+            rejected.append((index, str(e)))
+        except SessionStoreUnavailable as e:
+            rejected.append((index, f"Session store unavailable: {str(e)}"))
+
+    def run_task(chat_history):
+        def run():
+            code_agent = CodeAgent(chat_history=chat_history, import_libraries=IMPORT_LIBRARIES)
+            with in_flight_runs.track():
+                return code_agent.run_agent()
+        return run
+
+    futures = submit_batch([
+        (task_key(chat_history, IMPORT_LIBRARIES), run_task(chat_history))
+        for _, chat_history, _ in accepted
+    ])
+
+    def finish_sessions(future):
+        # Sessions get their answer even if the client is gone before it is streamed
+        if future.exception() is None:
+            final_answer, _ = future.result()
+            for position in futures[future]:
+                finish_turn(accepted[position][2], final_answer)
+
+    for future in futures:
+        future.add_done_callback(finish_sessions)
+
+    def generate():
+        yield ": stream opened\n\n"
+        for index, error in rejected:
+            yield format_sse("error", {"index": index, "error": error})
+        failed = len(rejected)
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=SSE_HEARTBEAT_SECONDS, return_when=FIRST_COMPLETED)
+            if not done:
+                yield ": keep-alive\n\n"
+                continue
+            for future in done:
+                positions = futures[future]
+                error = future.exception()
+                if error is not None:
+                    failed += len(positions)
+                    message = f"Agent run exceeded its deadline: {error}" if isinstance(error, DeadlineExceeded) else f"Internal server error: {error}"
+                    for position in positions:
+                        yield format_sse("error", {"index": accepted[position][0], "error": message})
+                    continue
+                final_answer, shared = future.result()
+                for position in positions:
+                    yield format_sse("result", {
+                        "index": accepted[position][0],
+                        "assistant": final_answer,
+                        "deduplicated": shared or len(positions) > 1
+                    })
+        yield format_sse("done", {"tasks": len(tasks), "distinct_runs": len(futures), "failed": failed})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue an agent run and return its id immediately; workers pick it up from the queue."""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Request body is empty"}), 400
+
+    try:
+        chat_history, session_id = resolve_chat_history(data)
+        job_id = get_job_queue().submit(
+            payload={
+                "session_chat_history": chat_history,
+                "session_id": session_id,
+                "import_libraries": IMPORT_LIBRARIES
+            },
+            priority=int(data.get('priority', 0))
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except SessionStoreUnavailable as e:
+        return jsonify({"error": f"Session store unavailable: {str(e)}"}), 503
+    except JobQueueUnavailable as e:
+        return jsonify({"error": f"Job queue unavailable: {str(e)}"}), 503
+
+    return jsonify({
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "result_url": f"/jobs/{job_id}/result"
+    }), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    try:
+        job = get_job_queue().get(job_id)
+    except JobQueueUnavailable as e:
+        return jsonify({"error": f"Job queue unavailable: {str(e)}"}), 503
+    if not job:
+        return jsonify({"error": "Job not found or expired"}), 404
+
+    return jsonify({
+        key: job.get(key)
+        for key in ("id", "status", "priority", "attempts", "submitted_at", "started_at", "finished_at", "error")
+        if key in job
+    }), 200
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    try:
+        job = get_job_queue().get(job_id)
+    except JobQueueUnavailable as e:
+        return jsonify({"error": f"Job queue unavailable: {str(e)}"}), 503
+    if not job:
+        return jsonify({"error": "Job not found or expired"}), 404
+
+    if job["status"] == "done":
+        return jsonify(job["result"]), 200
+    if job["status"] == "failed":
+        return jsonify({"error": job.get("error", "Job failed")}), 500
+    return jsonify({"status": job["status"]}), 202
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({
+        "status": "draining" if in_flight_runs.draining else "ok",
+        "in_flight_runs": in_flight_runs.count
+    }), 503 if in_flight_runs.draining else 200
+
+
+@app.route('/traces/<request_id>', methods=['GET'])
+def get_trace(request_id):
+    """Span trace of a finished agent run as OTLP/JSON, by its request id."""
+    trace = tracing.get_trace(request_id)
+    if trace is None:
+        return jsonify({"error": "Trace not found"}), 404
+    return jsonify(trace), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint for this worker process."""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == '__main__':
+    # Development server; production runs under gunicorn with gunicorn.conf.py
+    start_background_workers()
     app.run(
         host='0.0.0.0',
         port=int(os.getenv('FLASK_PORT', 5000)),
-        debug=True
+        debug=os.getenv('FLASK_DEBUG', 'false').lower() == 'true'
     )
@@ -0,0 +1,361 @@
+"""
+OpenAI-compatible stand-in server for offline benchmarks.
+
+Serves POST /v1/chat/completions (plain and streamed) with canned responses chosen
+from the prompt: the planning prompt gets a fixed two-subtask plan (whose subtasks
+reference the verified tools the prompt offers, as a planner would), the evaluation
+prompt a verdict, the plan rebinding prompt the plan's first tool unchanged, and
+anything else (calls made by generated code) a short text.
+Latency, jitter, faults (HTTP 500s, 429s with Retry-After, stalled responses) and
+unsatisfactory verdicts are injected from a seeded random generator so that runs
+are reproducible.
+
+    python -m benchmarks.fake_openai --port 8765 --latency 0.2 --failure-rate 0.01 --stall-rate 0.01
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 gunicorn -c gunicorn.conf.py app:app
+
+GET /stats returns the number of completions served per kind.
+"""
+import argparse
+import copy
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+PLAN = {
+    "main_task": "Compute summary statistics of a generated series and describe them",
+    "main_task_thought": "Generate the data in plain Python, then let a model call describe the numbers.",
+    "subtasks": [
+        {
+            "subtask": "Generate the series and compute its statistics",
+            "tool_name": "compute_stats",
+            "input_from_tool": "",
+            "description": "Builds a deterministic series and returns count, mean and max.",
+            "code": (
+                "def compute_stats():\n"
+                "    values = [(i * 7919) % 1000 for i in range(20000)]\n"
+                "    print(f'Computed {len(values)} values')\n"
+                "    return {'count': len(values), 'mean': sum(values) / len(values), 'max': max(values)}\n"
+            )
+        },
+        {
+            "subtask": "Describe the statistics",
+            "tool_name": "describe_stats",
+            "input_from_tool": "compute_stats",
+            "description": "Asks the model for a one-sentence description of the statistics.",
+            "code": (
+                "def describe_stats(stats):\n"
+                "    from models.models import call_model\n"
+                "    return call_model([{'role': 'user', 'content': f'Describe these statistics: {stats}'}], model='gpt-4o-mini')\n"
+            )
+        }
+    ]
+}
+
+SATISFACTORY = {
+    "satisfactory": True,
+    "thoughts": "Every subtask completed without errors.",
+    "final_answer": "<p>The series has 20,000 values with a mean of 499.5 and a maximum of 999.</p>"
+}
+
+UNSATISFACTORY = {
+    "satisfactory": False,
+    "thoughts": "Re-running the plan to confirm the statistics.",
+    "new_json_plan": PLAN
+}
+
+ELABORATION = "The series is uniformly spread between 0 and 999."
+
+
+def plan_with_work(work_seconds: float) -> Dict:
+    """PLAN whose first tool also waits work_seconds, standing for I/O such as a web search."""
+    if not work_seconds:
+        return PLAN
+    plan = copy.deepcopy(PLAN)
+    root = plan["subtasks"][0]
+    root["code"] = root["code"].replace(
+        "def compute_stats():\n",
+        f"def compute_stats():\n    import time\n    time.sleep({work_seconds!r})\n",
+        1
+    )
+    return plan
+
+
+def plan_with_references(plan: Dict, prompt: str) -> Dict:
+    """plan with each subtask the prompt offers as a verified tool replaced by a reference to it."""
+    offered = {tool_id.split("#")[0]: tool_id for tool_id in re.findall(r"^- (\w+#[0-9a-f]{8}):", prompt, re.MULTILINE)}
+    if not offered:
+        return plan
+    plan = copy.deepcopy(plan)
+    plan["subtasks"] = [
+        {
+            "tool_name": subtask["tool_name"],
+            "input_from_tool": subtask["input_from_tool"],
+            "description": subtask["description"],
+            "verified_tool": offered[subtask["tool_name"]],
+            "arguments": {}
+        } if subtask["tool_name"] in offered else subtask
+        for subtask in plan["subtasks"]
+    ]
+    return plan
+
+
+def classify_prompt(messages) -> str:
+    content = " ".join(str(message.get("content", "")) for message in messages or [])
+    if "evaluation assistant" in content:
+        return "evaluate"
+    if "decomposing them into a series of Python functions" in content:
+        return "plan"
+    if "A plan of Python tool functions was written for a previous task" in content:
+        return "rebind"
+    return "elaborate"
+
+
+# Characters per streamed chunk; --chunk-delay is paid once per chunk, streamed or not
+CHUNK_CHARS = 16
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 overflows under load and stalls clients in SYN retransmits
+    request_queue_size = 256
+
+
+class FakeOpenAIServer:
+    """Threaded HTTP server answering chat completions with canned, seeded responses."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 failure_rate: float = 0.0, unsatisfactory_rate: float = 0.0, chunk_delay: float = 0.0,
+                 seed: int = 0, rate_limit_rate: float = 0.0, retry_after: float = 1.0,
+                 stall_rate: float = 0.0, stall_seconds: float = 30.0, work_seconds: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.plan = plan_with_work(work_seconds)
+        self.unsatisfactory_rate = unsatisfactory_rate
+        self.chunk_delay = chunk_delay
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"plan": 0, "evaluate": 0, "rebind": 0, "elaborate": 0, "failed": 0, "rate_limited": 0, "stalled": 0}
+        self._httpd = _HTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def start(self) -> "FakeOpenAIServer":
+        """Serve from a background thread of this process."""
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _draw(self):
+        """One seeded draw per request: (delay, fault, unsatisfactory); fault is None, "fail", "rate_limit" or "stall"."""
+        with self._lock:
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            fault_draw = self._random.random()
+            unsatisfactory = self._random.random() < self.unsatisfactory_rate
+        fault = None
+        for name, rate in (("fail", self.failure_rate), ("rate_limit", self.rate_limit_rate), ("stall", self.stall_rate)):
+            if fault_draw < rate:
+                fault = name
+                break
+            fault_draw -= rate
+        return delay, fault, unsatisfactory
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def respond(self, body: Dict):
+        """Return (status, completion text or error message, kind) for a request body."""
+        kind = classify_prompt(body.get("messages"))
+        delay, fault, unsatisfactory = self._draw()
+        if fault == "rate_limit":
+            self._count("rate_limited")
+            return 429, "Injected rate limit", kind
+        if fault == "stall":
+            # A connection that hangs: the answer comes, but long after any reasonable timeout
+            self._count("stalled")
+            delay += self.stall_seconds
+        time.sleep(delay)
+        if fault == "fail":
+            self._count("failed")
+            return 500, "Injected failure", kind
+
+        self._count(kind)
+        if kind == "plan":
+            prompt = " ".join(str(message.get("content", "")) for message in body.get("messages") or [])
+            return 200, "```json\n" + json.dumps(plan_with_references(self.plan, prompt), indent=2) + "\n```", kind
+        if kind == "evaluate":
+            return 200, json.dumps(dict(UNSATISFACTORY, new_json_plan=self.plan) if unsatisfactory else SATISFACTORY), kind
+        if kind == "rebind":
+            roots = [s for s in self.plan["subtasks"] if not s["input_from_tool"]]
+            return 200, json.dumps([{"tool_name": s["tool_name"], "code": s["code"]} for s in roots]), kind
+        return 200, ELABORATION, kind
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes: without this, Nagle plus delayed ACKs add ~40 ms per response
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/stats"):
+                    with server._lock:
+                        self._send_json(200, dict(server.stats))
+                else:
+                    self._send_json(404, {"error": {"message": "Not found"}})
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "Not found"}})
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                status, text, kind = server.respond(body)
+                if status == 429:
+                    self._send_json(status, {"error": {"message": text, "type": "rate_limit_error"}},
+                                    headers={"Retry-After": f"{server.retry_after:g}"})
+                    return
+                if status != 200:
+                    self._send_json(status, {"error": {"message": text, "type": "server_error"}})
+                    return
+
+                model = body.get("model", "o1-mini")
+                usage = _usage(body.get("messages"), text)
+                if body.get("stream"):
+                    self._stream(model, text, usage, bool((body.get("stream_options") or {}).get("include_usage")))
+                else:
+                    # Generation takes as long as when streamed; the answer is just sent at the end
+                    time.sleep(server.chunk_delay * _chunk_count(text))
+                    self._send_json(200, {
+                        "id": f"chatcmpl-{uuid.uuid4().hex}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": text},
+                            "finish_reason": "stop"
+                        }],
+                        "usage": usage
+                    })
+
+            def _stream(self, model: str, text: str, usage: Dict, include_usage: bool):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+                def chunk(choices, chunk_usage=None):
+                    payload = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": choices
+                    }
+                    if chunk_usage is not None:
+                        payload["usage"] = chunk_usage
+                    self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+                for start in range(0, len(text), CHUNK_CHARS):
+                    chunk([{"index": 0, "delta": {"content": text[start:start + CHUNK_CHARS]}, "finish_reason": None}])
+                    if server.chunk_delay:
+                        time.sleep(server.chunk_delay)
+                chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+                if include_usage:
+                    chunk([], usage)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+def _chunk_count(text: str) -> int:
+    return (len(text) + CHUNK_CHARS - 1) // CHUNK_CHARS
+
+
+def _usage(messages, text: str) -> Dict:
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in messages or [])
+    prompt_tokens = prompt_chars // 4
+    completion_tokens = len(text) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="mean seconds per completion")
+    parser.add_argument("--jitter", type=float, default=0.05, help="uniform +/- seconds around the mean")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0,
+                        help="fraction of requests answered with HTTP 429 and Retry-After")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="fraction of requests that stall")
+    parser.add_argument("--stall-seconds", type=float, default=30.0, help="extra delay of a stalled request")
+    parser.add_argument("--unsatisfactory-rate", type=float, default=0.0,
+                        help="fraction of evaluations that ask for another iteration")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="seconds per 16-character chunk of a completion (generation time), streamed or not")
+    parser.add_argument("--work-seconds", type=float, default=0.0,
+                        help="seconds the plan's first tool spends waiting, standing for I/O")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = FakeOpenAIServer(
+        host=args.host, port=args.port, latency=args.latency, jitter=args.jitter,
+        failure_rate=args.failure_rate, unsatisfactory_rate=args.unsatisfactory_rate,
+        chunk_delay=args.chunk_delay, seed=args.seed, rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after, stall_rate=args.stall_rate, stall_seconds=args.stall_seconds,
+        work_seconds=args.work_seconds
+    )
+    print(f"Fake OpenAI server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+Offline load benchmark for /run-code-agent.
+
+Starts the fake OpenAI server (benchmarks/fake_openai.py), points models.models at
+it through OPENAI_BASE_URL and drives the Flask app in this process at a fixed
+concurrency, so no API cost and no network noise enter the numbers. Reports latency
+percentiles, throughput, memory growth per request and, from the /metrics registry,
+where the time of an average request goes: model calls versus the agent's own
+overhead in each stage.
+
+    python -m benchmarks.load_agent --requests 200 --concurrency 16 --latency 0.2
+    python -m benchmarks.load_agent --output bench.json
+    python -m benchmarks.load_agent --baseline bench.json --max-regression 0.15
+
+With --url the requests go to a running server instead (start it with
+OPENAI_BASE_URL pointing at `python -m benchmarks.fake_openai`); the stage split is
+then read from that server's /metrics and memory growth is not measured.
+
+Results are reproducible for a given set of arguments: the fake server is seeded,
+requests are deterministic and warmup requests are excluded from the statistics.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai import FakeOpenAIServer
+
+# Model calls that belong to each agent stage
+STAGE_CALL_SITES = {"plan": ["plan", "plan-rebind"], "execute": ["elaborate"], "evaluate": ["evaluate", "replan", "answer"]}
+REGRESSION_METRICS = ("p50", "p95", "p99")
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = fraction * (len(ordered) - 1)
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+_SAMPLE = re.compile(r'^(\w+)\{([^}]*)\} (\S+)$')
+
+
+def metric_sums(metrics_text: str, name: str, label: str) -> Dict[str, float]:
+    """Sum `name` samples from a Prometheus text exposition, grouped by one label."""
+    sums = {}
+    for line in metrics_text.splitlines():
+        match = _SAMPLE.match(line)
+        if not match or match.group(1) != name:
+            continue
+        labels = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match.group(2)))
+        key = labels.get(label, "")
+        sums[key] = sums.get(key, 0.0) + float(match.group(3))
+    return sums
+
+
+def counter_deltas(metrics_before: str, metrics_after: str, name: str, label: str) -> Dict[str, float]:
+    """Increase of a counter during the run, by one label; labels that did not move are left out."""
+    before = metric_sums(metrics_before, name, label)
+    deltas = {key: value - before.get(key, 0.0) for key, value in metric_sums(metrics_after, name, label).items()}
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+RESILIENCE_COUNTERS = {
+    "retries": ("llm_retries_total", "reason"),
+    "fallbacks": ("llm_route_fallbacks_total", "reason"),
+    "hedges": ("llm_hedges_total", "result"),
+    "breaker": ("llm_breaker_transitions_total", "state"),
+}
+
+
+class InProcessClient:
+    """Calls the WSGI app directly; one Flask test client per thread."""
+
+    def __init__(self, stream: bool):
+        from app import app
+        self.app = app
+        self.path = "/run-code-agent-stream" if stream else "/run-code-agent"
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, "client"):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def run(self, body: Dict) -> bool:
+        response = self._client().post(self.path, json=body)
+        return _succeeded(response.status_code, response.get_data(as_text=True), self.path)
+
+    def metrics(self) -> str:
+        return self._client().get("/metrics").get_data(as_text=True)
+
+
+class HttpClient:
+    """Sends requests to a running server over HTTP."""
+
+    def __init__(self, url: str, stream: bool):
+        import requests
+        self.requests = requests
+        self.url = url.rstrip("/")
+        self.path = "/run-code-agent-stream" if stream else "/run-code-agent"
+        self._local = threading.local()
+
+    def _session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = self.requests.Session()
+        return self._local.session
+
+    def run(self, body: Dict) -> bool:
+        response = self._session().post(self.url + self.path, json=body, timeout=600)
+        return _succeeded(response.status_code, response.text, self.path)
+
+    def metrics(self) -> str:
+        return self._session().get(self.url + "/metrics", timeout=30).text
+
+
+def _succeeded(status: int, text: str, path: str) -> bool:
+    if status != 200:
+        return False
+    if path.endswith("-stream"):
+        return "event: done" in text and "event: error" not in text
+    try:
+        return json.loads(text).get("assistant") is not None
+    except ValueError:
+        return False
+
+
+def request_body(index: int) -> Dict:
+    # A distinct conversation per request, so the planning call is never a cache hit
+    return {"session_chat_history": [
+        {"role": "user", "content": f"Benchmark request {index}: compute and describe summary statistics."}
+    ]}
+
+
+def run_load(client, requests: int, concurrency: int, start_index: int = 0):
+    latencies = []
+    failures = 0
+    lock = threading.Lock()
+
+    def one(index: int):
+        nonlocal failures
+        started_at = time.perf_counter()
+        try:
+            ok = client.run(request_body(index))
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started_at
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                failures += 1
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(start_index, start_index + requests)))
+    return latencies, failures, time.perf_counter() - started_at
+
+
+def stage_breakdown(before: str, after: str, requests: int) -> Dict[str, Dict[str, float]]:
+    """Per-request seconds spent in each stage, in model calls and in the agent's own overhead."""
+    def delta(name, label):
+        start, end = metric_sums(before, name, label), metric_sums(after, name, label)
+        return {key: end[key] - start.get(key, 0.0) for key in end}
+
+    stage_seconds = delta("agent_stage_duration_seconds_sum", "stage")
+    llm_seconds = delta("llm_call_duration_seconds_sum", "call_site")
+    breakdown = {}
+    for stage, call_sites in STAGE_CALL_SITES.items():
+        total = stage_seconds.get(stage, 0.0) / requests
+        model = sum(llm_seconds.get(call_site, 0.0) for call_site in call_sites) / requests
+        breakdown[stage] = {"total": total, "model": model, "overhead": max(0.0, total - model)}
+    return breakdown
+
+
+def compare(results: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    regressions = []
+    for key in REGRESSION_METRICS:
+        old, new = baseline["latency"][key], results["latency"][key]
+        if old and new > old * (1 + max_regression):
+            regressions.append(f"{key} latency {old:.3f}s -> {new:.3f}s")
+    old_rps, new_rps = baseline["requests_per_second"], results["requests_per_second"]
+    if old_rps and new_rps < old_rps * (1 - max_regression):
+        regressions.append(f"throughput {old_rps:.2f} -> {new_rps:.2f} req/s")
+    if results["failures"] > baseline["failures"]:
+        regressions.append(f"failures {baseline['failures']} -> {results['failures']}")
+    return regressions
+
+
+def say(text: str = ""):
+    # The agent prints to sys.stdout, which is silenced unless --verbose
+    print(text, file=sys.__stdout__)
+
+
+def print_report(results: Dict):
+    latency = results["latency"]
+    say(f"\nRequests: {results['requests']} at concurrency {results['concurrency']} "
+          f"({results['failures']} failed, {results['error_rate']:.1%}) in {results['wall_seconds']:.2f}s")
+    say(f"Throughput: {results['requests_per_second']:.2f} req/s")
+    say(f"Latency: p50 {latency['p50']:.3f}s  p95 {latency['p95']:.3f}s  p99 {latency['p99']:.3f}s  "
+          f"max {latency['max']:.3f}s")
+    if results.get("memory_growth_kb_per_request") is not None:
+        say(f"Memory growth: {results['memory_growth_kb_per_request']:.1f} KB/request "
+              f"(RSS {results['rss_mb']['before']:.1f} -> {results['rss_mb']['after']:.1f} MB)")
+    say("\nPer-request stage time (s):   total    model  overhead")
+    for stage, split in results["stages"].items():
+        say(f"  {stage:<26} {split['total']:7.3f}  {split['model']:7.3f}  {split['overhead']:8.3f}")
+    say(f"  {'outside stages':<26} {results['unaccounted_seconds']:7.3f}")
+    resilience = {name: counts for name, counts in results.get("resilience", {}).items() if counts}
+    if resilience:
+        say("\nResilience: " + "  ".join(
+            f"{name} " + ", ".join(f"{key}={value:g}" for key, value in sorted(counts.items()))
+            for name, counts in resilience.items()
+        ))
+    if results.get("fake_openai"):
+        say(f"\nFake OpenAI completions: {results['fake_openai']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5, help="requests run first and left out of the statistics")
+    parser.add_argument("--stream", action="store_true", help="use /run-code-agent-stream")
+    parser.add_argument("--url", help="benchmark a running server instead of the app in this process")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake model latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--chunk-delay", type=float, default=0.0,
+                        help="seconds per 16-character chunk of a fake completion, i.e. generation time")
+    parser.add_argument("--work-seconds", type=float, default=0.0,
+                        help="seconds the fake plan's first tool waits, standing for I/O")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of model calls answered with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction answered with HTTP 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="fraction of model calls that stall")
+    parser.add_argument("--stall-seconds", type=float, default=30.0)
+    parser.add_argument("--unsatisfactory-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--plan-cache", action="store_true", help="let requests reuse cached plans")
+    parser.add_argument("--verbose", action="store_true", help="show the agent's prints and info logs")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="results JSON of a previous run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.15,
+                        help="allowed relative slowdown against the baseline before exiting with status 1")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        sys.stdout = open(os.devnull, "w")
+        logging.basicConfig(level=logging.INFO)
+        for handler in logging.getLogger().handlers:
+            handler.setLevel(logging.WARNING)
+
+    fake_server = None
+    if args.url:
+        client = HttpClient(args.url, args.stream)
+    else:
+        fake_server = FakeOpenAIServer(
+            latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+            unsatisfactory_rate=args.unsatisfactory_rate, chunk_delay=args.chunk_delay, seed=args.seed,
+            rate_limit_rate=args.rate_limit_rate,
+            retry_after=args.retry_after, stall_rate=args.stall_rate, stall_seconds=args.stall_seconds,
+            work_seconds=args.work_seconds
+        ).start()
+        # Must be set before the app (and the sandbox workers it forks) import models.models
+        os.environ["OPENAI_BASE_URL"] = fake_server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+        # Every benchmark request is a near-duplicate task: measure planning unless asked otherwise
+        os.environ["PLAN_CACHE_ENABLED"] = "true" if args.plan_cache else "false"
+        # An unresolvable Redis host stalls on DNS at every reconnect attempt; refuse fast instead
+        os.environ.setdefault("REDIS_HOST", "127.0.0.1")
+        client = InProcessClient(args.stream)
+
+    if args.warmup:
+        run_load(client, args.warmup, min(args.concurrency, args.warmup), start_index=-args.warmup)
+
+    metrics_before = client.metrics()
+    rss_before = None if args.url else rss_mb()
+    latencies, failures, wall_seconds = run_load(client, args.requests, args.concurrency)
+    rss_after = None if args.url else rss_mb()
+    metrics_after = client.metrics()
+
+    stages = stage_breakdown(metrics_before, metrics_after, args.requests)
+    mean_latency = sum(latencies) / len(latencies) if latencies else 0.0
+    results = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "failures": failures,
+        "error_rate": failures / args.requests if args.requests else 0.0,
+        "wall_seconds": wall_seconds,
+        "requests_per_second": args.requests / wall_seconds if wall_seconds else 0.0,
+        "latency": {
+            "mean": mean_latency,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies, default=0.0)
+        },
+        "stages": stages,
+        "resilience": {
+            name: counter_deltas(metrics_before, metrics_after, metric, label)
+            for name, (metric, label) in RESILIENCE_COUNTERS.items()
+        },
+        "unaccounted_seconds": max(0.0, mean_latency - sum(split["total"] for split in stages.values())),
+        "memory_growth_kb_per_request": None if rss_before is None else (rss_after - rss_before) * 1024 / args.requests,
+        "rss_mb": None if rss_before is None else {"before": rss_before, "after": rss_after},
+        "fake_openai": dict(fake_server.stats) if fake_server else None
+    }
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+        say(f"\nResults written to {args.output}")
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.max_regression)
+        if regressions:
+            say("\nREGRESSION against baseline: " + "; ".join(regressions))
+            exit_code = 1
+        else:
+            say(f"\nOK: within {args.max_regression:.0%} of the baseline")
+
+    if fake_server:
+        fake_server.stop()
+    if not args.url:
+        from app import shutdown
+        shutdown(timeout=10)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
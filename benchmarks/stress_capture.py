@@ -0,0 +1,85 @@
+"""
+Concurrency stress test for request-scoped output and log capture.
+
+Runs many CodeAgent plans at once (no model calls: the plan is executed directly)
+where every subtask prints and logs a marker unique to its agent, then checks that
+each agent captured exactly its own markers and nothing from the others.
+
+    python -m benchmarks.stress_capture --agents 32 --subtasks 6
+"""
+import argparse
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("OPENAI_API_KEY", "stress-test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from code_agent.capture import bind_memory_logs
+from code_agent.code_agent import CodeAgent
+from code_agent.executor import execute_plan
+
+
+def build_plan(marker: str, subtasks: int):
+    plan = []
+    for index in range(subtasks):
+        plan.append({
+            "tool_name": f"step_{index}",
+            "input_from_tool": f"step_{index - 1}" if index % 2 else "",
+            "code": (
+                f"def step_{index}(*args):\n"
+                f"    import time\n"
+                f"    for _ in range(20):\n"
+                f"        print('{marker}')\n"
+                f"        time.sleep(0.001)\n"
+                f"    logger.info('log {marker}')\n"
+                f"    return {{'marker': '{marker}'}}\n"
+            )
+        })
+    return plan
+
+
+def run_one(agent_index: int, subtasks: int, use_sandbox: bool):
+    marker = f"agent-{agent_index}-marker"
+    agent = CodeAgent(chat_history=[], import_libraries=[])
+    agent.import_modules = []
+    run_subtask = agent._run_subtask if use_sandbox else agent._run_subtask_inline
+    with bind_memory_logs(agent.memory_logs):
+        results = execute_plan(build_plan(marker, subtasks), run_subtask, agent._log_subtask)
+
+    foreign = [line for line in agent.memory_logs if "marker" in line and marker not in line]
+    own_logs = sum(1 for line in agent.memory_logs if f"log {marker}" in line)
+    bad_results = [name for name, result in results.items() if result.get("marker") != marker]
+    return marker, foreign, own_logs, bad_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", type=int, default=32)
+    parser.add_argument("--subtasks", type=int, default=6)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--sandbox", action="store_true", help="run subtasks on the sandbox worker pool")
+    args = parser.parse_args()
+
+    failures = 0
+    for round_index in range(args.rounds):
+        with ThreadPoolExecutor(max_workers=args.agents) as pool:
+            futures = [pool.submit(run_one, i, args.subtasks, args.sandbox) for i in range(args.agents)]
+            for future in futures:
+                marker, foreign, own_logs, bad_results = future.result()
+                if foreign or own_logs != args.subtasks or bad_results:
+                    failures += 1
+                    print(f"FAIL {marker}: {len(foreign)} foreign lines, {own_logs}/{args.subtasks} own logs, "
+                          f"bad results {bad_results}", file=sys.__stdout__)
+        print(f"round {round_index + 1}: {args.agents} agents done, threads alive {threading.active_count()}",
+              file=sys.__stdout__)
+
+    if failures:
+        print(f"{failures} agents saw interleaved capture", file=sys.__stdout__)
+        sys.exit(1)
+    print("OK: every agent captured only its own output and logs", file=sys.__stdout__)
+
+
+if __name__ == "__main__":
+    main()
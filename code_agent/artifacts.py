@@ -0,0 +1,172 @@
+import logging
+import mmap
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import uuid
+from typing import Dict
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_STORE_ENABLED = os.getenv("ARTIFACT_STORE_ENABLED", "true").lower() == "true"
+# Tool outputs at least this large (serialized) are kept in a file and passed around by handle
+ARTIFACT_THRESHOLD_BYTES = int(os.getenv("ARTIFACT_THRESHOLD_BYTES", 64 * 1024))
+ARTIFACT_PREVIEW_CHARS = int(os.getenv("ARTIFACT_PREVIEW_CHARS", 200))
+# Shared memory when the system has it, so artifacts never touch the disk
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR") or os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "code-agent-artifacts"
+)
+# Scopes left behind by processes that died mid-run are removed after this many seconds
+ARTIFACT_MAX_AGE = int(os.getenv("ARTIFACT_MAX_AGE", 86400))
+
+
+def _human_size(size: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+class ArtifactRef:
+    """
+    Handle to a tool output kept in the artifact store: what travels between processes,
+    sits in the executor's records and appears in logs and prompts instead of the value.
+    Its text form is the handle, the size and a preview.
+    """
+
+    __slots__ = ("artifact_id", "path", "kind", "size", "preview")
+
+    def __init__(self, artifact_id: str, path: str, kind: str, size: int, preview: str):
+        self.artifact_id = artifact_id
+        self.path = path
+        self.kind = kind  # "text", "bytes" or "pickle"
+        self.size = size
+        self.preview = preview
+
+    def __repr__(self) -> str:
+        return f"<artifact {self.artifact_id} {self.kind} {_human_size(self.size)}: {self.preview!r}...>"
+
+    __str__ = __repr__
+
+    def load(self):
+        """
+        Materialize the value, reading the file through a memory map. This is a copy: the
+        process that calls the tool holds the whole value, once, for as long as the tool
+        keeps it; only the processes that pass the handle along never do.
+        """
+        with open(self.path, "rb") as artifact_file, \
+                mmap.mmap(artifact_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if self.kind == "text":
+                return str(mapped, "utf-8")
+            if self.kind == "bytes":
+                return mapped[:]
+            return pickle.loads(mapped)
+
+    def excerpt(self, max_chars: int) -> str:
+        """Beginning and end of a text artifact, read without loading the rest."""
+        if self.kind != "text":
+            return repr(self)
+        half = max(max_chars // 2, 1)
+        with open(self.path, "rb") as artifact_file, \
+                mmap.mmap(artifact_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if len(mapped) <= max_chars:
+                return str(mapped, "utf-8", "replace")
+            head = str(mapped[:half], "utf-8", "ignore")
+            tail = str(mapped[-half:], "utf-8", "ignore")
+        return f"{head}\n...[{_human_size(self.size)} artifact {self.artifact_id}, middle omitted]...\n{tail}"
+
+
+def _serialize(value):
+    """(kind, data) of a value worth spilling, or None when it is small or cannot be stored."""
+    if isinstance(value, str):
+        # A str is at least len(value) bytes once encoded: skip the copy for anything shorter
+        if len(value) < ARTIFACT_THRESHOLD_BYTES // 4:
+            return None
+        data = value.encode("utf-8", "surrogatepass")
+        return ("text", data) if len(data) >= ARTIFACT_THRESHOLD_BYTES else None
+    if isinstance(value, (bytes, bytearray)):
+        return ("bytes", bytes(value)) if len(value) >= ARTIFACT_THRESHOLD_BYTES else None
+    if isinstance(value, (dict, list, tuple)):
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return None
+        return ("pickle", data) if len(data) >= ARTIFACT_THRESHOLD_BYTES else None
+    return None
+
+
+def _preview(value, kind: str) -> str:
+    if kind == "text":
+        return value[:ARTIFACT_PREVIEW_CHARS]
+    if kind == "bytes":
+        return repr(bytes(value[:ARTIFACT_PREVIEW_CHARS // 4]))
+    return repr(value)[:ARTIFACT_PREVIEW_CHARS]
+
+
+def spill(value, scope: str):
+    """
+    Return value itself when it is small, otherwise write it to the store under the
+    scope of the agent run and return an ArtifactRef to it.
+    """
+    if not ARTIFACT_STORE_ENABLED or not scope or isinstance(value, ArtifactRef):
+        return value
+    serialized = _serialize(value)
+    if serialized is None:
+        return value
+    kind, data = serialized
+    artifact_id = uuid.uuid4().hex[:16]
+    directory = os.path.join(ARTIFACT_DIR, scope)
+    path = os.path.join(directory, artifact_id)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "wb") as artifact_file:
+            artifact_file.write(data)
+    except OSError as e:
+        logger.warning(f"Could not write artifact to {path}, keeping the value in memory: {e}")
+        return value
+    metrics.ARTIFACTS_SPILLED.inc(kind=kind)
+    metrics.ARTIFACT_SPILLED_BYTES.inc(len(data))
+    return ArtifactRef(artifact_id, path, kind, len(data), _preview(value, kind))
+
+
+def resolve(value):
+    """The value an ArtifactRef stands for; anything else is returned as is."""
+    return value.load() if isinstance(value, ArtifactRef) else value
+
+
+def describe(value):
+    """JSON-friendly stand-in for results that outlive the run, whose artifacts are released."""
+    return repr(value) if isinstance(value, ArtifactRef) else value
+
+
+def new_scope() -> str:
+    return f"{int(time.time())}-{uuid.uuid4().hex[:12]}"
+
+
+def release(scope: str):
+    """Delete every artifact of a finished run, and scopes abandoned by dead processes."""
+    if not scope:
+        return
+    shutil.rmtree(os.path.join(ARTIFACT_DIR, scope), ignore_errors=True)
+    _sweep()
+
+
+def _sweep():
+    cutoff = time.time() - ARTIFACT_MAX_AGE
+    try:
+        entries = os.listdir(ARTIFACT_DIR)
+    except OSError:
+        return
+    for entry in entries:
+        created_at = entry.split("-", 1)[0]
+        if created_at.isdigit() and int(created_at) < cutoff:
+            shutil.rmtree(os.path.join(ARTIFACT_DIR, entry), ignore_errors=True)
+
+
+def public_results(results: Dict) -> Dict:
+    return {tool_name: describe(result) for tool_name, result in results.items()}
@@ -0,0 +1,66 @@
+import contextvars
+import sys
+import threading
+from contextlib import contextmanager
+from io import StringIO
+
+_current_stdout = contextvars.ContextVar("captured_stdout", default=None)
+_current_memory_logs = contextvars.ContextVar("memory_logs", default=None)
+_install_lock = threading.Lock()
+
+
+class _ContextStdout:
+    """
+    Stand-in for sys.stdout that writes to the buffer bound to the current
+    context, or to the real stdout when nothing is being captured. Installing
+    it once lets concurrent subtasks capture their prints without swapping
+    the process-global stream under each other.
+    """
+
+    def __init__(self, fallback):
+        self._fallback = fallback
+
+    def _target(self):
+        buffer = _current_stdout.get()
+        return buffer if buffer is not None else self._fallback
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._fallback, name)
+
+
+def install_stdout_proxy():
+    with _install_lock:
+        if not isinstance(sys.stdout, _ContextStdout):
+            sys.stdout = _ContextStdout(sys.stdout)
+
+
+@contextmanager
+def capture_stdout():
+    install_stdout_proxy()
+    buffer = StringIO()
+    token = _current_stdout.set(buffer)
+    try:
+        yield buffer
+    finally:
+        _current_stdout.reset(token)
+
+
+def current_memory_logs():
+    """The memory log list of the agent run executing in this context, if any."""
+    return _current_memory_logs.get()
+
+
+@contextmanager
+def bind_memory_logs(memory_logs):
+    """Route agent log records emitted in this context (and contexts copied from it) to memory_logs."""
+    token = _current_memory_logs.set(memory_logs)
+    try:
+        yield memory_logs
+    finally:
+        _current_memory_logs.reset(token)
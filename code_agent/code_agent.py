@@ -1,39 +1,89 @@
-
+import contextvars
 import logging
 import json
-from typing import List, Dict
+import os
+import threading
+import time
+from typing import Callable, List, Dict, Optional
 from .prompts import (
     CODE_SYSTEM_PROMPT, 
-    EVALUATION_AGENT_PROMPT
+    EVALUATION_AGENT_PROMPT,
+    FINAL_ANSWER_PROMPT,
+    VERIFIED_TOOLS_PROMPT
 )
-from .utils import sanitize_gpt_response
-from models.models import call_model
+from .utils import sanitize_gpt_response, StreamingArrayExtractor, StreamingFieldExtractor
+from models.models import call_model, call_model_stream, forget_cached_answer
+from models.resilience import DeadlineExceeded, deadline, time_remaining
+from models.routing import routing_policy
 from .prompts import DEFAULT_IMPORT_LIBRARIES
-import sys
-from io import StringIO
+from .capture import capture_stdout, bind_memory_logs, current_memory_logs
+from .executor import execute_plan
+from .artifacts import ArtifactRef, new_scope, public_results, release, resolve, spill
+from .limits import (
+    SUBTASK_CPU_LIMIT,
+    SUBTASK_KILL_GRACE,
+    SUBTASK_TIMEOUT,
+    SubtaskLimitExceeded,
+    limit_fields,
+    thread_limits
+)
+from .compaction import compact_logs, estimate_tokens, log_entry, truncate_middle
+from .sandbox import SANDBOX_ENABLED, SandboxError, get_sandbox_pool, modules_for_libraries
+from .plan_cache import PLAN_CACHE_ENABLED, catalog_fingerprint, plan_cache, task_text
+from .tool_library import TOOL_LIBRARY_ENABLED, describe_tools, resolve_reference, tool_library
+from .validation import SUBTASK_REPAIR_ATTEMPTS, SUBTASK_VALIDATION_ENABLED, PlanValidator, compile_subtask, repair_subtask
+from .pre_evaluator import (
+    PRE_EVALUATION_ANSWER_MODEL,
+    PRE_EVALUATION_ENABLED,
+    final_outputs,
+    pre_evaluate,
+    replan
+)
+from metrics import metrics, tracing
+import traceback
+
+# Size of the output previews sent with subtask_finished progress events
+EVENT_PREVIEW_TOKENS = int(os.getenv("EVENT_PREVIEW_TOKENS", 100))
+# Stream the planning call and start each subtask as soon as its JSON object is complete
+PLAN_STREAMING_ENABLED = os.getenv("PLAN_STREAMING_ENABLED", "true").lower() == "true"
+# Seconds a whole run may take, model calls included; 0 disables the deadline
+AGENT_RUN_DEADLINE = float(os.getenv("AGENT_RUN_DEADLINE", 300))
 
 class MemoryLogHandler(logging.Handler):
-    def __init__(self, memory_logs: List[str], *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.memory_logs = memory_logs
+    """
+    Appends records to the memory logs of the agent run bound to the current context.
+    A single instance serves every agent, so concurrent runs never see each other's
+    logs and nothing outlives the run that produced it.
+    """
 
     def emit(self, record):
-        log_entry = self.format(record)
-        self.memory_logs.append(log_entry)
+        memory_logs = current_memory_logs()
+        if memory_logs is not None:
+            memory_logs.append(log_entry(record, self.format(record)))
 
 
 class CodeAgent:
-    def __init__(self, chat_history: List[Dict], import_libraries: List[str]):
+    def __init__(self, chat_history: List[Dict], import_libraries: List[str],
+                 on_event: Optional[Callable[[str, Dict], None]] = None, request_id: Optional[str] = None,
+                 client_request_id: Optional[str] = None):
         self.chat_history = chat_history
         self.import_libraries = import_libraries
+        self.on_event = on_event  # Optional progress callback, called as on_event(event_name, data)
+        self.request_id = request_id or tracing.new_request_id()  # The run's trace is stored under this id
+        self.client_request_id = client_request_id  # The caller's own id for the request, recorded on the trace
+        self.trace_root = tracing.NOOP_SPAN
         self.memory_logs = []  # Initialize the logs list
         self.logger = logging.getLogger(__name__)
         self.json_plan = None
+        self.subtask_results = {}  # Memoized subtask records by subtask key, shared across iterations
+        self.cached_plan = None  # PlanMatch when the plan was reused from the plan cache
+        self.iteration_records = []  # (subtask, record) pairs of the current iteration, in plan order
+        self.artifact_scope = new_scope()  # Large tool outputs of this run live in the artifact store under this scope
 
         logging.basicConfig(level=logging.DEBUG)  
         self.logger.setLevel(logging.DEBUG)
 
-        memory_handler = MemoryLogHandler(self.memory_logs)
+        memory_handler = MemoryLogHandler()
         memory_handler.setLevel(logging.DEBUG)
         formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s")
         memory_handler.setFormatter(formatter)
@@ -44,100 +94,553 @@ class CodeAgent:
 
 
     def run_agent(self):
+        with bind_memory_logs(self.memory_logs), deadline(AGENT_RUN_DEADLINE), \
+                tracing.trace_run(self.request_id, "agent.run", **{"client.request_id": self.client_request_id}) as trace_root:
+            self.trace_root = trace_root
+            try:
+                return self._run_agent()
+            finally:
+                release(self.artifact_scope)
+
+
+    def _run_finished(self, outcome: str, iterations: int):
+        metrics.AGENT_RUNS.inc(outcome=outcome)
+        self.trace_root.set(outcome=outcome, iterations=iterations)
+        if iterations:
+            metrics.AGENT_ITERATIONS.observe(iterations)
+
+
+    def _run_agent(self):
+        iteration = 0
         try:
             self.logger.info(f"🟢 Starting agent with main task: {self.chat_history}")
             self.import_libraries = self.import_libraries + DEFAULT_IMPORT_LIBRARIES
+            self.import_modules = modules_for_libraries(self.import_libraries)
 
             agent_prompt = CODE_SYSTEM_PROMPT.format(
                 conversation_history=self.chat_history,
                 import_libraries=self.import_libraries
             )
 
-            agent_output_str = call_model(
-                chat_history=[{"role": "user", "content": agent_prompt}],
-                model="o1-mini"
-            )
-
-            agent_output_str = sanitize_gpt_response(agent_output_str)
-            self.json_plan = json.loads(agent_output_str)
-
-            print(f"🔵 Code agent json plan: {json.dumps(self.json_plan, indent=4)}")
+            stage_started_at = time.perf_counter()
+            task = task_text(self.chat_history)
+            if TOOL_LIBRARY_ENABLED:
+                verified_tools = tool_library.offer(task, self.import_libraries)
+                if verified_tools:
+                    # Referenced by id, these tools cost the planner a line instead of their whole code
+                    agent_prompt += VERIFIED_TOOLS_PROMPT.format(verified_tools=describe_tools(verified_tools))
+                    self.logger.info(f"📚 Offering {len(verified_tools)} verified tools to the planner")
+                    self.trace_root.set(verified_tools_offered=len(verified_tools))
+            catalog = catalog_fingerprint(self.import_libraries)
+            if PLAN_CACHE_ENABLED:
+                with tracing.span("plan_cache.lookup") as lookup_span:
+                    self.cached_plan = plan_cache.lookup(task, catalog)
+                    lookup_span.set(result=self.cached_plan.mode if self.cached_plan else "miss")
+
+            plan_stream = None
+            if self.cached_plan:
+                self.json_plan = self.cached_plan.plan
+                self.logger.info(f"♻️ Reusing cached plan ({self.cached_plan.mode}) of task: {self.cached_plan.cached_task}")
+            elif PLAN_STREAMING_ENABLED and not routing_policy.route("plan").escalate_to:
+                # The first iteration executes subtasks while the rest of the plan is generated
+                plan_span = tracing.start_span("plan", streamed=True, prompt_chars=len(agent_prompt))
+                plan_stream = tracing.within(plan_span, self._stream_plan(agent_prompt, stage_started_at, plan_span))
+            else:
+                with tracing.span("plan", streamed=False, prompt_chars=len(agent_prompt)) as plan_span:
+                    agent_output_str = call_model(
+                        chat_history=[{"role": "user", "content": agent_prompt}],
+                        call_site="plan",
+                        expect_json=True
+                    )
+
+                    with tracing.span("plan.parse", chars=len(agent_output_str)):
+                        agent_output_str = sanitize_gpt_response(agent_output_str)
+                        self.json_plan = json.loads(agent_output_str)
+                    plan_span.set(subtasks=len(self.json_plan.get("subtasks", [])))
+
+            if not plan_stream:
+                metrics.AGENT_STAGE_DURATION.observe(time.perf_counter() - stage_started_at, stage="plan")
+                print(f"🔵 Code agent json plan: {json.dumps(self.json_plan, indent=4)}")
+                self._emit_plan()
 
             max_iterations = 2
-            iteration = 0
+            iteration_duration = 0.0
 
             while iteration < max_iterations:
+                # Give up now rather than start an iteration the deadline leaves no time for
+                self._check_deadline(iteration_duration)
+                iteration_started_at = time.monotonic()
                 iteration += 1
                 print(f"🟢 Iteration: {iteration}")
-                subtasks = self.json_plan["subtasks"]
-                results = {}
-
-                # Execute each subtask in the JSON plan
-                for subtask in subtasks:
-                    code_string = subtask["code"]
-                    temp_namespace = {"logger": self.logger}
-                    
-                    old_stdout = sys.stdout
-                    sys.stdout = captured_output = StringIO()  # Redirect stdout
-                    
-                    try:
-                        exec(code_string, temp_namespace)
-                    finally:
-                        sys.stdout = old_stdout  # Restore stdout
-                    
-                    # Optionally log the captured output
-                    printed_output = captured_output.getvalue()
-                    if printed_output:
-                        self.logger.info(f"🟡 Printed output from exec: {printed_output}")
-
-                    tool_name = subtask["tool_name"]
-                    input_tool_name = subtask.get("input_from_tool", "")
-
-                    # If the tool exists in the temp_namespace, proceed
-                    if tool_name in temp_namespace:
-                        tool_func = temp_namespace[tool_name]
-
-                        # Determine input if specified
-                        if input_tool_name:
-                            previous_result = results.get(input_tool_name, {})
-                            result = tool_func(previous_result) # Call the function with the previous result in the parameter
-                        else:
-                            result = tool_func()
-
-                        results[tool_name] = result
-                        self.logger.info(f"🟣 Output from '{tool_name}': {result}")
-                        print(f"🟣 Output from '{tool_name}': {result}")
-
-                evaluation_prompt = EVALUATION_AGENT_PROMPT.format(
-                    original_prompt=agent_prompt,
-                    original_json_plan=json.dumps(self.json_plan, indent=4),
-                    logs=self.memory_logs
+                self._emit("iteration", {"iteration": iteration})
+                subtasks = plan_stream or self.json_plan["subtasks"]
+                plan_stream = None
+                if TOOL_LIBRARY_ENABLED:
+                    resolved = self._resolved(subtasks)
+                    subtasks = list(resolved) if isinstance(subtasks, list) else resolved
+                if SUBTASK_VALIDATION_ENABLED:
+                    # A streamed plan stays a stream: each subtask is checked as it arrives
+                    validated = self._validated(subtasks)
+                    subtasks = list(validated) if isinstance(subtasks, list) else validated
+                stage_started_at = time.perf_counter()
+                self.iteration_records = []
+                with tracing.span("execute", iteration=iteration):
+                    results = execute_plan(subtasks, self._run_subtask, self._log_subtask, memo=self.subtask_results)
+                metrics.AGENT_STAGE_DURATION.observe(time.perf_counter() - stage_started_at, stage="execute")
+
+                self._emit("evaluating", {"iteration": iteration})
+                stage_started_at = time.perf_counter()
+                with tracing.span("evaluate", iteration=iteration) as evaluate_span:
+                    evaluation_output = self._pre_evaluate(agent_prompt, can_replan=iteration < max_iterations)
+                    evaluator = "rules" if evaluation_output else "model"
+                    if not evaluation_output:
+                        evaluation_output = self._evaluate(agent_prompt)
+                    evaluate_span.set(evaluator=evaluator, satisfactory=bool(evaluation_output["satisfactory"]))
+                metrics.AGENT_STAGE_DURATION.observe(time.perf_counter() - stage_started_at, stage="evaluate")
+                metrics.AGENT_EVALUATIONS.inc(
+                    verdict="satisfactory" if evaluation_output["satisfactory"] else "unsatisfactory",
+                    evaluator=evaluator
                 )
-
-                evaluation_output_str = call_model(
-                    chat_history=[{"role": "user", "content": evaluation_prompt}],
-                    model="o1-mini"
-                )
-
-                print('evaluation_output_str', evaluation_output_str)
-
-                evaluation_output_str = sanitize_gpt_response(evaluation_output_str)
-                evaluation_output = json.loads(evaluation_output_str)
+                self._emit("evaluation", {
+                    "iteration": iteration,
+                    "satisfactory": bool(evaluation_output["satisfactory"]),
+                    "thoughts": evaluation_output.get("thoughts", ""),
+                    "pre_evaluated": evaluator == "rules"
+                })
 
                 # Check if the evaluation is satisfactory
                 if evaluation_output["satisfactory"]:
                     print(f"🟢🟢🟢 Evaluation is satisfactory, returning final answer: {evaluation_output.get('final_answer', '')}")
+                    self._run_finished("satisfactory", iteration)
+                    if PLAN_CACHE_ENABLED and not self.cached_plan:
+                        plan_cache.store(task, self.json_plan, catalog)
+                    if TOOL_LIBRARY_ENABLED:
+                        self._learn_tools()
                     return evaluation_output.get("final_answer", "")
                 else:
                     print(f"🔴🔴🔴 Evaluation is not satisfactory, updating json plan: {evaluation_output}")
-                    self.json_plan = evaluation_output["new_json_plan"]
+                    if self.cached_plan:
+                        # The reused plan did not work for this task: forget it and learn the revised one
+                        plan_cache.invalidate(self.cached_plan.entry_id, catalog)
+                        self.cached_plan = None
+                    elif iteration == 1:
+                        # Nor may the model's plan be served again from the response cache
+                        forget_cached_answer([{"role": "user", "content": agent_prompt}], call_site="plan")
+                    # No new plan when the pre-evaluation fails the last iteration: there is nothing left to run it
+                    self.json_plan = evaluation_output.get("new_json_plan") or self.json_plan
+                iteration_duration = time.monotonic() - iteration_started_at
 
 
             self.logger.warning("Max iterations reached without satisfactory evaluation.")
-            return results
+            self._run_finished("max_iterations", iteration)
+            # The artifacts are released with the run: return their handles only
+            return public_results(results)
+
+        except DeadlineExceeded as e:
+            self.logger.error(f"⏱️ Agent run stopped at its deadline of {AGENT_RUN_DEADLINE:g}s: {e}")
+            self._run_finished("deadline", iteration)
+            self._emit("error", {"error": str(e), "deadline": True})
+            raise
 
         except Exception as e:
             self.logger.error(f"Error running agent: {e}")
+            self._run_finished("error", iteration)
+            self._emit("error", {"error": str(e)})
 
 
+    def _check_deadline(self, needed: float):
+        remaining = time_remaining()
+        if remaining is not None and remaining < needed:
+            raise DeadlineExceeded(
+                f"{max(remaining, 0):.1f}s left of the run's deadline, not enough for another iteration (the last took {needed:.1f}s)"
+            )
+
+
+    def _emit(self, event: str, data: Dict):
+        if not self.on_event:
+            return
+        try:
+            self.on_event(event, data)
+        except Exception as e:
+            self.logger.warning(f"Progress callback failed for event '{event}': {e}")
+
+
+    def _emit_plan(self):
+        self._emit("plan", {
+            "main_task": self.json_plan.get("main_task", ""),
+            "cached": bool(self.cached_plan),
+            "subtasks": [
+                {
+                    "tool_name": subtask.get("tool_name"),
+                    "input_from_tool": subtask.get("input_from_tool", ""),
+                    "description": subtask.get("description", "")
+                }
+                for subtask in self.json_plan.get("subtasks", [])
+            ]
+        })
+
+
+    def _stream_plan(self, agent_prompt: str, started_at: float, plan_span=tracing.NOOP_SPAN):
+        """
+        Make the planning call streamed and yield each subtask as soon as its object is
+        complete. self.json_plan is set, and the plan event emitted, once the whole plan
+        has arrived and parsed; subtasks the incremental parser could not read are then
+        taken from the complete plan. plan_span ends with the planning call.
+        """
+        extractor = StreamingArrayExtractor("subtasks")
+        parts = []
+        try:
+            for delta in call_model_stream(
+                chat_history=[{"role": "user", "content": agent_prompt}],
+                call_site="plan"
+            ):
+                parts.append(delta)
+                for subtask in extractor.feed(delta):
+                    self.logger.debug(f"📦 Subtask '{subtask.get('tool_name')}' planned after {time.perf_counter() - started_at:.2f}s")
+                    yield subtask
+
+            plan_text = "".join(parts)
+            with tracing.span("plan.parse", chars=len(plan_text)):
+                self.json_plan = json.loads(sanitize_gpt_response(plan_text))
+            plan_span.set(subtasks=len(self.json_plan.get("subtasks", [])))
+        except Exception as e:
+            plan_span.record_error(e)
+            raise
+        finally:
+            plan_span.end()
+        metrics.AGENT_STAGE_DURATION.observe(time.perf_counter() - started_at, stage="plan")
+        print(f"🔵 Code agent json plan: {json.dumps(self.json_plan, indent=4)}")
+        self._emit_plan()
+        for subtask in self.json_plan["subtasks"][extractor.count:]:
+            yield subtask
+
+
+    def _resolved(self, subtasks):
+        """
+        Replace the subtasks that reference a verified tool with the tool's code, as they
+        arrive. The resolved subtasks become the plan's subtasks, so the evaluation and the
+        plan cache see the code that actually ran.
+        """
+        renamed = {}
+        resolved = []
+        for subtask in subtasks:
+            if subtask.get("input_from_tool") in renamed:
+                subtask = dict(subtask, input_from_tool=renamed[subtask["input_from_tool"]])
+            if subtask.get("verified_tool") and not subtask.get("code"):
+                tool_name = subtask.get("tool_name")
+                subtask = resolve_reference(subtask)
+                if tool_name and tool_name != subtask["tool_name"]:
+                    # Planned under another name: later subtasks still read it by that name
+                    renamed[tool_name] = subtask["tool_name"]
+                self.logger.info(f"📚 Subtask '{subtask['tool_name']}' uses verified tool {subtask['verified_tool']} with arguments {subtask.get('arguments')}")
+            resolved.append(subtask)
+            yield subtask
+        self.json_plan["subtasks"] = resolved
+
+
+    def _learn_tools(self):
+        """Add the subtasks of a satisfactory iteration that ran cleanly to the verified tool library."""
+        for subtask, record in self.iteration_records:
+            if record.get("has_result") and not record.get("error") and not record.get("limit_exceeded"):
+                tool_library.register(subtask)
+
+
+    def _validated(self, subtasks):
+        """
+        Check each subtask statically before it can run, and replace the ones that fail
+        with a targeted repair. The checked subtasks become the plan's subtasks, so the
+        evaluation and the plan cache see what actually ran.
+        """
+        validator = PlanValidator()
+        checked = []
+        for subtask in subtasks:
+            problems = validator.problems(subtask)
+            attempts = 0
+            while problems and attempts < SUBTASK_REPAIR_ATTEMPTS:
+                attempts += 1
+                self.logger.warning(f"🛠️ Subtask '{subtask.get('tool_name')}' failed static checks, repairing it: {problems}")
+                try:
+                    repaired = repair_subtask(subtask, problems, sorted(validator.tool_names))
+                except Exception as e:
+                    self.logger.warning(f"Repairing subtask '{subtask.get('tool_name')}' failed: {e}")
+                    break
+                repaired_problems = validator.problems(repaired)
+                if len(repaired_problems) < len(problems):
+                    subtask, problems = repaired, repaired_problems
+
+            if problems:
+                # Run it anyway: the error it raises is what the evaluation re-plans from
+                self.logger.error(f"🔴 Subtask '{subtask.get('tool_name')}' is still invalid: {problems}")
+                metrics.AGENT_SUBTASK_VALIDATIONS.inc(result="invalid")
+            else:
+                metrics.AGENT_SUBTASK_VALIDATIONS.inc(result="repaired" if attempts else "ok")
+            validator.add(subtask)
+            checked.append(subtask)
+            yield subtask
+        self.json_plan["subtasks"] = checked
+
+
+    def _evaluate(self, agent_prompt: str) -> Dict:
+        """Have the model judge the iteration from the logs, and re-plan or answer."""
+        evaluation_prompt = EVALUATION_AGENT_PROMPT.format(
+            original_prompt=agent_prompt,
+            original_json_plan=json.dumps(self.json_plan, indent=4),
+            logs=compact_logs(self.memory_logs)
+        )
+        print(f"📏 Evaluation prompt size: {len(evaluation_prompt):,} chars (~{estimate_tokens(evaluation_prompt):,} tokens)")
+        tracing.annotate(prompt_chars=len(evaluation_prompt))
+
+        if self.on_event:
+            evaluation_output_str = self._stream_evaluation(evaluation_prompt)
+        else:
+            # Logs carry timestamps, so evaluation prompts never repeat: skip the cache
+            evaluation_output_str = call_model(
+                chat_history=[{"role": "user", "content": evaluation_prompt}],
+                use_cache=False,
+                call_site="evaluate",
+                expect_json=True
+            )
+
+        print('evaluation_output_str', evaluation_output_str)
+
+        with tracing.span("evaluate.parse", chars=len(evaluation_output_str)):
+            evaluation_output_str = sanitize_gpt_response(evaluation_output_str)
+            return json.loads(evaluation_output_str)
+
+
+    def _pre_evaluate(self, agent_prompt: str, can_replan: bool) -> Optional[Dict]:
+        """
+        Settle the evaluation from the subtask records when the rules are conclusive:
+        a certain failure goes straight to re-planning, and a clean run is answered by
+        PRE_EVALUATION_ANSWER_MODEL when one is configured. None leaves it to the model.
+        """
+        if not PRE_EVALUATION_ENABLED:
+            return None
+        pre_evaluation = pre_evaluate(self.iteration_records)
+
+        if pre_evaluation.verdict == "fail":
+            summary = pre_evaluation.summary()
+            self.logger.warning(f"🔴 Pre-evaluation found failures, skipping the evaluation call:\n{summary}")
+            evaluation_output = {"satisfactory": False, "thoughts": summary}
+            if can_replan:
+                try:
+                    evaluation_output["new_json_plan"] = replan(agent_prompt, self.json_plan, summary)
+                except Exception as e:
+                    self.logger.warning(f"Re-planning from the pre-evaluation failed, falling back to the evaluation call: {e}")
+                    return None
+            return evaluation_output
+
+        if pre_evaluation.verdict == "pass" and PRE_EVALUATION_ANSWER_MODEL:
+            self.logger.info(f"🟢 Pre-evaluation passed, answering with {PRE_EVALUATION_ANSWER_MODEL}")
+            prompt = FINAL_ANSWER_PROMPT.format(
+                conversation_history=self.chat_history,
+                outputs=json.dumps(final_outputs(self.iteration_records), indent=4, default=str)
+            )
+            return {
+                "satisfactory": True,
+                "thoughts": "Every subtask completed with a non-empty result.",
+                "final_answer": self._answer(prompt)
+            }
+        return None
+
+
+    def _answer(self, prompt: str) -> str:
+        chat_history = [{"role": "user", "content": prompt}]
+        if not self.on_event:
+            return call_model(chat_history=chat_history, model=PRE_EVALUATION_ANSWER_MODEL, call_site="answer").strip()
+        parts = []
+        for delta in call_model_stream(chat_history=chat_history, model=PRE_EVALUATION_ANSWER_MODEL, call_site="answer"):
+            parts.append(delta)
+            self._emit("answer_token", {"text": delta})
+        return "".join(parts).strip()
+
+
+    def _stream_evaluation(self, evaluation_prompt: str) -> str:
+        """Run the evaluation call streamed, forwarding final_answer tokens as they are generated."""
+        extractor = StreamingFieldExtractor("final_answer")
+        parts = []
+        for delta in call_model_stream(
+            chat_history=[{"role": "user", "content": evaluation_prompt}],
+            use_cache=False,
+            call_site="evaluate"
+        ):
+            parts.append(delta)
+            answer_text = extractor.feed(delta)
+            if answer_text:
+                self._emit("answer_token", {"text": answer_text})
+        return "".join(parts).strip()
+
+
+    def _run_subtask(self, subtask: Dict, previous_result) -> Dict:
+        """Execute one subtask's code and call its tool. Runs on an executor thread."""
+        self._emit("subtask_started", {"tool_name": subtask.get("tool_name")})
+        with tracing.span("subtask", tool_name=subtask.get("tool_name"), verified_tool=subtask.get("verified_tool"),
+                          sandboxed=SANDBOX_ENABLED) as subtask_span:
+            started_at = time.monotonic()
+            remaining = time_remaining()
+            timeout = SUBTASK_TIMEOUT if remaining is None else min(SUBTASK_TIMEOUT or remaining, remaining)
+            if remaining is not None and remaining <= 0:
+                # The run is out of time: record the subtask as not run instead of starting it
+                record = dict(limit_fields(SubtaskLimitExceeded("run_deadline", AGENT_RUN_DEADLINE), stopped="not_started"),
+                              has_result=False, result=None, traceback="", printed_output="")
+            elif SANDBOX_ENABLED:
+                record = self._run_subtask_sandboxed(subtask, previous_result, timeout)
+            elif timeout:
+                record = self._run_subtask_inline_bounded(subtask, previous_result, timeout)
+            else:
+                record = self._run_subtask_inline(subtask, previous_result)
+            # The wait for a sandbox worker is reported on its own, not as the subtask's run time
+            record["duration"] = time.monotonic() - started_at - record.get("queue_wait", 0)
+
+            result = record.get("result")
+            subtask_span.set(
+                queue_wait=record.get("queue_wait"),
+                output_bytes=(result.size if isinstance(result, ArtifactRef) else len(str(result))) if record["has_result"] else None,
+                printed_chars=len(record.get("printed_output") or ""),
+                limit_exceeded=record["limit_exceeded"]["kind"] if record.get("limit_exceeded") else None
+            )
+            if record.get("error"):
+                subtask_span.record_error(record["error"])
+        return record
+
+
+    def _run_subtask_sandboxed(self, subtask: Dict, previous_result, timeout: Optional[float] = None) -> Dict:
+        try:
+            response = get_sandbox_pool(self.import_libraries).run(
+                code=subtask["code"],
+                tool_name=subtask["tool_name"],
+                call_with_input=bool(subtask.get("input_from_tool", "")),
+                input_data=previous_result,
+                import_modules=self.import_modules,
+                artifact_scope=self.artifact_scope,
+                timeout=timeout,
+                cpu_limit=SUBTASK_CPU_LIMIT,
+                arguments=subtask.get("arguments")
+            )
+        except SandboxError as e:
+            # The worker crashed (os._exit, a segfault, the OOM killer) or none could start:
+            # a failed subtask like any other, so the run still evaluates and re-plans
+            self.logger.error(f"🔴 Sandbox failed while running '{subtask['tool_name']}': {e}")
+            return {"has_result": False, "result": None, "error": f"SandboxError: {e}",
+                    "traceback": "", "printed_output": ""}
+        # Replay what the subtask logged inside the worker into this agent's logs, and its
+        # model-call metrics into this process's registry
+        for level, message in response.pop("logs", []):
+            self.logger.log(level, message)
+        metrics.replay(response.pop("metrics", []))
+        tracing.adopt(response.pop("spans", []))
+        return response
+
+
+    def _run_subtask_inline_bounded(self, subtask: Dict, previous_result, timeout: float) -> Dict:
+        """
+        Inline run on a thread of its own. Python code is interrupted at the deadline;
+        code blocked in a call that never returns to Python (a socket read, a sleep) cannot
+        be, so its thread is abandoned after the grace period and left to finish alone.
+        """
+        outcome = {}
+        context = contextvars.copy_context()
+
+        def run():
+            outcome["record"] = context.run(self._run_subtask_inline, subtask, previous_result, timeout)
+
+        thread = threading.Thread(target=run, name=f"subtask-{subtask.get('tool_name')}", daemon=True)
+        thread.start()
+        thread.join(timeout + SUBTASK_KILL_GRACE)
+        if "record" in outcome:
+            return outcome["record"]
+        return dict(limit_fields(SubtaskLimitExceeded("wall_clock", timeout), stopped="abandoned"),
+                    has_result=False, result=None, traceback="", printed_output="")
+
+
+    def _run_subtask_inline(self, subtask: Dict, previous_result, timeout: Optional[float] = None) -> Dict:
+        code_string = subtask["code"]
+        temp_namespace = {"logger": self.logger}
+        record = {"has_result": False, "result": None}
+
+        with capture_stdout() as captured_output:
+            try:
+                with thread_limits(timeout), deadline(timeout or 0):
+                    with tracing.span("subtask.exec", code_chars=len(code_string)):
+                        exec(compile_subtask(code_string), temp_namespace)
+
+                    tool_name = subtask["tool_name"]
+                    input_tool_name = subtask.get("input_from_tool", "")
+
+                    # If the tool exists in the temp_namespace, proceed
+                    if tool_name in temp_namespace:
+                        tool_func = temp_namespace[tool_name]
+                        arguments = subtask.get("arguments") or {}  # Set when the subtask references a verified tool
+
+                        # Determine input if specified
+                        with tracing.span("tool.call", tool_name=tool_name):
+                            if input_tool_name:
+                                result = tool_func(resolve(previous_result), **arguments) # Call the function with the previous result in the parameter
+                            else:
+                                result = tool_func(**arguments)
+
+                        record["has_result"] = True
+                        record["result"] = spill(result, self.artifact_scope)
+                    else:
+                        record["missing_function"] = True
+            except SubtaskLimitExceeded as e:
+                record.update(limit_fields(e))
+                record["traceback"] = traceback.format_exc()
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+                record["traceback"] = traceback.format_exc()
+
+        record["printed_output"] = captured_output.getvalue()
+        return record
+
+
+    def _log_subtask(self, index: int, subtask: Dict, record: Dict):
+        """Log a finished subtask. Called in plan order, whatever order the subtasks finished in."""
+        self.iteration_records.append((subtask, record))
+        if record.get("reused"):
+            self.logger.info(f"♻️ Reused result of '{subtask['tool_name']}' from a previous iteration: code and input unchanged")
+
+        printed_output = record["printed_output"]
+        if printed_output and not record.get("reused"):
+            self.logger.info(f"🟡 Printed output from exec: {printed_output}")
+
+        if record.get("error"):
+            self.logger.error(f"🔴 Error in subtask '{subtask['tool_name']}': {record['error']}\n{record['traceback']}")
+
+        limit_exceeded = record.get("limit_exceeded")
+        if limit_exceeded and not record.get("reused"):
+            metrics.AGENT_SUBTASK_LIMITS.inc(kind=limit_exceeded["kind"])
+            self.logger.warning(
+                f"⏱️ Subtask '{subtask['tool_name']}' hit its {limit_exceeded['kind']} limit of {round(limit_exceeded['limit'], 1):g}"
+                f" ({limit_exceeded['stopped'].replace('_', ' ')})"
+                + (f", {len(printed_output)} characters of output kept" if printed_output else "")
+            )
 
+        if record.get("reused"):
+            metrics.AGENT_SUBTASKS.inc(status="reused")
+        else:
+            status = "error" if record.get("error") else "ok"
+            metrics.AGENT_SUBTASKS.inc(status=status)
+            if record.get("duration") is not None:
+                metrics.AGENT_SUBTASK_DURATION.observe(record["duration"], status=status)
+
+        if record["has_result"]:
+            tool_name = subtask["tool_name"]
+            result = record["result"]
+            # An artifact is logged as its handle, size and preview, never in full
+            result_text = str(result)
+            if not record.get("reused"):
+                output_bytes = result.size if isinstance(result, ArtifactRef) else len(result_text.encode("utf-8", "replace"))
+                metrics.AGENT_SUBTASK_OUTPUT_BYTES.observe(output_bytes)
+            self.logger.info(f"🟣 Output from '{tool_name}': {result_text}")
+            print(f"🟣 Output from '{tool_name}': {result_text}")
+
+        self._emit("subtask_finished", {
+            "tool_name": subtask["tool_name"],
+            "reused": bool(record.get("reused")),
+            "duration": record.get("duration"),
+            "queue_wait": record.get("queue_wait"),
+            "error": record.get("error"),
+            "limit_exceeded": record.get("limit_exceeded"),
+            "output_preview": truncate_middle(repr(record["result"]), EVENT_PREVIEW_TOKENS) if record["has_result"] else None
+        })
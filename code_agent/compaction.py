@@ -0,0 +1,72 @@
+import logging
+import os
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+LOG_ENTRY_TOKEN_BUDGET = int(os.getenv("LOG_ENTRY_TOKEN_BUDGET", 500))
+TOOL_OUTPUT_TOKEN_BUDGET = int(os.getenv("TOOL_OUTPUT_TOKEN_BUDGET", 2000))
+
+# Rough characters-per-token ratio for English text and code with OpenAI tokenizers
+CHARS_PER_TOKEN = 4
+
+TOOL_OUTPUT_MARKERS = ("🟣 Output from", "🟡 Printed output from exec")
+
+
+class ErrorLogEntry(str):
+    """
+    A memory log entry made from an error record (a subtask's error and traceback, a
+    logged exception). The type, not the text, marks it: printed output that merely
+    contains "Traceback" or "[ERROR]" is an ordinary entry.
+    """
+
+
+def log_entry(record: logging.LogRecord, text: str) -> str:
+    if record.levelno >= logging.ERROR or record.exc_info:
+        return ErrorLogEntry(text)
+    return text
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_middle(text: str, max_tokens: int) -> str:
+    """
+    Bound text to roughly max_tokens by keeping its head and tail, with a note
+    of how much was dropped. The head gets the larger share: that is where
+    titles, URLs and the beginning of structured outputs are.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    head_chars = max_chars * 2 // 3
+    tail_chars = max_chars - head_chars
+    omitted = len(text) - head_chars - tail_chars
+    return (
+        f"{text[:head_chars]}"
+        f"\n[... {omitted:,} chars (~{estimate_tokens(text[head_chars:len(text) - tail_chars]):,} tokens) omitted "
+        f"of {len(text):,} total ...]\n"
+        f"{text[len(text) - tail_chars:]}"
+    )
+
+
+def compact_log_entry(entry: str, entry_budget: int = LOG_ENTRY_TOKEN_BUDGET,
+                      output_budget: int = TOOL_OUTPUT_TOKEN_BUDGET) -> str:
+    if isinstance(entry, ErrorLogEntry):
+        # Errors are what the evaluator needs most: never cut them
+        return entry
+    if any(marker in entry for marker in TOOL_OUTPUT_MARKERS):
+        return truncate_middle(entry, output_budget)
+    return truncate_middle(entry, entry_budget)
+
+
+def compact_logs(memory_logs: List[str], entry_budget: int = LOG_ENTRY_TOKEN_BUDGET,
+                 output_budget: int = TOOL_OUTPUT_TOKEN_BUDGET) -> str:
+    """Compact the memory logs for the evaluation prompt and return them as one block of text."""
+    compacted = [compact_log_entry(entry, entry_budget, output_budget) for entry in memory_logs]
+    original_tokens = sum(estimate_tokens(entry) for entry in memory_logs)
+    compacted_tokens = sum(estimate_tokens(entry) for entry in compacted)
+    if compacted_tokens < original_tokens:
+        logger.info(f"Compacted {len(memory_logs)} log entries from ~{original_tokens:,} to ~{compacted_tokens:,} tokens")
+    return "\n".join(compacted)
@@ -0,0 +1,182 @@
+import contextvars
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SUBTASK_MAX_WORKERS = int(os.getenv("SUBTASK_MAX_WORKERS", 4))
+
+
+def build_dependencies(subtasks: List[Dict]) -> List[Optional[int]]:
+    """
+    Return, for every subtask, the index of the subtask whose output it consumes
+    (through input_from_tool), or None when it has no upstream. A subtask can only
+    depend on one listed before it, which keeps the graph acyclic and matches the
+    sequential semantics: a reference to a later or unknown tool gets no input.
+    """
+    latest_by_name = {}
+    dependencies = []
+    for index, subtask in enumerate(subtasks):
+        input_tool_name = subtask.get("input_from_tool", "")
+        dependencies.append(latest_by_name.get(input_tool_name) if input_tool_name else None)
+        latest_by_name[subtask.get("tool_name")] = index
+    return dependencies
+
+
+def subtask_key(subtask: Dict, upstream_key: str = "") -> str:
+    """
+    Content hash of a subtask: its own code, arguments and wiring plus the key of the
+    subtask it reads from. Any change upstream therefore changes the key of every dependent.
+    """
+    payload = json.dumps(
+        [subtask.get("tool_name"), subtask.get("input_from_tool", ""), subtask.get("code", ""),
+         subtask.get("arguments") or {}, upstream_key],
+        separators=(",", ":"), sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+_END_OF_PLAN = object()
+
+
+def execute_plan(
+    subtasks: Iterable[Dict],
+    run_subtask: Callable[[Dict, object], Dict],
+    on_complete: Callable[[int, Dict, Dict], None],
+    max_workers: int = SUBTASK_MAX_WORKERS,
+    memo: Optional[Dict[str, Dict]] = None
+) -> Dict:
+    """
+    Run the subtasks of a plan as a DAG on a bounded thread pool.
+
+    run_subtask(subtask, upstream_output) executes one subtask and returns a record
+    with at least "has_result" and "result". on_complete(index, subtask, record) is
+    called from the calling thread strictly in plan order, so logs stay deterministic
+    no matter which branch finishes first. Returns the results keyed by tool_name.
+
+    subtasks may also be an iterator that is still producing them, such as a plan being
+    streamed from the model: it is read on a separate thread and each subtask starts as
+    soon as it and its upstream are available. Dependencies only point backwards, so a
+    subtask never waits for one that has not arrived yet.
+
+    When a memo dict is given, successful records are stored in it by subtask_key and
+    a subtask whose key is already there is not run again: its record is reused with
+    "reused" set, so a revised plan only re-executes what changed and its dependents.
+    """
+    streamed = not isinstance(subtasks, (list, tuple))
+    source = iter(subtasks)
+    subtasks = []
+    dependencies = []
+    children = {}
+    latest_by_name = {}
+
+    records = {}
+    errors = {}
+    results = {}
+    keys = {}
+    reported = [0]
+
+    def upstream_output(index):
+        parent = dependencies[index]
+        if parent is None:
+            return {}
+        record = records.get(parent)
+        return record["result"] if record and record.get("has_result") else {}
+
+    def upstream_memoized(index):
+        # A record computed from a failed upstream must not be reused once that upstream is fixed
+        parent = dependencies[index]
+        return parent is None or keys[parent] in memo
+
+    def report_completed():
+        while reported[0] in records:
+            index = reported[0]
+            record = records[index]
+            subtask = subtasks[index]
+            if record.get("has_result"):
+                results[subtask["tool_name"]] = record["result"]
+            on_complete(index, subtask, record)
+            reported[0] += 1
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="subtask") as pool, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="plan-reader") as reader_pool:
+        running = {}
+
+        def start(index):
+            parent = dependencies[index]
+            keys[index] = subtask_key(subtasks[index], keys[parent] if parent is not None else "")
+            if memo is not None and keys[index] in memo:
+                records[index] = dict(memo[keys[index]], key=keys[index], reused=True)
+                for child in children[index]:
+                    start(child)
+                return
+            context = contextvars.copy_context()
+            future = pool.submit(context.run, run_subtask, subtasks[index], upstream_output(index))
+            running[future] = index
+
+        def add(subtask):
+            # Same wiring as build_dependencies, one subtask at a time
+            index = len(subtasks)
+            input_tool_name = subtask.get("input_from_tool", "")
+            parent = latest_by_name.get(input_tool_name) if input_tool_name else None
+            subtasks.append(subtask)
+            dependencies.append(parent)
+            children[index] = []
+            latest_by_name[subtask.get("tool_name")] = index
+            if parent is not None:
+                children[parent].append(index)
+            if errors:
+                return
+            if parent is None or parent in records:
+                start(index)
+
+        def read_next():
+            return reader_pool.submit(contextvars.copy_context().run, next, source, _END_OF_PLAN)
+
+        reader = None
+        if streamed:
+            reader = read_next()
+        else:
+            for subtask in source:
+                add(subtask)
+        report_completed()
+
+        while running or reader:
+            done, _ = wait(list(running) + ([reader] if reader else []), return_when=FIRST_COMPLETED)
+            if reader in done:
+                try:
+                    subtask = reader.result()
+                except Exception as e:
+                    # The plan stream broke: let what is running finish, start nothing more
+                    errors[len(subtasks)] = e
+                    subtask = _END_OF_PLAN
+                reader = None if subtask is _END_OF_PLAN else read_next()
+                if subtask is not _END_OF_PLAN:
+                    add(subtask)
+            for future in done:
+                if future not in running:
+                    continue
+                index = running.pop(future)
+                try:
+                    record = future.result()
+                except Exception as e:
+                    errors[index] = e
+                    continue
+                record["key"] = keys[index]
+                records[index] = record
+                if memo is not None and not record.get("error") and upstream_memoized(index):
+                    memo[keys[index]] = record
+                if not errors:
+                    for child in children[index]:
+                        start(child)
+
+            report_completed()
+
+    if errors:
+        raise errors[min(errors)]
+
+    return results
@@ -0,0 +1,135 @@
+import ctypes
+import logging
+import math
+import os
+import signal
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Wall-clock seconds a subtask may run, cut to what is left of the run's deadline
+SUBTASK_TIMEOUT = float(os.getenv("SUBTASK_TIMEOUT", 60))
+# CPU seconds and memory a subtask may use; enforced in sandbox workers only
+SUBTASK_CPU_LIMIT = float(os.getenv("SUBTASK_CPU_LIMIT", 30))
+SUBTASK_MEMORY_LIMIT_MB = int(os.getenv("SUBTASK_MEMORY_LIMIT_MB", 2048))
+# Seconds a subtask gets past its deadline to stop by itself before its sandbox worker is
+# killed, or its inline thread abandoned
+SUBTASK_KILL_GRACE = float(os.getenv("SUBTASK_KILL_GRACE", 2))
+
+LIMIT_UNITS = {"wall_clock": "s", "cpu": "s", "memory": " MB", "run_deadline": "s"}
+
+# Timeout of the inline subtask running on each executor thread, read by _InlineTimeout
+_thread_state = threading.local()
+
+
+class SubtaskLimitExceeded(BaseException):
+    """
+    Raised inside a subtask that ran out of wall-clock time or CPU. A BaseException, like
+    KeyboardInterrupt, so the generated code's own `except Exception` cannot swallow it.
+    """
+
+    def __init__(self, kind: str, limit: float):
+        super().__init__(f"subtask exceeded its {kind.replace('_', '-')} limit of {round(limit, 1):g}{LIMIT_UNITS.get(kind, '')}")
+        self.kind = kind
+        self.limit = limit
+
+
+def limit_fields(error: SubtaskLimitExceeded, stopped: str = "interrupted") -> Dict:
+    """
+    Record fields describing a limit hit, for the logs, the evaluator and the metrics.
+    stopped tells how: "interrupted" where the code was (output so far kept), "killed"
+    with its sandbox worker, "abandoned" on its inline thread, or "not_started".
+    """
+    return {
+        "error": f"SubtaskLimitExceeded: {error}",
+        "limit_exceeded": {"kind": error.kind, "limit": error.limit, "stopped": stopped}
+    }
+
+
+def _raise_limit(kind: str, limit: float):
+    def handler(signum, frame):
+        raise SubtaskLimitExceeded(kind, limit)
+    return handler
+
+
+@contextmanager
+def process_limits(timeout: Optional[float], cpu_limit: Optional[float]):
+    """
+    Limits of one job in a sandbox worker's main thread: SIGALRM after `timeout` seconds
+    and SIGXCPU after `cpu_limit` more CPU seconds both raise SubtaskLimitExceeded where
+    the code is, so the job ends with its output so far instead of being killed.
+    """
+    import resource
+
+    previous_cpu = resource.getrlimit(resource.RLIMIT_CPU)
+    if timeout and timeout > 0:
+        signal.signal(signal.SIGALRM, _raise_limit("wall_clock", timeout))
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    if cpu_limit and cpu_limit > 0:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = math.ceil(usage.ru_utime + usage.ru_stime + cpu_limit)
+        if previous_cpu[1] == resource.RLIM_INFINITY or soft < previous_cpu[1]:
+            signal.signal(signal.SIGXCPU, _raise_limit("cpu", cpu_limit))
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, previous_cpu[1]))
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        resource.setrlimit(resource.RLIMIT_CPU, previous_cpu)
+
+
+def set_memory_limit(limit_mb: int):
+    """Cap the data segment of this process (heap and anonymous mappings), so a runaway allocation raises MemoryError."""
+    if not limit_mb or limit_mb <= 0:
+        return
+    try:
+        import resource
+        limit = limit_mb * 1024 * 1024
+        hard = resource.getrlimit(resource.RLIMIT_DATA)[1]
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, hard))
+    except (ImportError, ValueError, OSError) as e:
+        logger.warning(f"Could not set a memory limit of {limit_mb} MB: {e}")
+
+
+@contextmanager
+def thread_limits(timeout: Optional[float]):
+    """
+    Wall-clock limit of a subtask run inline on an executor thread. Threads cannot be
+    killed: when the time is up SubtaskLimitExceeded is raised asynchronously in the
+    thread, which takes effect at its next Python instruction.
+    """
+    if not timeout or timeout <= 0:
+        yield
+        return
+    thread_id = threading.get_ident()
+    lock = threading.Lock()
+    running = [True]
+
+    def interrupt():
+        with lock:
+            if running[0]:
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                    ctypes.c_ulong(thread_id), ctypes.py_object(_InlineTimeout)
+                )
+
+    _thread_state.timeout = timeout
+    timer = threading.Timer(timeout, interrupt)
+    timer.daemon = True
+    timer.start()
+    try:
+        yield
+    finally:
+        with lock:
+            running[0] = False
+        timer.cancel()
+
+
+class _InlineTimeout(SubtaskLimitExceeded):
+    """What PyThreadState_SetAsyncExc raises: it instantiates the class without arguments, in the interrupted thread."""
+
+    def __init__(self):
+        super().__init__("wall_clock", getattr(_thread_state, "timeout", 0.0))
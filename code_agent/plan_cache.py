@@ -0,0 +1,407 @@
+import copy
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import metrics
+from storage.redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "true").lower() == "true"
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", 1000))
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", 7 * 86400))
+# Candidates must reach this TF-IDF cosine before the token-level comparison runs
+PLAN_CACHE_MIN_SIMILARITY = float(os.getenv("PLAN_CACHE_MIN_SIMILARITY", 0.3))
+# At most this many tokens may differ between a cached task and the new one
+PLAN_CACHE_MAX_SLOT_TOKENS = int(os.getenv("PLAN_CACHE_MAX_SLOT_TOKENS", 4))
+PLAN_CACHE_REBIND_MODEL = os.getenv("PLAN_CACHE_REBIND_MODEL", "gpt-4o-mini")
+PLAN_CACHE_REDIS_PREFIX = os.getenv("PLAN_CACHE_REDIS_PREFIX", "plan-cache:")
+PLAN_CACHE_SYNC_INTERVAL = float(os.getenv("PLAN_CACHE_SYNC_INTERVAL", 60))
+
+HASH_DIMENSIONS = 2048
+CANDIDATES = 5
+MAX_SLOTS = 2
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def task_text(chat_history: List[Dict]) -> str:
+    """The text the planner solves: every user message of the conversation."""
+    parts = []
+    for message in chat_history or []:
+        content = message.get("content", "")
+        if message.get("role") == "user" and isinstance(content, str):
+            parts.append(content.strip())
+    return "\n".join(parts)
+
+
+def catalog_fingerprint(import_libraries: List[Dict]) -> str:
+    """Identifies the library catalog and planning prompt a plan was generated against."""
+    from .prompts import CODE_SYSTEM_PROMPT
+    payload = json.dumps(import_libraries, sort_keys=True, default=str) + CODE_SYSTEM_PROMPT
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _tokens(text: str) -> List[re.Match]:
+    return list(TOKEN_PATTERN.finditer(text))
+
+
+def _features(words: List[str]) -> Dict[int, int]:
+    """Hashed unigram and bigram counts."""
+    counts = {}
+    for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        column = zlib.crc32(feature.encode("utf-8")) % HASH_DIMENSIONS
+        counts[column] = counts.get(column, 0) + 1
+    return counts
+
+
+def find_slots(old_task: str, new_task: str, max_slot_tokens: int = PLAN_CACHE_MAX_SLOT_TOKENS) -> Optional[List[Tuple[str, str]]]:
+    """
+    Compare two tasks token by token. When they share the same skeleton and differ only
+    in up to MAX_SLOTS short replaced spans, return those spans as (old text, new text)
+    pairs in their original spelling; otherwise return None.
+    """
+    old_tokens, new_tokens = _tokens(old_task), _tokens(new_task)
+    old_words = [token.group().lower() for token in old_tokens]
+    new_words = [token.group().lower() for token in new_tokens]
+    if not old_words or not new_words:
+        return None
+
+    slots = []
+    differing = 0
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_words, new_words, autojunk=False).get_opcodes():
+        if tag == "equal":
+            continue
+        if tag != "replace":
+            return None
+        differing += max(i2 - i1, j2 - j1)
+        old_span = old_task[old_tokens[i1].start():old_tokens[i2 - 1].end()]
+        new_span = new_task[new_tokens[j1].start():new_tokens[j2 - 1].end()]
+        slots.append((old_span, new_span))
+
+    shared = len(new_words) - differing
+    if len(slots) > MAX_SLOTS or differing > max_slot_tokens or shared < differing:
+        return None
+    return slots
+
+
+def _root_subtasks(plan: Dict) -> List[Dict]:
+    return [subtask for subtask in plan.get("subtasks", []) if not subtask.get("input_from_tool")]
+
+
+def template_plan(plan: Dict, slots: List[Tuple[str, str]]) -> Optional[Dict]:
+    """
+    Rebind a cached plan by substituting each slot's old text with the new text. Every
+    slot must appear literally in the code of a tool that takes no input, the place
+    where the planner hard-codes the task's parameters; otherwise return None. All slots
+    are substituted in one pass, so swapped values ("Rome to Paris" for "Paris to Rome")
+    are not rewritten twice.
+    """
+    replacements = {}
+    for old, new in slots:
+        if replacements.setdefault(old.lower(), new) != new:
+            return None  # The same text would have to become two different values
+    root_code = "\n".join(subtask.get("code", "") for subtask in _root_subtasks(plan))
+    if not all(re.search(r"\b" + re.escape(old) + r"\b", root_code, re.IGNORECASE) for old in replacements):
+        return None
+
+    # Longer values first, so one slot that contains another is matched whole
+    alternatives = sorted(replacements, key=len, reverse=True)
+    pattern = re.compile(r"\b(?:" + "|".join(re.escape(old) for old in alternatives) + r")\b", re.IGNORECASE)
+
+    def substitute(text):
+        return pattern.sub(lambda match: replacements[match.group().lower()], text)
+
+    rebound = copy.deepcopy(plan)
+    for key in ("main_task", "main_task_thought"):
+        if isinstance(rebound.get(key), str):
+            rebound[key] = substitute(rebound[key])
+    for subtask in rebound.get("subtasks", []):
+        for key in ("code", "description", "subtask", "thought"):
+            if isinstance(subtask.get(key), str):
+                subtask[key] = substitute(subtask[key])
+    return rebound
+
+
+def rebind_plan_with_model(plan: Dict, old_task: str, new_task: str, model: str = PLAN_CACHE_REBIND_MODEL) -> Optional[Dict]:
+    """Ask a small model to rewrite the parameters of the plan's input-less tools for the new task."""
+    from models.models import call_model
+    from .prompts import PLAN_REBIND_PROMPT
+    from .utils import sanitize_gpt_response
+
+    roots = _root_subtasks(plan)
+    if not roots:
+        return None
+    prompt = PLAN_REBIND_PROMPT.format(
+        old_task=old_task,
+        new_task=new_task,
+        tools=json.dumps([{"tool_name": s["tool_name"], "code": s.get("code", "")} for s in roots], indent=4)
+    )
+    try:
+        answer = call_model(
+            chat_history=[{"role": "user", "content": prompt}],
+            model=model,
+            call_site="plan-rebind",
+            expect_json=True
+        )
+        rewritten = {tool["tool_name"]: tool["code"] for tool in json.loads(sanitize_gpt_response(answer))}
+        if set(rewritten) != {subtask["tool_name"] for subtask in roots}:
+            return None
+        for code in rewritten.values():
+            compile(code, "<rebound plan>", "exec")
+    except Exception as e:
+        logger.warning(f"Plan rebinding failed: {e}")
+        return None
+
+    rebound = copy.deepcopy(plan)
+    for subtask in rebound.get("subtasks", []):
+        if subtask["tool_name"] in rewritten and not subtask.get("input_from_tool"):
+            subtask["code"] = rewritten[subtask["tool_name"]]
+    return rebound
+
+
+class PlanMatch:
+    def __init__(self, entry_id: str, plan: Dict, mode: str, similarity: float, cached_task: str):
+        self.entry_id = entry_id
+        self.plan = plan
+        self.mode = mode  # exact, templated or rebound
+        self.similarity = similarity
+        self.cached_task = cached_task
+
+
+class PlanCache:
+    """
+    Store of plans that passed evaluation, searched by task similarity so that
+    near-identical tasks skip the planning call. Tasks are indexed as hashed TF-IDF
+    vectors; the nearest candidates are then compared token by token, and a match
+    that differs only in a few parameter tokens has those parameters rebound, by
+    substitution when the old values appear in the plan's code and otherwise by a
+    small model call. Entries are keyed by library catalog, so requests with different
+    libraries keep their own plans side by side; they are evicted LRU and by TTL, and
+    shared through Redis (one hash per catalog) when it is reachable.
+    """
+
+    def __init__(self, max_entries: int = PLAN_CACHE_MAX_ENTRIES, ttl: float = PLAN_CACHE_TTL,
+                 min_similarity: float = PLAN_CACHE_MIN_SIMILARITY, redis_prefix: str = PLAN_CACHE_REDIS_PREFIX,
+                 sync_interval: float = PLAN_CACHE_SYNC_INTERVAL, rebind_model: Optional[str] = PLAN_CACHE_REBIND_MODEL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_similarity = min_similarity
+        self.redis_prefix = redis_prefix
+        self.sync_interval = sync_interval
+        self.rebind_model = rebind_model
+        self._entries = OrderedDict()  # (catalog, entry id) -> {"task", "plan", "created_at", "features"}
+        self._indexes = {}  # catalog -> (matrix, entry ids, idf), rebuilt after the catalog's entries change
+        self._synced_at = {}  # catalog -> monotonic time of its last Redis sync
+        self._lock = threading.Lock()
+        self._stats = {
+            "exact": 0,
+            "templated": 0,
+            "rebound": 0,
+            "misses": 0,
+            "rebind_failed": 0,
+            "stores": 0,
+            "evictions": 0,
+            "invalidations": 0
+        }
+
+    def lookup(self, task: str, catalog: str) -> Optional[PlanMatch]:
+        """Return a plan for task rebound from the closest cached task, or None."""
+        self._sync_from_redis(catalog)
+        rebind_failed = False
+        for entry_id, similarity in self._candidates(task, catalog):
+            with self._lock:
+                entry = self._entries.get((catalog, entry_id))
+            if entry is None:
+                continue
+            slots = find_slots(entry["task"], task)
+            if slots is None:
+                continue
+
+            mode, plan = "exact", copy.deepcopy(entry["plan"])
+            if slots:
+                mode, plan = "templated", template_plan(entry["plan"], slots)
+                if plan is None and self.rebind_model and not rebind_failed:
+                    mode, plan = "rebound", rebind_plan_with_model(entry["plan"], entry["task"], task, self.rebind_model)
+                    rebind_failed = plan is None
+            if plan is None:
+                continue
+
+            with self._lock:
+                if (catalog, entry_id) in self._entries:
+                    self._entries.move_to_end((catalog, entry_id))
+                self._stats[mode] += 1
+            metrics.PLAN_CACHE_LOOKUPS.inc(result=mode)
+            logger.info(f"Plan cache {mode} hit (similarity {similarity:.2f}) from task: {entry['task'][:80]!r}")
+            return PlanMatch(entry_id, plan, mode, similarity, entry["task"])
+
+        result = "rebind_failed" if rebind_failed else "misses"
+        with self._lock:
+            self._stats[result] += 1
+        metrics.PLAN_CACHE_LOOKUPS.inc(result="rebind_failed" if rebind_failed else "miss")
+        return None
+
+    def store(self, task: str, plan: Dict, catalog: str):
+        """Remember a plan that received a satisfactory evaluation for task."""
+        if not task.strip() or not isinstance(plan, dict) or not plan.get("subtasks"):
+            return
+        entry_id = hashlib.sha256(" ".join(task.lower().split()).encode("utf-8")).hexdigest()[:24]
+        entry = {"task": task, "plan": plan, "created_at": time.time()}
+        self._insert(catalog, entry_id, entry)
+        with self._lock:
+            self._stats["stores"] += 1
+        self._redis_call("hset", catalog, entry_id, json.dumps(entry))
+
+    def invalidate(self, entry_id: str, catalog: str):
+        """Drop a cached plan that failed its evaluation when reused."""
+        with self._lock:
+            removed = self._entries.pop((catalog, entry_id), None) is not None
+            if removed:
+                self._indexes.pop(catalog, None)
+                self._stats["invalidations"] += 1
+        if removed:
+            metrics.PLAN_CACHE_REMOVALS.inc(reason="invalidated")
+        self._redis_call("hdel", catalog, entry_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._indexes.clear()
+            self._synced_at.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        hits = stats["exact"] + stats["templated"] + stats["rebound"]
+        lookups = hits + stats["misses"] + stats["rebind_failed"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+    def _insert(self, catalog: str, entry_id: str, entry: Dict):
+        entry["features"] = _features([token.group().lower() for token in _tokens(entry["task"])])
+        with self._lock:
+            self._entries[(catalog, entry_id)] = entry
+            self._entries.move_to_end((catalog, entry_id))
+            self._indexes.pop(catalog, None)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+                self._indexes.pop(evicted[-1][0], None)
+                self._stats["evictions"] += 1
+        for evicted_catalog, evicted_id in evicted:
+            metrics.PLAN_CACHE_REMOVALS.inc(reason="capacity")
+            self._redis_call("hdel", evicted_catalog, evicted_id)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if entry["created_at"] < cutoff]
+            for key in expired:
+                del self._entries[key]
+                self._indexes.pop(key[0], None)
+                self._stats["evictions"] += 1
+        if expired:
+            metrics.PLAN_CACHE_REMOVALS.inc(len(expired), reason="expired")
+
+    def _candidates(self, task: str, catalog: str) -> List[Tuple[str, float]]:
+        """Cached entries of the catalog most similar to task by TF-IDF cosine, best first."""
+        self._expire()
+        query = _features([token.group().lower() for token in _tokens(task)])
+        if not query:
+            return []
+        with self._lock:
+            index = self._indexes.get(catalog)
+            if index is None:
+                index = self._indexes[catalog] = self._build_index(catalog)
+            matrix, ids, idf = index
+        if not ids:
+            return []
+
+        vector = np.zeros(HASH_DIMENSIONS, dtype=np.float32)
+        for column, count in query.items():
+            vector[column] = 1 + math.log(count)
+        vector *= idf
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return []
+        scores = matrix @ (vector / norm)
+        best = np.argsort(-scores)[:CANDIDATES]
+        return [(ids[index], float(scores[index])) for index in best if scores[index] >= self.min_similarity]
+
+    def _build_index(self, catalog: str):
+        # Called with the lock held
+        ids = [entry_id for entry_catalog, entry_id in self._entries if entry_catalog == catalog]
+        counts = np.zeros((len(ids), HASH_DIMENSIONS), dtype=np.float32)
+        for row, entry_id in enumerate(ids):
+            for column, count in self._entries[(catalog, entry_id)]["features"].items():
+                counts[row, column] = 1 + math.log(count)
+        document_frequency = (counts > 0).sum(axis=0)
+        idf = (np.log((1 + len(ids)) / (1 + document_frequency)) + 1).astype(np.float32)
+        weights = counts * idf
+        norms = np.linalg.norm(weights, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return weights / norms, ids, idf
+
+    def _redis_key(self, catalog: str) -> str:
+        return f"{self.redis_prefix}{catalog}"
+
+    def _redis_call(self, operation: str, catalog: str, *args):
+        client = get_redis_client()
+        if client is None:
+            return
+        try:
+            getattr(client, operation)(self._redis_key(catalog), *args)
+            if operation == "hset":
+                client.expire(self._redis_key(catalog), int(self.ttl))
+        except Exception as e:
+            logger.warning(f"Plan cache Redis {operation} failed: {e}")
+
+    def _sync_from_redis(self, catalog: str):
+        """Adopt the catalog's shared set of plans, so plans learnt by other processes are reused here."""
+        now = time.monotonic()
+        with self._lock:
+            synced_at = self._synced_at.get(catalog)
+            if synced_at is not None and now - synced_at < self.sync_interval:
+                return
+            self._synced_at[catalog] = now
+        client = get_redis_client()
+        if client is None:
+            return
+        try:
+            shared = client.hgetall(self._redis_key(catalog))
+        except Exception as e:
+            logger.warning(f"Plan cache Redis sync failed: {e}")
+            return
+
+        entries = {}
+        for entry_id, value in shared.items():
+            try:
+                entry = json.loads(value)
+            except ValueError:
+                continue
+            entries[entry_id.decode("utf-8") if isinstance(entry_id, bytes) else entry_id] = entry
+        with self._lock:
+            # Redis is authoritative: entries invalidated or evicted elsewhere disappear here too
+            stale = [key for key in self._entries if key[0] == catalog and key[1] not in entries]
+            for key in stale:
+                del self._entries[key]
+            self._indexes.pop(catalog, None)
+            new_ids = [entry_id for entry_id in sorted(entries, key=lambda i: entries[i]["created_at"])
+                       if (catalog, entry_id) not in self._entries]
+        for entry_id in new_ids:
+            self._insert(catalog, entry_id, entries[entry_id])
+
+
+plan_cache = PlanCache()
@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+import re
+from typing import Dict, List, Tuple
+
+from .artifacts import ArtifactRef
+from .compaction import CHARS_PER_TOKEN, TOOL_OUTPUT_TOKEN_BUDGET, truncate_middle
+
+logger = logging.getLogger(__name__)
+
+PRE_EVALUATION_ENABLED = os.getenv("PRE_EVALUATION_ENABLED", "true").lower() == "true"
+# Model that writes the final answer when every subtask produced output; empty keeps the evaluation call
+PRE_EVALUATION_ANSWER_MODEL = os.getenv("PRE_EVALUATION_ANSWER_MODEL", "")
+
+FINDING_TOKENS = 150
+SUSPICIOUS_OUTPUT = re.compile(r"\b(error|exception|failed|traceback)\b", re.IGNORECASE)
+
+
+def is_empty(value) -> bool:
+    """An empty output; None is not one, it is what a step that only acts (send, write) returns."""
+    if isinstance(value, (str, bytes)):
+        return not value.strip()
+    if isinstance(value, (dict, list, tuple, set)):
+        return not value
+    return False
+
+
+def _tail(text: str, lines: int = 3) -> str:
+    return truncate_middle("\n".join(text.strip().splitlines()[-lines:]), FINDING_TOKENS)
+
+
+class PreEvaluation:
+    """
+    Verdict of the rules over one iteration's subtask records: "fail" when a subtask
+    certainly went wrong, "pass" when every subtask returned a non-empty result without
+    any sign of trouble, "uncertain" when the output needs a model to judge it.
+    """
+
+    def __init__(self, findings: List[str], warnings: List[str]):
+        self.findings = findings
+        self.warnings = warnings
+        self.verdict = "fail" if findings else ("uncertain" if warnings else "pass")
+
+    def summary(self) -> str:
+        return "\n".join(f"- {finding}" for finding in self.findings + self.warnings)
+
+
+def pre_evaluate(records: List[Tuple[Dict, Dict]]) -> PreEvaluation:
+    """Apply the rules to (subtask, record) pairs, in plan order."""
+    findings, warnings = [], []
+    for subtask, record in records:
+        tool_name = subtask.get("tool_name")
+        printed_output = record.get("printed_output") or ""
+        result = record.get("result")
+
+        if record.get("error"):
+            finding = f"Subtask '{tool_name}' raised {record['error']}"
+            if record.get("traceback"):
+                finding += f"\n  {_tail(record['traceback'])}"
+            findings.append(finding)
+        elif record.get("missing_function"):
+            findings.append(f"Subtask '{tool_name}': its code does not define a function named '{tool_name}'")
+        elif not record.get("has_result"):
+            finding = f"Subtask '{tool_name}' produced no result"
+            if printed_output.strip():
+                finding += f", after printing: {_tail(printed_output)}"
+            findings.append(finding)
+        elif result is None:
+            # Right for a step that only acts, a miss for one that should produce data: the model judges
+            warnings.append(f"Subtask '{tool_name}' returned None")
+        elif is_empty(result):
+            finding = f"Subtask '{tool_name}' returned an empty result ({result!r})"
+            if printed_output.strip():
+                finding += f", after printing: {_tail(printed_output)}"
+            findings.append(finding)
+        elif isinstance(result, dict) and result.get("error"):
+            findings.append(f"Subtask '{tool_name}' returned an error: {truncate_middle(str(result['error']), FINDING_TOKENS)}")
+        elif SUSPICIOUS_OUTPUT.search(printed_output):
+            warnings.append(f"Subtask '{tool_name}' printed: {_tail(printed_output)}")
+    return PreEvaluation(findings, warnings)
+
+
+def final_outputs(records: List[Tuple[Dict, Dict]]) -> Dict:
+    """Results of the subtasks no other subtask consumes: what the answer has to relay."""
+    consumed = {subtask.get("input_from_tool") for subtask, _ in records}
+    outputs = {subtask["tool_name"]: record.get("result") for subtask, record in records if subtask["tool_name"] not in consumed}
+    budget = max(TOOL_OUTPUT_TOKEN_BUDGET // max(len(outputs), 1), 200)
+    return {tool_name: truncate_middle(_text(result, budget), budget) for tool_name, result in outputs.items()}
+
+
+def _text(result, budget: int) -> str:
+    # Only the part of an artifact that fits the budget is read from the store
+    if isinstance(result, ArtifactRef):
+        return result.excerpt(budget * CHARS_PER_TOKEN)
+    return str(result)
+
+
+def replan(agent_prompt: str, json_plan: Dict, failures: str) -> Dict:
+    """Ask for a corrected plan from the failures alone, without the logs an evaluation call carries."""
+    from models.models import call_model
+    from .prompts import REPLAN_PROMPT
+    from .utils import sanitize_gpt_response
+
+    prompt = REPLAN_PROMPT.format(
+        original_prompt=agent_prompt,
+        original_json_plan=json.dumps(json_plan, indent=4),
+        failures=failures
+    )
+    answer = call_model(chat_history=[{"role": "user", "content": prompt}], call_site="replan", expect_json=True)
+    return json.loads(sanitize_gpt_response(answer))
@@ -260,6 +260,88 @@ Logs:
 """
 
 
+REPLAN_PROMPT = """
+The json plan below was executed and automatic checks found that it failed. Reformulate the plan to solve the problem, fixing the causes of these failures:
+
+{failures}
+
+Follow exactly the rules and the output format of the original prompt, and return only the new json plan.
+
+Original prompt:
+{original_prompt}
+
+Original json plan:
+{original_json_plan}
+"""
+
+
+SUBTASK_REPAIR_PROMPT = """
+The subtask below belongs to a plan of Python tool functions, but static checks found problems in it before it ran:
+
+{problems}
+
+Tool names of the subtasks listed before it: {earlier_tools}
+
+Fix these problems with the smallest change to the code, keeping its purpose, its imports and its tool_name. The code must define a top-level function named exactly like tool_name; that function takes the output of the tool named in input_from_tool as its only argument, or no argument when input_from_tool is empty. input_from_tool may only name an earlier tool, or be empty.
+Return only the corrected subtask as a JSON object with the same keys.
+
+Subtask:
+{subtask}
+"""
+
+
+FINAL_ANSWER_PROMPT = """
+An AI code agent solved the task in the conversation below by running Python tools. Every tool completed successfully. Write the final answer for the user from the outputs of the last tools, without mentioning the tools themselves.
+The final answer must be raw HTML and text content to be processed by Marked.js and DOMPurify. Return only the answer.
+
+Conversation:
+{conversation_history}
+
+Tool outputs:
+{outputs}
+"""
+
+
+PLAN_REBIND_PROMPT = """
+A plan of Python tool functions was written for a previous task. A new task differs from it only in its parameters.
+Rewrite the code of the tools below so that they solve the new task: change only the hard-coded parameters (names, places, dates, quantities, queries, ...) and keep everything else, including function names, signatures and returned keys, exactly as it is.
+
+Previous task:
+{old_task}
+
+New task:
+{new_task}
+
+Tools:
+{tools}
+
+Return only valid JSON, a list with one object per tool in the same order:
+[
+    {{"tool_name": "...", "code": "def ..."}}
+]
+"""
+
+
+VERIFIED_TOOLS_PROMPT = """
+
+### Verified Tools
+
+The tool functions below were already written and ran successfully in earlier tasks. When one of them does exactly what a subtask needs, reference it instead of writing its code: set "verified_tool" to its id, keep its name as tool_name, omit "code", and put in "arguments" only the parameters whose values must differ from the defaults in its signature. A tool that takes the previous tool's output still receives it through input_from_tool, as usual. Write new code only for the subtasks no verified tool covers.
+
+{verified_tools}
+
+A subtask that references a verified tool looks like this:
+
+{{
+    "tool_name": "search_amazon",
+    "input_from_tool": "",
+    "description": "...",
+    "verified_tool": "search_amazon#1a2b3c4d",
+    "arguments": {{"query": "headphones"}}
+}}
+"""
+
+
 DEFAULT_IMPORT_LIBRARIES = [
             {
                 "lib_names": ["models"],
@@ -269,67 +351,48 @@ DEFAULT_IMPORT_LIBRARIES = [
                     from models.models import call_model
                     prompt = f"<here you describe how to elaborate the previous output>: <previous_output>"
                     llm_response = call_model(
-                        chat_history=[{"role": "user", "content": prompt}],
-                        model="o1-mini"
+                        chat_history=[{"role": "user", "content": prompt}]
                     )
                     return {"elaborated_output": llm_response}
                 """
             },
             {
-                "lib_names": ["duckduckgo_search"],
-                "instructions": "A library to scrape the web. Never use the regex or other specific method to extract the data, always output the whole page. The data must be extracted or summarized from the page with models lib.",
+                "lib_names": ["duckduckgo_search", "tools.web"],
+                "instructions": "A library to search the web. It returns the readable main text of every result page, already stripped of markup and boilerplate. Never use the regex or other specific method to extract the data, always output the whole text. The data must be extracted or summarized from the text with models lib.",
                 "use_exaclty_code_example": True,
                 "code_example": """
                     def search_web(query, max_results=5):
                         
-                        #Perform a DuckDuckGo search for the specified query, then fetch the entire HTML
-                        #of each result, capped at 300,000 characters. Returns one long string containing
-                        #the full HTML of all results.
+                        #Perform a DuckDuckGo search for the specified query, then fetch all the result
+                        #pages concurrently (pooled connections, cached on disk) and return one long string
+                        #with the main text of each page.
                         
                         from duckduckgo_search import DDGS
-                        import requests
-
-                        def sanitize_text(text):
-                            # Replace backslashes and quotes with escaped versions
-                            return text.replace('\\', '\\\\').replace('\\"', '\\\\"').replace("'", "\\'")
+                        from tools.web import fetch_pages
 
                         ddgs = DDGS()
                         try:
                             # Use DuckDuckGo to get 'max_results' search results
-                            results = ddgs.text(query, max_results=max_results)
-                            full_html_output = []
-
-                            # For each result, fetch the entire page with requests
-                            for result in results:
-                                href = result.get("href", "")
-                                if not href:
-                                    # Skip if there's no link
-                                    continue
+                            results = [result for result in ddgs.text(query, max_results=max_results) if result.get("href")]
 
-                                try:
-                                    resp = requests.get(href, timeout=10)
-                                    resp.raise_for_status()
-
-                                    # Limit the page HTML to 100,000 chars
-                                    page_html_limited = resp.text[:100000]
-                                    # Sanitize it to avoid JSON-breaking characters
-                                    page_html_sanitized = sanitize_text(page_html_limited)
-
-                                    # Optionally, prepend some metadata
-                                    title_sanitized = sanitize_text(result.get("title", ""))
-                                    full_html_output.append(
-                                        f"=== START OF ARTICLE ===\n"
-                                        f"Title: {title_sanitized}\nURL: {href}\n"
-                                        f"{page_html_sanitized}\n"
-                                        f"=== END OF ARTICLE ==="
-                                    )
-
-                                except Exception as fetch_err:
-                                    print(f"Error fetching page {href}: {fetch_err}")
+                            # Fetch every result page at once; each page comes back as extracted text
+                            pages = fetch_pages([result["href"] for result in results])
+                            full_text_output = []
+
+                            for result, page in zip(results, pages):
+                                if page["error"]:
+                                    print(f"Error fetching page {page['url']}: {page['error']}")
                                     continue
 
+                                full_text_output.append(
+                                    f"=== START OF ARTICLE ===\n"
+                                    f"Title: {page['title'] or result.get('title', '')}\nURL: {page['url']}\n"
+                                    f"{page['text']}\n"
+                                    f"=== END OF ARTICLE ==="
+                                )
+
                             # Join all the fetched content into a single string
-                            return "\\n\\n".join(full_html_output)
+                            return "\\n\\n".join(full_text_output)
 
                         except Exception as e:
                             print(f"Error in duckduckgo_search_wrapper: {e}")
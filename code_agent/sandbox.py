@@ -0,0 +1,416 @@
+import atexit
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from io import StringIO
+from typing import Dict, List, Optional
+
+from metrics import metrics, tracing
+from models.resilience import deadline, time_remaining
+from .artifacts import resolve, spill
+from .limits import (
+    SUBTASK_KILL_GRACE,
+    SUBTASK_MEMORY_LIMIT_MB,
+    SubtaskLimitExceeded,
+    limit_fields,
+    process_limits,
+    set_memory_limit
+)
+from .validation import compile_subtask
+
+logger = logging.getLogger(__name__)
+
+SANDBOX_ENABLED = os.getenv("SANDBOX_ENABLED", "true").lower() == "true"
+SANDBOX_POOL_SIZE = int(os.getenv("SANDBOX_POOL_SIZE", 4))
+SANDBOX_MAX_JOBS = int(os.getenv("SANDBOX_MAX_JOBS", 1000))
+SANDBOX_MAX_RSS_MB = int(os.getenv("SANDBOX_MAX_RSS_MB", 1024))
+SANDBOX_START_METHOD = os.getenv("SANDBOX_START_METHOD", "forkserver")
+# Attempts to start a worker before its slot is reported broken; the next job retries it
+SANDBOX_SPAWN_ATTEMPTS = int(os.getenv("SANDBOX_SPAWN_ATTEMPTS", 3))
+
+# Distribution names used in import_libraries that differ from the module to import
+LIBRARY_MODULES = {
+    "beautifulsoup4": "bs4",
+    "models": "models.models",
+    "email": "email.mime.multipart",
+}
+
+
+class SandboxError(Exception):
+    """Raised when a sandbox worker dies or cannot be reached."""
+
+
+def modules_for_libraries(import_libraries: List[Dict]) -> List[str]:
+    """Map the lib_names of an import_libraries catalog to importable module names."""
+    modules = []
+    for library in import_libraries or []:
+        lib_names = library.get("lib_names") or library.get("lib_name") or []
+        for lib_name in lib_names:
+            module = LIBRARY_MODULES.get(lib_name, lib_name)
+            if module not in modules:
+                modules.append(module)
+    return modules
+
+
+def _import_modules(modules: List[str], worker_logger: logging.Logger):
+    for module in modules:
+        if module in sys.modules:
+            continue
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            worker_logger.debug(f"Sandbox could not pre-import '{module}': {e}")
+
+
+def _current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _CollectingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage()))
+
+
+def _run_job(job: Dict, subtask_logger: logging.Logger, handler: _CollectingHandler) -> Dict:
+    handler.records = []
+    response = {"has_result": False, "result": None}
+    old_stdout = sys.stdout
+    sys.stdout = captured_output = StringIO()
+    # Spans are recorded under the agent's subtask span and shipped back with the response
+    with tracing.remote_trace(job.get("trace")) as trace:
+        try:
+            # Model calls made by the code get the subtask's deadline too
+            with process_limits(job.get("timeout"), job.get("cpu_limit")), deadline(job.get("timeout") or 0):
+                temp_namespace = {"logger": subtask_logger}
+                with tracing.span("subtask.exec", code_chars=len(job["code"])):
+                    exec(compile_subtask(job["code"]), temp_namespace)
+
+                tool_name = job["tool_name"]
+                if tool_name in temp_namespace:
+                    tool_func = temp_namespace[tool_name]
+                    arguments = job.get("arguments") or {}
+                    with tracing.span("tool.call", tool_name=tool_name, pid=os.getpid()):
+                        if job["call_with_input"]:
+                            result = tool_func(resolve(job["input"]), **arguments)
+                        else:
+                            result = tool_func(**arguments)
+                    response["has_result"] = True
+                    # A large result goes back through the pipe as a handle, not pickled in full
+                    response["result"] = spill(result, job.get("artifact_scope"))
+                else:
+                    response["missing_function"] = True
+        except SubtaskLimitExceeded as e:
+            response.update(limit_fields(e))
+            response["traceback"] = traceback.format_exc()
+        except MemoryError:
+            response.update(limit_fields(SubtaskLimitExceeded("memory", SUBTASK_MEMORY_LIMIT_MB)))
+            response["traceback"] = traceback.format_exc()
+        except Exception as e:
+            response["error"] = f"{type(e).__name__}: {e}"
+            response["traceback"] = traceback.format_exc()
+        finally:
+            sys.stdout = old_stdout
+    response["printed_output"] = captured_output.getvalue()
+    response["logs"] = handler.records
+    response["metrics"] = metrics.drain_forwarded()
+    response["spans"] = trace.spans if trace is not None else []
+    return response
+
+
+def _worker_main(conn, preload_modules: List[str], max_jobs: int, max_rss_mb: int, preload_code: List[str] = ()):
+    """Entry point of a sandbox worker process: import and compile once, then serve jobs until recycled."""
+    subtask_logger = logging.getLogger("code_agent.subtask")
+    subtask_logger.propagate = False
+    subtask_logger.setLevel(logging.DEBUG)
+    handler = _CollectingHandler()
+    subtask_logger.addHandler(handler)
+    # Model calls made by subtask code are observed here and replayed by the parent
+    metrics.enable_forwarding()
+
+    _import_modules(preload_modules, subtask_logger)
+    # Verified tools are compiled ahead, so a plan that references them skips compile()
+    for code in preload_code:
+        try:
+            compile_subtask(code)
+        except SyntaxError:
+            pass
+    set_memory_limit(SUBTASK_MEMORY_LIMIT_MB)
+    conn.send({"ready": True, "pid": os.getpid()})
+
+    jobs_done = 0
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+
+        _import_modules(job.get("import_modules", []), subtask_logger)
+        response = _run_job(job, subtask_logger, handler)
+        jobs_done += 1
+        # The pool starts a replacement and stops this worker once it is ready
+        response["recycle"] = jobs_done >= max_jobs or _current_rss_mb() > max_rss_mb
+
+        try:
+            conn.send(response)
+        except Exception as e:
+            # The tool returned something that cannot be pickled: ship its repr instead
+            response["result"] = repr(response["result"])
+            response["logs"].append((logging.WARNING, f"Result of '{job['tool_name']}' is not picklable ({e}), returning its repr"))
+            conn.send(response)
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, context, preload_modules: List[str], max_jobs: int, max_rss_mb: int, preload_code: List[str] = ()):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, preload_modules, max_jobs, max_rss_mb, list(preload_code)),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.replacing = False  # A replacement is being started
+        self.replaced = False  # The replacement is serving: stop this worker when it is next taken
+
+    def wait_ready(self, timeout: float = 120) -> bool:
+        if self.conn.poll(timeout):
+            try:
+                return bool(self.conn.recv().get("ready"))
+            except (EOFError, OSError):
+                return False
+        return False
+
+    def run(self, job: Dict) -> Dict:
+        self.conn.send(job)
+        # Backstop for code stuck where the worker's own alarm cannot interrupt it
+        kill_at = time.monotonic() + job["timeout"] + SUBTASK_KILL_GRACE if job.get("timeout") else None
+        while not self.conn.poll(0.5):
+            if not self.process.is_alive():
+                raise SandboxError(f"Sandbox worker {self.process.pid} died with exit code {self.process.exitcode}")
+            if kill_at is not None and time.monotonic() > kill_at:
+                self.process.kill()
+                raise SubtaskLimitExceeded("wall_clock", job["timeout"])
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            self.process.join(timeout=1)
+            raise SandboxError(f"Sandbox worker {self.process.pid} died with exit code {self.process.exitcode}")
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    Pool of long-lived worker processes that execute subtask code. Workers import the
+    library catalog and compile the verified tools once at start-up, so a subtask only
+    pays for its own code; a worker is replaced after max_jobs jobs or above max_rss_mb of
+    resident memory, by starting the replacement first so jobs never wait for it, and
+    when it dies. A job whose worker dies, or whose slot has no worker
+    because SANDBOX_SPAWN_ATTEMPTS starts failed, raises SandboxError.
+    """
+
+    def __init__(self, preload_modules: List[str], size: int = SANDBOX_POOL_SIZE,
+                 max_jobs: int = SANDBOX_MAX_JOBS, max_rss_mb: int = SANDBOX_MAX_RSS_MB,
+                 start_method: str = SANDBOX_START_METHOD):
+        if start_method not in multiprocessing.get_all_start_methods():
+            start_method = "spawn"
+        self.context = multiprocessing.get_context(start_method)
+        if start_method == "forkserver":
+            # Fork workers from a small server process instead of re-importing __main__
+            # (the web app) in each of them; workers import the catalog themselves
+            self.context.set_forkserver_preload(["code_agent.sandbox"])
+        self.preload_modules = list(preload_modules)
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self._idle = queue.Queue()
+        self._closed = False
+        for _ in range(size):
+            self._spawn_async()
+
+    def _spawn(self, attempt: int = 1, replacing: Optional[_Worker] = None):
+        from .tool_library import TOOL_LIBRARY_ENABLED, tool_library
+        preload_code = tool_library.sources() if TOOL_LIBRARY_ENABLED else []
+        try:
+            worker = _Worker(self.context, self.preload_modules, self.max_jobs, self.max_rss_mb, preload_code)
+        except Exception as e:
+            worker, ready, reason = None, False, str(e)
+        else:
+            ready = worker.wait_ready()
+        if self._closed:
+            if worker is not None:
+                worker.stop()
+        elif ready:
+            self._idle.put(worker)
+            if replacing is not None:
+                replacing.replaced = True
+        else:
+            if worker is not None:
+                worker.stop()
+                reason = f"worker {worker.process.pid} was not ready, exit code {worker.process.exitcode}"
+            if attempt < SANDBOX_SPAWN_ATTEMPTS:
+                logger.error(f"Sandbox worker failed to start ({reason}), retrying")
+                time.sleep(attempt)
+                self._spawn(attempt + 1, replacing)
+            elif replacing is not None:
+                # The worker due for recycling keeps serving; its next job tries again
+                logger.error(f"🔴 Replacement sandbox worker failed to start {attempt} times ({reason})")
+                replacing.replacing = False
+            else:
+                # Jobs that get this slot fail with the reason instead of waiting for a worker forever
+                logger.error(f"🔴 Sandbox worker failed to start {attempt} times ({reason}), giving up on this slot")
+                self._idle.put(SandboxError(f"Sandbox worker failed to start {attempt} times: {reason}"))
+
+    def _spawn_async(self, replacing: Optional[_Worker] = None):
+        threading.Thread(target=self._spawn, kwargs={"replacing": replacing}, name="sandbox-spawn", daemon=True).start()
+
+    def _retire(self, worker: _Worker, respawn: bool = True):
+        threading.Thread(target=worker.stop, name="sandbox-retire", daemon=True).start()
+        if respawn and not self._closed:
+            self._spawn_async()
+
+    def _acquire(self, timeout: Optional[float]):
+        """The next idle worker, or a slot's SandboxError; raises queue.Empty after timeout seconds (None: no limit)."""
+        give_up_at = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            wait = None if give_up_at is None else max(give_up_at - time.monotonic(), 0)
+            worker = self._idle.get(timeout=wait) if wait != 0 else self._idle.get_nowait()
+            if isinstance(worker, _Worker) and worker.replaced:
+                self._retire(worker, respawn=False)
+                continue
+            return worker
+
+    def run(self, code: str, tool_name: str, call_with_input: bool, input_data=None,
+            import_modules: Optional[List[str]] = None, artifact_scope: Optional[str] = None,
+            timeout: Optional[float] = None, cpu_limit: Optional[float] = None,
+            arguments: Optional[Dict] = None) -> Dict:
+        """
+        Execute a subtask on a warm worker and return its response dict: has_result, result,
+        printed_output, logs (level, message), metrics and spans to replay in this process
+        and, when the code raised, error and traceback.
+        arguments are passed to the tool function by name, after its input if it takes one.
+        With an artifact_scope, a large result is written to the artifact store by the
+        worker and comes back as an ArtifactRef. A subtask that runs past timeout seconds
+        or cpu_limit CPU seconds is stopped and its response carries limit_exceeded.
+        Its limits start once a worker takes the job: the wait for a free worker, reported
+        as queue_wait seconds, is only bounded by the run's deadline, and a subtask that
+        finds no free worker before it is not started.
+        """
+        if self._closed:
+            raise SandboxError("Sandbox pool is shut down")
+        waiting_since = time.monotonic()
+        remaining = time_remaining()
+        try:
+            worker = self._acquire(remaining)
+        except queue.Empty:
+            logger.warning(f"⏱️ No sandbox worker became free before the run's deadline, subtask '{tool_name}' not started")
+            return dict(limit_fields(SubtaskLimitExceeded("run_deadline", max(remaining, 0)), stopped="not_started"),
+                        has_result=False, result=None, traceback="", printed_output="", logs=[], metrics=[],
+                        queue_wait=time.monotonic() - waiting_since)
+        queue_wait = time.monotonic() - waiting_since
+        metrics.SANDBOX_QUEUE_WAIT.observe(queue_wait)
+        if isinstance(worker, SandboxError):
+            # A slot whose worker could not start: try it again in the background and report why
+            self._spawn_async()
+            raise worker
+        remaining = time_remaining()
+        if timeout and remaining is not None:
+            # The wait for a worker does not shorten the subtask's own limit, only the run's deadline does
+            timeout = max(min(timeout, remaining), 0.001)
+        job = {
+            "code": code,
+            "tool_name": tool_name,
+            "call_with_input": call_with_input,
+            "input": input_data,
+            "arguments": arguments or {},
+            "import_modules": import_modules or [],
+            "artifact_scope": artifact_scope,
+            "timeout": timeout,
+            "cpu_limit": cpu_limit,
+            "trace": tracing.remote_context()
+        }
+        try:
+            response = worker.run(job)
+        except SubtaskLimitExceeded as e:
+            logger.warning(f"⏱️ Sandbox worker {worker.process.pid} did not stop at the deadline of '{tool_name}', killed it")
+            self._retire(worker)
+            return dict(limit_fields(e, stopped="killed"), has_result=False, result=None, traceback="", printed_output="", logs=[], metrics=[],
+                        queue_wait=queue_wait)
+        except SandboxError:
+            self._retire(worker)
+            raise
+        except Exception as e:
+            # Typically the input could not be pickled; the worker is still usable
+            self._idle.put(worker)
+            raise SandboxError(f"Could not send subtask '{tool_name}' to the sandbox: {e}")
+
+        if response.get("recycle") and not worker.replacing and not self._closed:
+            worker.replacing = True
+            self._spawn_async(replacing=worker)
+        self._idle.put(worker)
+        response["queue_wait"] = queue_wait
+        return response
+
+    def shutdown(self):
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(worker, _Worker):
+                worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_sandbox_pool(import_libraries: Optional[List[Dict]] = None) -> SandboxPool:
+    """Return the process-wide sandbox pool, creating it warm on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from .prompts import DEFAULT_IMPORT_LIBRARIES
+                preload_modules = modules_for_libraries(DEFAULT_IMPORT_LIBRARIES + (import_libraries or []))
+                _pool = SandboxPool(preload_modules)
+                atexit.register(_pool.shutdown)
+    return _pool
+
+
+def shutdown_sandbox_pool():
+    """Stop the process-wide pool if one was started."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
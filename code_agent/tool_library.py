@@ -0,0 +1,243 @@
+import ast
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from metrics import metrics
+from storage.redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+TOOL_LIBRARY_ENABLED = os.getenv("TOOL_LIBRARY_ENABLED", "true").lower() == "true"
+TOOL_LIBRARY_MAX_ENTRIES = int(os.getenv("TOOL_LIBRARY_MAX_ENTRIES", 500))
+TOOL_LIBRARY_TTL = float(os.getenv("TOOL_LIBRARY_TTL", 30 * 86400))
+# Verified tools offered to the planner per task, the most relevant first
+TOOL_LIBRARY_PROMPT_TOOLS = int(os.getenv("TOOL_LIBRARY_PROMPT_TOOLS", 10))
+TOOL_LIBRARY_REDIS_KEY = os.getenv("TOOL_LIBRARY_REDIS_KEY", "tool-library")
+TOOL_LIBRARY_SYNC_INTERVAL = float(os.getenv("TOOL_LIBRARY_SYNC_INTERVAL", 60))
+
+
+def _function(code: str, name: str) -> Optional[ast.FunctionDef]:
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    found = None
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == name:
+            found = node  # The last definition wins, as at exec time
+    return found
+
+
+def tool_id(name: str, code: str) -> str:
+    return f"{name}#{hashlib.sha256(code.encode('utf-8')).hexdigest()[:8]}"
+
+
+class ToolLibrary:
+    """
+    Registry of tool functions that were part of a satisfactory run, so the planner can
+    reference them instead of writing their code again. Each tool is identified by its
+    name and code hash, indexed for the planner by name and description, kept LRU with a
+    TTL, and shared through Redis when it is reachable. A tool verified again with the
+    same code only gets its counter and timestamp bumped.
+    """
+
+    def __init__(self, max_entries: int = TOOL_LIBRARY_MAX_ENTRIES, ttl: float = TOOL_LIBRARY_TTL,
+                 redis_key: str = TOOL_LIBRARY_REDIS_KEY, sync_interval: float = TOOL_LIBRARY_SYNC_INTERVAL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.redis_key = redis_key
+        self.sync_interval = sync_interval
+        self._entries = OrderedDict()  # tool id -> entry
+        self._synced_at = None
+        self._lock = threading.Lock()
+
+    def register(self, subtask: Dict) -> Optional[str]:
+        """Record a subtask that ran cleanly in a satisfactory run; return its tool id."""
+        name, code = subtask.get("tool_name"), subtask.get("code")
+        if not isinstance(name, str) or not isinstance(code, str):
+            return None
+        function = _function(code, name)
+        if function is None:
+            return None
+        entry_id = tool_id(name, code)
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                entry = {
+                    "id": entry_id,
+                    "name": name,
+                    "signature": f"{name}({ast.unparse(function.args)})",
+                    "description": subtask.get("description", ""),
+                    "imports": [str(library) for library in subtask.get("imports") or []],
+                    "takes_input": bool(subtask.get("input_from_tool")),
+                    "code": code,
+                    "verified": 0
+                }
+            entry["verified"] += 1
+            entry["verified_at"] = time.time()
+            self._entries[entry_id] = entry
+            self._entries.move_to_end(entry_id)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+        metrics.VERIFIED_TOOLS.inc(event="registered" if entry["verified"] == 1 else "reverified")
+        self._redis_call("hset", entry_id, json.dumps(entry))
+        for evicted_id in evicted:
+            self._redis_call("hdel", evicted_id)
+        _warm(code)
+        return entry_id
+
+    def get(self, entry_id: str, name: Optional[str] = None) -> Optional[Dict]:
+        """The tool with this id; failing that, the latest verified tool with this name."""
+        self._sync_from_redis()
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is None and name:
+                named = [entry for entry in self._entries.values() if entry["name"] == name]
+                entry = max(named, key=lambda entry: entry["verified_at"]) if named else None
+            if entry is not None:
+                self._entries.move_to_end(entry["id"])
+            return entry
+
+    def offer(self, task: str, import_libraries: List[Dict], limit: int = TOOL_LIBRARY_PROMPT_TOOLS) -> List[Dict]:
+        """
+        The tools to show the planner for a task: those whose imports the library catalog
+        still provides, one version per name, ranked by how well their name and
+        description match the task. None when nothing matches.
+        """
+        from tools.tool_index import ToolIndex
+
+        self._sync_from_redis()
+        self._expire()
+        available = {
+            str(lib_name) for library in import_libraries or []
+            for lib_name in library.get("lib_names") or library.get("lib_name") or []
+        }
+        latest = {}
+        with self._lock:
+            for entry in self._entries.values():
+                if not set(entry["imports"]) <= available:
+                    continue
+                current = latest.get(entry["name"])
+                if current is None or entry["verified_at"] > current["verified_at"]:
+                    latest[entry["name"]] = entry
+        candidates = list(latest.values())
+        if not candidates or limit <= 0:
+            return []
+        scores = ToolIndex([{"tool_name": entry["name"], "description": entry["description"]} for entry in candidates]).scores(task)
+        ranked = sorted(range(len(candidates)), key=lambda position: (-scores[position], -candidates[position]["verified"]))
+        return [candidates[position] for position in ranked[:limit] if scores[position] > 0]
+
+    def sources(self) -> List[str]:
+        """Code of every tool in the library, for workers to compile ahead of use."""
+        with self._lock:
+            return [entry["code"] for entry in self._entries.values()]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [entry_id for entry_id, entry in self._entries.items() if entry["verified_at"] < cutoff]
+            for entry_id in expired:
+                del self._entries[entry_id]
+        for entry_id in expired:
+            self._redis_call("hdel", entry_id)
+
+    def _redis_call(self, operation: str, *args):
+        client = get_redis_client()
+        if client is None:
+            return
+        try:
+            getattr(client, operation)(self.redis_key, *args)
+        except Exception as e:
+            logger.warning(f"Tool library Redis {operation} failed: {e}")
+
+    def _sync_from_redis(self):
+        """Adopt the tools verified by other processes."""
+        now = time.monotonic()
+        with self._lock:
+            if self._synced_at is not None and now - self._synced_at < self.sync_interval:
+                return
+            self._synced_at = now
+        client = get_redis_client()
+        if client is None:
+            return
+        try:
+            shared = client.hgetall(self.redis_key)
+        except Exception as e:
+            logger.warning(f"Tool library Redis sync failed: {e}")
+            return
+
+        adopted = []
+        with self._lock:
+            for value in shared.values():
+                try:
+                    entry = json.loads(value)
+                except ValueError:
+                    continue
+                current = self._entries.get(entry.get("id"))
+                if current is None or entry.get("verified_at", 0) > current["verified_at"]:
+                    self._entries[entry["id"]] = entry
+                    adopted.append(entry["code"])
+            ordered = sorted(self._entries.items(), key=lambda item: item[1]["verified_at"])
+            self._entries = OrderedDict(ordered[-self.max_entries:])
+        for code in adopted:
+            _warm(code)
+
+
+def _warm(code: str):
+    # Compiled once here too, for subtasks run inline
+    from .validation import compile_subtask
+    try:
+        compile_subtask(code)
+    except SyntaxError:
+        pass
+
+
+tool_library = ToolLibrary()
+
+
+def describe_tools(entries: List[Dict]) -> str:
+    """The planner's view of verified tools: id, signature, input and description."""
+    lines = []
+    for entry in entries:
+        takes = "takes the previous tool's output" if entry["takes_input"] else "first tool, no input"
+        lines.append(f"- {entry['id']}: {entry['signature']} ({takes}) - {entry['description']}")
+    return "\n".join(lines)
+
+
+def resolve_reference(subtask: Dict) -> Dict:
+    """
+    Expand a subtask that references a verified tool into one that carries the tool's
+    code, keeping its arguments. A reference to a tool the library does not have gets
+    code that fails with the reason, so validation or the evaluation replaces it.
+    """
+    reference = subtask.get("verified_tool")
+    if not reference or subtask.get("code"):
+        return subtask
+    name = subtask.get("tool_name") or str(reference).split("#", 1)[0]
+    entry = tool_library.get(str(reference), name)
+    resolved = dict(subtask)
+    if entry is None:
+        metrics.VERIFIED_TOOL_REFERENCES.inc(result="unresolved")
+        logger.warning(f"🔴 Plan references verified tool '{reference}', which is not in the library")
+        resolved["code"] = f"raise LookupError({f'verified tool {reference} is not in the library, write its code instead'!r})\n"
+        return resolved
+    metrics.VERIFIED_TOOL_REFERENCES.inc(result="resolved")
+    resolved["verified_tool"] = entry["id"]
+    resolved["tool_name"] = entry["name"]
+    resolved["code"] = entry["code"]
+    resolved.setdefault("description", entry["description"])
+    resolved.setdefault("imports", entry["imports"])
+    if not isinstance(resolved.get("arguments"), dict):
+        resolved["arguments"] = {}
+    return resolved
@@ -1,3 +1,4 @@
+import json
 import re
 
 def sanitize_gpt_response(response_str: str) -> str:
@@ -12,4 +13,129 @@ def sanitize_gpt_response(response_str: str) -> str:
     response_str = response_str.replace(": False", ": false")
     response_str = response_str.replace(": True", ": true")
     
-    return response_str.strip()
\ No newline at end of file
+    return response_str.strip()
+
+
+class StreamingFieldExtractor:
+    """
+    Pulls the value of one top-level string field out of a JSON object that is still
+    being generated, e.g. "final_answer" from a streamed evaluation. feed() takes the
+    next raw chunk and returns the newly decoded part of the field's value, so the
+    value can be forwarded token by token before the object is complete.
+    """
+
+    ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self, field_name: str):
+        self.start_pattern = re.compile(r'"' + re.escape(field_name) + r'"\s*:\s*"')
+        self.buffer = ""
+        self.position = None  # index in buffer of the next undecoded character of the value
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        self.buffer += chunk
+        if self.done:
+            return ""
+        if self.position is None:
+            match = self.start_pattern.search(self.buffer)
+            if not match:
+                return ""
+            self.position = match.end()
+
+        decoded = []
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+            if char == '"':
+                self.done = True
+                break
+            if char != '\\':
+                decoded.append(char)
+                self.position += 1
+                continue
+            # Escape sequence: wait for the rest of it if it was split across chunks
+            if self.position + 1 >= len(self.buffer):
+                break
+            code = self.buffer[self.position + 1]
+            if code == 'u':
+                if self.position + 6 > len(self.buffer):
+                    break
+                decoded.append(json.loads('"' + self.buffer[self.position:self.position + 6] + '"'))
+                self.position += 6
+            else:
+                decoded.append(self.ESCAPES.get(code, code))
+                self.position += 2
+        return "".join(decoded)
+
+
+class StreamingArrayExtractor:
+    """
+    Pulls the elements of one top-level array field out of a JSON object that is still
+    being generated, e.g. the "subtasks" of a streamed plan. feed() takes the next raw
+    chunk and returns the objects of the array that were completed by it, parsed, so
+    each can be acted on as soon as its closing brace arrives. Only the top-level key
+    counts: the same text inside a string or a nested object is ignored.
+    """
+
+    def __init__(self, field_name: str):
+        self.field_name = field_name
+        self.buffer = ""
+        self.position = 0  # index in buffer of the next unscanned character
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.string_start = None
+        self.last_string = None  # raw text of the last string closed at the top level
+        self.pending_key = None  # key whose value comes next at the top level
+        self.in_array = False
+        self.element_start = None
+        self.count = 0  # elements returned so far
+        self.done = False
+        self.failed = False
+
+    def feed(self, chunk: str) -> list:
+        self.buffer += chunk
+        elements = []
+        while self.position < len(self.buffer) and not (self.done or self.failed):
+            char = self.buffer[self.position]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = self.buffer[self.string_start + 1:self.position]
+            elif char == '"':
+                self.in_string = True
+                self.string_start = self.position
+            elif char in '{[':
+                self.depth += 1
+                if self.in_array and self.depth == 3 and char == '{':
+                    self.element_start = self.position
+                elif char == '[' and self.depth == 2 and self.pending_key == self.field_name:
+                    self.in_array = True
+            elif char in '}]':
+                if self.in_array and self.depth == 3 and char == '}' and self.element_start is not None:
+                    element = self._parse(self.buffer[self.element_start:self.position + 1])
+                    if element is not None:
+                        elements.append(element)
+                    self.element_start = None
+                elif self.in_array and self.depth == 2 and char == ']':
+                    self.done = True
+                self.depth -= 1
+            elif self.depth == 1 and char == ':':
+                self.pending_key = self.last_string
+            elif self.depth == 1 and char == ',':
+                self.pending_key = None
+            self.position += 1
+        self.count += len(elements)
+        return elements
+
+    def _parse(self, text: str):
+        try:
+            return json.loads(sanitize_gpt_response(text))
+        except ValueError:
+            # Leave the rest to whoever parses the complete document
+            self.failed = True
+            return None
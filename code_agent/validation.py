@@ -0,0 +1,191 @@
+import ast
+import builtins
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from types import CodeType
+from typing import Dict, List, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SUBTASK_VALIDATION_ENABLED = os.getenv("SUBTASK_VALIDATION_ENABLED", "true").lower() == "true"
+# Repair calls per invalid subtask; 0 only reports the problems in the logs
+SUBTASK_REPAIR_ATTEMPTS = int(os.getenv("SUBTASK_REPAIR_ATTEMPTS", 1))
+CODE_CACHE_MAX_ENTRIES = int(os.getenv("CODE_CACHE_MAX_ENTRIES", 512))
+
+# Names every subtask namespace provides besides the builtins (see _run_subtask_inline and the sandbox)
+NAMESPACE_NAMES = {"logger", "__builtins__", "__file__"}
+
+
+class _CodeCache:
+    """LRU of compiled subtask code by source hash, so reused and retried subtasks skip compile()."""
+
+    def __init__(self, max_entries: int = CODE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compile(self, source: str) -> CodeType:
+        key = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        with self._lock:
+            code = self._entries.get(key)
+            if code is not None:
+                self._entries.move_to_end(key)
+                metrics.SUBTASK_CODE_CACHE_LOOKUPS.inc(result="hit")
+                return code
+        metrics.SUBTASK_CODE_CACHE_LOOKUPS.inc(result="miss")
+        # The filename exec() of a string would use, so tracebacks read the same
+        code = compile(source, "<string>", "exec")
+        with self._lock:
+            self._entries[key] = code
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return code
+
+
+code_cache = _CodeCache()
+
+
+def compile_subtask(source: str) -> CodeType:
+    return code_cache.compile(source)
+
+
+def _bound_names(tree: ast.AST) -> set:
+    """Every name the module binds anywhere, whatever the scope: a scope-blind but false-positive-free view."""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                names.add(alias.asname or alias.name.split(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+    return names
+
+
+def _function(tree: ast.Module, name: str) -> Optional[ast.FunctionDef]:
+    found = None
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == name:
+            found = node  # The last definition wins, as at exec time
+    return found
+
+
+def _check_signature(function: ast.FunctionDef, takes_input: bool, arguments: Optional[Dict] = None) -> Optional[str]:
+    args = function.args
+    positional = args.posonlyargs + args.args
+    required = len(positional) - len(args.defaults)
+    if arguments is not None:
+        if not isinstance(arguments, dict):
+            return "arguments must be a JSON object of parameter names and values"
+        # The previous tool's output fills the first parameter; arguments name the others
+        named = {arg.arg for arg in (args.args[1:] if takes_input else args.args) + args.kwonlyargs}
+        unknown = sorted(set(arguments) - named)
+        if unknown and not args.kwarg:
+            return f"function '{function.name}' has no parameters {unknown} to pass as arguments"
+        required -= len(set(arguments) & {arg.arg for arg in positional})
+    required_keyword_only = [arg.arg for arg, default in zip(args.kwonlyargs, args.kw_defaults) if default is None]
+    if required_keyword_only:
+        return f"function '{function.name}' has required keyword-only parameters {required_keyword_only}"
+    if takes_input and not positional and not args.vararg:
+        return f"function '{function.name}' is called with the previous tool's output but takes no parameter"
+    if takes_input and required > 1:
+        return f"function '{function.name}' is called with one argument but requires {required}"
+    if not takes_input and required > 0:
+        return f"function '{function.name}' is called without arguments but requires {required}"
+    return None
+
+
+class PlanValidator:
+    """
+    Static checks of a plan's subtasks, in plan order, before any of them runs: the code
+    compiles, defines a top-level function named after tool_name whose signature fits the
+    way it will be called, uses no name that is never defined, and input_from_tool names
+    a tool listed earlier. Subtasks are fed one at a time, so a streamed plan can be
+    checked as it arrives.
+    """
+
+    def __init__(self):
+        self.tool_names = set()
+
+    def problems(self, subtask: Dict) -> List[str]:
+        tool_name = subtask.get("tool_name")
+        code = subtask.get("code")
+        input_tool_name = subtask.get("input_from_tool", "")
+        problems = []
+
+        if not tool_name or not isinstance(tool_name, str):
+            problems.append("the subtask has no tool_name")
+        if input_tool_name and input_tool_name not in self.tool_names:
+            problems.append(f"input_from_tool '{input_tool_name}' is not the tool_name of an earlier subtask")
+        if not isinstance(code, str) or not code.strip():
+            problems.append("the subtask has no code")
+            return problems
+
+        try:
+            compile_subtask(code)
+            tree = ast.parse(code)
+        except SyntaxError as e:
+            problems.append(f"SyntaxError at line {e.lineno}: {e.msg}" + (f": {e.text.strip()}" if e.text else ""))
+            return problems
+
+        if tool_name:
+            function = _function(tree, tool_name)
+            if function is None:
+                problems.append(f"the code does not define a top-level function named '{tool_name}'")
+            else:
+                signature_problem = _check_signature(function, bool(input_tool_name), subtask.get("arguments"))
+                if signature_problem:
+                    problems.append(signature_problem)
+
+        star_import = any(
+            isinstance(node, ast.ImportFrom) and any(alias.name == "*" for alias in node.names)
+            for node in ast.walk(tree)
+        )
+        if not star_import:
+            known = _bound_names(tree) | NAMESPACE_NAMES | set(dir(builtins))
+            undefined = sorted({
+                node.id for node in ast.walk(tree)
+                if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id not in known
+            })
+            if undefined:
+                problems.append(f"names used but never defined or imported: {', '.join(undefined)}")
+        return problems
+
+    def add(self, subtask: Dict):
+        if subtask.get("tool_name"):
+            self.tool_names.add(subtask["tool_name"])
+
+
+def repair_subtask(subtask: Dict, problems: List[str], earlier_tools: List[str]) -> Dict:
+    """Ask for a corrected version of one subtask, showing only that subtask and its problems."""
+    from models.models import call_model
+    from .prompts import SUBTASK_REPAIR_PROMPT
+    from .utils import sanitize_gpt_response
+
+    prompt = SUBTASK_REPAIR_PROMPT.format(
+        subtask=json.dumps(subtask, indent=4),
+        problems="\n".join(f"- {problem}" for problem in problems),
+        earlier_tools=", ".join(earlier_tools) or "(none, this is the first subtask)"
+    )
+    answer = call_model(chat_history=[{"role": "user", "content": prompt}], call_site="repair", expect_json=True)
+    repaired = json.loads(sanitize_gpt_response(answer))
+    if not isinstance(repaired, dict):
+        raise ValueError("the repair is not a JSON object")
+    return dict(subtask, **repaired)
@@ -0,0 +1,57 @@
+# Production server configuration: gunicorn -c gunicorn.conf.py app:app
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('FLASK_PORT', 5000)}"
+
+# Agent runs spend most of their time waiting on the model API and on sandbox
+# workers, so each process serves several runs from threads.
+workers = int(os.getenv("GUNICORN_WORKERS", max(2, multiprocessing.cpu_count())))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+
+# Import the app, the prompt templates and the library catalog once in the master;
+# workers inherit them already initialized.
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+# A full agent run (planning, subtasks, evaluation, a second iteration) can take minutes
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 600))
+# On SIGTERM workers stop accepting requests and get this long to finish in-flight runs
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 120))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 0))
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+WARM_SANDBOX = os.getenv("GUNICORN_WARM_SANDBOX", "true").lower() == "true"
+
+
+def on_starting(server):
+    # Counters restart with the server: drop the files of this host's previous workers
+    from metrics import metrics
+
+    metrics.clear_multiprocess_dir()
+
+
+def post_fork(server, worker):
+    # Connections opened by the preloading master must not be shared between workers
+    from models import models
+    from storage.redis_client import reset_redis_client
+    import app
+
+    models.reset_client()
+    reset_redis_client()
+    app.start_background_workers(warm_sandbox=WARM_SANDBOX)
+
+
+def worker_exit(server, worker):
+    import app
+    from metrics import metrics
+
+    app.shutdown(timeout=graceful_timeout)
+    # The runs drained above are counted in the file the exited worker leaves behind
+    metrics.flush()
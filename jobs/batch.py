@@ -0,0 +1,116 @@
+"""
+Batch agent runs: identical tasks are coalesced and the distinct ones run on a bounded,
+process-wide pool, so a burst of tasks neither spawns a thread per task nor pays twice
+for the same conversation.
+"""
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_TASKS = int(os.getenv("BATCH_MAX_TASKS", 100))
+# Agent runs executing at once for all batches of this process
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 8))
+
+
+def task_key(chat_history: List[Dict], import_libraries: List[Dict]) -> str:
+    """Identity of an agent task: two tasks with the same key get the same run."""
+    canonical = json.dumps([chat_history, import_libraries], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Concurrent submissions with the same key share one execution: the first one submits
+    the function to the executor, the others get a future chained to that run (its result
+    or its exception) and hold no executor thread while it runs. Nothing is kept once the
+    run finishes.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, executor: Executor, key: str, function: Callable[[], object]) -> Future:
+        """Return a future of (result, shared); shared is True when another caller's run was joined."""
+        with self._lock:
+            call = self._calls.get(key)
+            shared = call is not None
+            if not shared:
+                call = self._calls[key] = executor.submit(function)
+        if not shared:
+            call.add_done_callback(lambda _: self._forget(key, call))
+
+        answer = Future()
+
+        def relay(finished: Future):
+            error = finished.exception()
+            if error is not None:
+                answer.set_exception(error)
+            else:
+                answer.set_result((finished.result(), shared))
+
+        call.add_done_callback(relay)
+        return answer
+
+    def _forget(self, key: str, call: Future):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+
+agent_runs = SingleFlight()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=BATCH_MAX_CONCURRENCY, thread_name_prefix="batch")
+        return _executor
+
+
+def submit_batch(tasks: List[Tuple[str, Callable[[], object]]]) -> Dict[Future, List[int]]:
+    """
+    Submit the (key, run) tasks of a batch. Each distinct key is run once, joined with a
+    run of the same key already in flight for another batch or request. Returns the
+    futures mapped to the indexes of the tasks they answer; a future's result is
+    (result, shared).
+    """
+    indexes_by_key: Dict[str, List[int]] = {}
+    runs = {}
+    for index, (key, run) in enumerate(tasks):
+        if key not in indexes_by_key:
+            indexes_by_key[key] = []
+            runs[key] = run
+        indexes_by_key[key].append(index)
+
+    executor = _get_executor()
+    futures = {}
+    for key, indexes in indexes_by_key.items():
+        metrics.AGENT_BATCH_TASKS.inc(len(indexes) - 1, disposition="deduplicated")
+        future = agent_runs.submit(executor, key, partial(contextvars.copy_context().run, runs[key]))
+        future.add_done_callback(_count_disposition)
+        futures[future] = indexes
+    logger.info(f"📦 Batch of {len(tasks)} tasks submitted as {len(futures)} distinct runs")
+    return futures
+
+
+def _count_disposition(future: Future):
+    if future.exception() is None:
+        _, shared = future.result()
+        metrics.AGENT_BATCH_TASKS.inc(disposition="joined" if shared else "run")
+    else:
+        metrics.AGENT_BATCH_TASKS.inc(disposition="failed")
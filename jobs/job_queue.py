@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+from storage.redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "redis")
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", 120))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", 3600))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_KEY_PREFIX = os.getenv("JOB_KEY_PREFIX", "agent-jobs:")
+
+# Queue scores order by priority first (higher first), then by submission time
+PRIORITY_WEIGHT = 10 ** 13
+MAX_PRIORITY = 100
+
+
+class JobQueueUnavailable(Exception):
+    """Raised when the queue backend cannot be reached."""
+
+
+def _score(priority: int, submitted_at: float) -> float:
+    priority = max(-MAX_PRIORITY, min(MAX_PRIORITY, int(priority)))
+    return -priority * PRIORITY_WEIGHT + int(submitted_at * 1000)
+
+
+def _decode_job(raw: Dict) -> Dict:
+    job = {
+        (key.decode() if isinstance(key, bytes) else key): (value.decode() if isinstance(value, bytes) else value)
+        for key, value in raw.items()
+    }
+    for field in ("payload", "result"):
+        if field in job:
+            job[field] = json.loads(job[field])
+    for field in ("priority", "attempts"):
+        if field in job:
+            job[field] = int(job[field])
+    for field in ("submitted_at", "started_at", "finished_at"):
+        if field in job:
+            job[field] = float(job[field])
+    return job
+
+
+_CLAIM_SCRIPT = """
+local popped = redis.call('ZPOPMIN', KEYS[1])
+if #popped == 0 then
+    return false
+end
+local job_id = popped[1]
+local job_key = ARGV[3] .. job_id
+redis.call('ZADD', KEYS[2], ARGV[1], job_id)
+redis.call('HSET', job_key, 'status', 'running', 'worker', ARGV[2], 'started_at', ARGV[4])
+redis.call('HINCRBY', job_key, 'attempts', 1)
+return job_id
+"""
+
+_REQUEUE_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local requeued = 0
+for _, job_id in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], job_id)
+    local job_key = ARGV[2] .. job_id
+    if redis.call('EXISTS', job_key) == 1 then
+        local attempts = tonumber(redis.call('HGET', job_key, 'attempts') or '0')
+        if attempts >= tonumber(ARGV[3]) then
+            redis.call('HSET', job_key, 'status', 'failed', 'finished_at', ARGV[4],
+                'error', 'Job abandoned: the worker died or exceeded the visibility timeout too many times')
+            redis.call('EXPIRE', job_key, ARGV[5])
+        else
+            redis.call('HSET', job_key, 'status', 'queued')
+            redis.call('ZADD', KEYS[2], redis.call('HGET', job_key, 'score'), job_id)
+            requeued = requeued + 1
+        end
+    end
+end
+return requeued
+"""
+
+
+class RedisJobQueue:
+    """
+    Priority job queue on Redis. Claimed jobs move to a processing set scored by their
+    visibility deadline; a worker that stops heartbeating lets the deadline pass and
+    requeue_expired() puts the job back, until JOB_MAX_ATTEMPTS is reached.
+    """
+
+    def __init__(self, client=None, prefix: str = JOB_KEY_PREFIX, result_ttl: int = JOB_RESULT_TTL,
+                 max_attempts: int = JOB_MAX_ATTEMPTS):
+        self._client = client
+        self.prefix = prefix
+        self.queue_key = prefix + "queue"
+        self.processing_key = prefix + "processing"
+        self.job_prefix = prefix + "job:"
+        self.result_ttl = result_ttl
+        self.max_attempts = max_attempts
+        self._claim_script = None
+        self._requeue_script = None
+
+    @property
+    def client(self):
+        client = self._client or get_redis_client()
+        if client is None:
+            raise JobQueueUnavailable("Redis is not reachable")
+        return client
+
+    def submit(self, payload: Dict, priority: int = 0) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        score = _score(priority, now)
+        pipe = self.client.pipeline()
+        pipe.hset(self.job_prefix + job_id, mapping={
+            "id": job_id,
+            "status": "queued",
+            "payload": json.dumps(payload),
+            "priority": priority,
+            "score": score,
+            "attempts": 0,
+            "submitted_at": now
+        })
+        pipe.zadd(self.queue_key, {job_id: score})
+        pipe.execute()
+        return job_id
+
+    def claim(self, worker_id: str, visibility_timeout: float = JOB_VISIBILITY_TIMEOUT) -> Optional[Dict]:
+        if self._claim_script is None:
+            self._claim_script = self.client.register_script(_CLAIM_SCRIPT)
+        now = time.time()
+        job_id = self._claim_script(
+            keys=[self.queue_key, self.processing_key],
+            args=[now + visibility_timeout, worker_id, self.job_prefix, now]
+        )
+        if not job_id:
+            return None
+        return self.get(job_id.decode() if isinstance(job_id, bytes) else job_id)
+
+    def heartbeat(self, job_id: str, visibility_timeout: float = JOB_VISIBILITY_TIMEOUT):
+        self.client.zadd(self.processing_key, {job_id: time.time() + visibility_timeout}, xx=True)
+
+    def complete(self, job_id: str, result):
+        self._finish(job_id, {"status": "done", "result": json.dumps(result, default=str)})
+
+    def fail(self, job_id: str, error: str):
+        self._finish(job_id, {"status": "failed", "error": error})
+
+    def _finish(self, job_id: str, fields: Dict):
+        fields["finished_at"] = time.time()
+        pipe = self.client.pipeline()
+        pipe.zrem(self.processing_key, job_id)
+        pipe.hset(self.job_prefix + job_id, mapping=fields)
+        pipe.expire(self.job_prefix + job_id, self.result_ttl)
+        pipe.execute()
+
+    def requeue_expired(self) -> int:
+        if self._requeue_script is None:
+            self._requeue_script = self.client.register_script(_REQUEUE_SCRIPT)
+        now = time.time()
+        return int(self._requeue_script(
+            keys=[self.processing_key, self.queue_key],
+            args=[now, self.job_prefix, self.max_attempts, now, self.result_ttl]
+        ))
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        raw = self.client.hgetall(self.job_prefix + job_id)
+        return _decode_job(raw) if raw else None
+
+    def queued_count(self) -> int:
+        return int(self.client.zcard(self.queue_key))
+
+
+class InMemoryJobQueue:
+    """
+    In-process stand-in for RedisJobQueue with the same interface and semantics, for
+    development without Redis and for tests. Only workers in the same process (see
+    jobs.worker.start_worker_threads) can consume it.
+    """
+
+    def __init__(self, result_ttl: int = JOB_RESULT_TTL, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.result_ttl = result_ttl
+        self.max_attempts = max_attempts
+        self._jobs = {}
+        self._queue = {}
+        self._processing = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def submit(self, payload: Dict, priority: int = 0) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        score = _score(priority, now)
+        with self._lock:
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "payload": json.loads(json.dumps(payload)),
+                "priority": priority,
+                "score": score,
+                "attempts": 0,
+                "submitted_at": now
+            }
+            self._queue[job_id] = score
+        return job_id
+
+    def claim(self, worker_id: str, visibility_timeout: float = JOB_VISIBILITY_TIMEOUT) -> Optional[Dict]:
+        with self._lock:
+            if not self._queue:
+                return None
+            job_id = min(self._queue, key=self._queue.get)
+            del self._queue[job_id]
+            now = time.time()
+            self._processing[job_id] = now + visibility_timeout
+            job = self._jobs[job_id]
+            job.update(status="running", worker=worker_id, started_at=now, attempts=job["attempts"] + 1)
+            return dict(job)
+
+    def heartbeat(self, job_id: str, visibility_timeout: float = JOB_VISIBILITY_TIMEOUT):
+        with self._lock:
+            if job_id in self._processing:
+                self._processing[job_id] = time.time() + visibility_timeout
+
+    def complete(self, job_id: str, result):
+        self._finish(job_id, {"status": "done", "result": json.loads(json.dumps(result, default=str))})
+
+    def fail(self, job_id: str, error: str):
+        self._finish(job_id, {"status": "failed", "error": error})
+
+    def _finish(self, job_id: str, fields: Dict):
+        with self._lock:
+            self._processing.pop(job_id, None)
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields, finished_at=time.time())
+                self._expires[job_id] = time.time() + self.result_ttl
+
+    def requeue_expired(self) -> int:
+        requeued = 0
+        now = time.time()
+        with self._lock:
+            for job_id, deadline in list(self._processing.items()):
+                if deadline > now:
+                    continue
+                del self._processing[job_id]
+                job = self._jobs[job_id]
+                if job["attempts"] >= self.max_attempts:
+                    job.update(
+                        status="failed",
+                        finished_at=now,
+                        error="Job abandoned: the worker died or exceeded the visibility timeout too many times"
+                    )
+                    self._expires[job_id] = now + self.result_ttl
+                else:
+                    job["status"] = "queued"
+                    self._queue[job_id] = job["score"]
+                    requeued += 1
+        return requeued
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            expires_at = self._expires.get(job_id)
+            if expires_at is not None and expires_at <= time.time():
+                self._jobs.pop(job_id, None)
+                self._expires.pop(job_id, None)
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def queued_count(self) -> int:
+        with self._lock:
+            return len(self._queue)
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Return the process-wide job queue for the configured JOB_QUEUE_BACKEND ('redis' or 'memory')."""
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = InMemoryJobQueue() if JOB_QUEUE_BACKEND == "memory" else RedisJobQueue()
+    return _job_queue
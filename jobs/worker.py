@@ -0,0 +1,141 @@
+"""
+Agent run workers: pull jobs from the job queue and execute CodeAgent.run_agent.
+
+    python -m jobs.worker --processes 4
+
+Every worker process heartbeats the job it is running so that the job stays
+invisible to other workers; if the process dies, the visibility deadline passes
+and the job is requeued by whichever worker next sweeps for expired jobs.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+from jobs.job_queue import JOB_VISIBILITY_TIMEOUT, JobQueueUnavailable, get_job_queue
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKER_PROCESSES = int(os.getenv("JOB_WORKER_PROCESSES", 2))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 0.5))
+JOB_REQUEUE_INTERVAL = float(os.getenv("JOB_REQUEUE_INTERVAL", 10))
+
+
+def run_job(job_queue, job, worker_id: str, visibility_timeout: float = JOB_VISIBILITY_TIMEOUT):
+    from code_agent.code_agent import CodeAgent
+    from sessions.session_store import finish_turn
+
+    job_id = job["id"]
+    payload = job["payload"]
+    stop_heartbeat = threading.Event()
+
+    def heartbeat():
+        while not stop_heartbeat.wait(visibility_timeout / 3):
+            try:
+                job_queue.heartbeat(job_id, visibility_timeout)
+            except Exception as e:
+                logger.warning(f"Heartbeat for job {job_id} failed: {e}")
+
+    threading.Thread(target=heartbeat, name=f"heartbeat-{job_id[:8]}", daemon=True).start()
+    logger.info(f"Worker {worker_id} running job {job_id} (attempt {job.get('attempts', 1)})")
+    try:
+        code_agent = CodeAgent(
+            chat_history=payload.get("session_chat_history", []),
+            import_libraries=payload.get("import_libraries", []),
+            request_id=job_id
+        )
+        final_answer = code_agent.run_agent()
+        job_queue.complete(job_id, {"assistant": final_answer})
+        finish_turn(payload.get("session_id"), final_answer)
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {e}")
+        logger.error(traceback.format_exc())
+        job_queue.fail(job_id, str(e))
+    finally:
+        stop_heartbeat.set()
+
+
+def work_loop(job_queue, worker_id: str, stop_event=None):
+    last_requeue = 0.0
+    while stop_event is None or not stop_event.is_set():
+        try:
+            if time.monotonic() - last_requeue > JOB_REQUEUE_INTERVAL:
+                requeued = job_queue.requeue_expired()
+                if requeued:
+                    logger.warning(f"Requeued {requeued} jobs whose worker stopped heartbeating")
+                last_requeue = time.monotonic()
+
+            job = job_queue.claim(worker_id)
+        except JobQueueUnavailable as e:
+            logger.warning(f"Job queue unavailable: {e}")
+            time.sleep(5)
+            continue
+
+        if job is None:
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        run_job(job_queue, job, worker_id)
+
+
+def start_worker_threads(count: int, job_queue=None):
+    """Consume the queue from threads of this process; used with the in-memory backend."""
+    job_queue = job_queue or get_job_queue()
+    stop_event = threading.Event()
+    for index in range(count):
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:thread-{index}"
+        threading.Thread(
+            target=work_loop,
+            args=(job_queue, worker_id, stop_event),
+            name=f"job-worker-{index}",
+            daemon=True
+        ).start()
+    return stop_event
+
+
+def _process_main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s %(processName)s: %(message)s"
+    )
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    work_loop(get_job_queue(), worker_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run agent job workers against the Redis job queue.")
+    parser.add_argument("--processes", type=int, default=JOB_WORKER_PROCESSES)
+    args = parser.parse_args()
+
+    # The worker processes write their metrics to METRICS_MULTIPROC_DIR, read by the web's /metrics
+    metrics.clear_multiprocess_dir()
+    processes = {}
+
+    def start(index):
+        process = multiprocessing.Process(target=_process_main, name=f"job-worker-{index}")
+        process.start()
+        processes[index] = process
+
+    for index in range(args.processes):
+        start(index)
+
+    # Supervise: a worker that dies is replaced; its job comes back after the visibility timeout
+    try:
+        while True:
+            time.sleep(1)
+            for index, process in list(processes.items()):
+                if not process.is_alive():
+                    logging.warning(f"Worker {process.name} exited with code {process.exitcode}, restarting")
+                    start(index)
+    except KeyboardInterrupt:
+        for process in processes.values():
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+import glob
+import json
+import logging
+import math
+import os
+import socket
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a cached answer to a slow reasoning-model call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+COUNT_BUCKETS = (1, 2, 3, 4, 5, 10)
+
+# Directory shared by all processes of a deployment (gunicorn workers, job worker processes).
+# When set, each process writes its values there and /metrics adds up every process's file,
+# so a scrape of any worker returns the totals. Unset, the registry is per process.
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR") or None
+# Seconds between two writes of a process's values to its file
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple[Tuple[str, str], ...]:
+        return tuple((name, str(labels.get(name, ""))) for name in self.labelnames)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        _claim_process()
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _forward(self.name, "inc", labels, amount)
+
+    @staticmethod
+    def merge(total: Dict, snapshot: Dict):
+        for key, value in snapshot.items():
+            total[key] = total.get(key, 0) + value
+
+    def samples(self, values: Optional[Dict] = None) -> List[str]:
+        values = self.snapshot() if values is None else values
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values = {}  # key -> [bucket counts..., sum, count]
+
+    @staticmethod
+    def _copy(value):
+        return list(value)
+
+    def observe(self, value: float, **labels):
+        _claim_process()
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+        _forward(self.name, "observe", labels, value)
+
+    def merge(self, total: Dict, snapshot: Dict):
+        for key, series in snapshot.items():
+            # A file written with other buckets, by an older version of this process, is left out
+            if len(series) != len(self.buckets) + 2:
+                continue
+            current = total.setdefault(key, [0] * len(series))
+            for index, value in enumerate(series):
+                current[index] += value
+
+    def samples(self, snapshot: Optional[Dict] = None) -> List[str]:
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        lines = []
+        for key, series in sorted(snapshot.items()):
+            cumulative = 0
+            for index, bound in enumerate(self.buckets):
+                cumulative += series[index]
+                bucket_labels = key + (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def clear(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+    def render(self, snapshots: Optional[Dict[str, Dict]] = None) -> str:
+        """Prometheus text exposition format (version 0.0.4), of snapshots when given."""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples(None if snapshots is None else snapshots.get(metric.name, {})))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# In sandbox worker processes observations are also buffered here, shipped back with
+# the job response and replayed into the web process registry.
+_forwarded = None
+_forward_lock = threading.Lock()
+
+
+def _forward(name: str, operation: str, labels: Dict, value: float):
+    if _forwarded is None:
+        return
+    with _forward_lock:
+        _forwarded.append((name, operation, labels, value))
+
+
+def enable_forwarding():
+    """Forward this process's observations instead of writing them to the multiprocess directory."""
+    global _forwarded
+    _forwarded = []
+
+
+def drain_forwarded() -> List:
+    global _forwarded
+    if _forwarded is None:
+        return []
+    with _forward_lock:
+        events, _forwarded = _forwarded, []
+    return events
+
+
+def replay(events: List):
+    """Apply observations forwarded from another process to this process's registry."""
+    for name, operation, labels, value in events or []:
+        metric = REGISTRY.get(name)
+        if metric is not None:
+            getattr(metric, operation)(value, **labels)
+
+
+# Multiprocess mode: each process writes a snapshot of its registry to <dir>/<host>-<pid>.json
+# from a background thread. Files of exited processes are kept, so counters do not go back
+# when a worker is replaced.
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _process_file(pid: Optional[int] = None) -> str:
+    return os.path.join(METRICS_MULTIPROC_DIR, f"{socket.gethostname()}-{pid or os.getpid()}.json")
+
+
+def _claim_process():
+    """
+    Start the flusher of this process on its first observation. A forked child first
+    drops the values it inherited: they are counted in its parent's file.
+    """
+    global _flusher_pid
+    if METRICS_MULTIPROC_DIR is None or _flusher_pid == os.getpid() or _forwarded is not None:
+        return
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        if _flusher_pid is not None:
+            REGISTRY.clear()
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_loop, args=(_flusher_pid,), name="metrics-flusher", daemon=True).start()
+
+
+def _flush_loop(pid: int):
+    while os.getpid() == pid:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush()
+
+
+def flush():
+    """Write this process's values to its file in the multiprocess directory."""
+    if METRICS_MULTIPROC_DIR is None or _flusher_pid != os.getpid() or _forwarded is not None:
+        return
+    snapshots = {
+        name: [[list(key), value] for key, value in values.items()]
+        for name, values in REGISTRY.snapshot().items() if values
+    }
+    path = _process_file()
+    temporary_path = f"{path}.tmp"
+    try:
+        os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+        with open(temporary_path, "w") as metrics_file:
+            json.dump(snapshots, metrics_file)
+        os.replace(temporary_path, path)
+    except OSError as e:
+        logger.warning(f"⚠️ Could not write metrics to {path}: {e}")
+
+
+def clear_multiprocess_dir():
+    """Remove the files of this host's earlier processes; called once when a server or worker pool starts."""
+    if METRICS_MULTIPROC_DIR is None:
+        return
+    for path in glob.glob(os.path.join(METRICS_MULTIPROC_DIR, f"{glob.escape(socket.gethostname())}-*.json")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _aggregate() -> Dict[str, Dict]:
+    """Sum the values of every process file in the multiprocess directory."""
+    flush()
+    totals = {}
+    for path in glob.glob(os.path.join(METRICS_MULTIPROC_DIR, "*.json")):
+        try:
+            with open(path) as metrics_file:
+                snapshots = json.load(metrics_file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Skipping unreadable metrics file {path}: {e}")
+            continue
+        for name, values in snapshots.items():
+            metric = REGISTRY.get(name)
+            if metric is None:
+                continue
+            metric.merge(totals.setdefault(name, {}), {
+                tuple(tuple(pair) for pair in key): value for key, value in values
+            })
+    return totals
+
+
+def render_metrics() -> str:
+    if METRICS_MULTIPROC_DIR is None:
+        return REGISTRY.render()
+    return REGISTRY.render(_aggregate())
+
+
+# Model calls
+LLM_CALLS = REGISTRY.register(Counter(
+    "llm_calls_total", "Model calls by model, call site and outcome (ok, error, circuit_open, deadline, cache_hit).",
+    ["model", "call_site", "outcome"]
+))
+LLM_CALL_DURATION = REGISTRY.register(Histogram(
+    "llm_call_duration_seconds", "Latency of model calls, including cache hits.",
+    ["model", "call_site", "outcome"]
+))
+LLM_PROMPT_TOKENS = REGISTRY.register(Counter(
+    "llm_prompt_tokens_total", "Prompt tokens reported by the API.", ["model", "call_site"]
+))
+LLM_COMPLETION_TOKENS = REGISTRY.register(Counter(
+    "llm_completion_tokens_total", "Completion tokens reported by the API.", ["model", "call_site"]
+))
+LLM_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "llm_cache_lookups_total", "Response cache lookups by result (hit, miss, bypass).", ["result"]
+))
+LLM_ROUTE_FALLBACKS = REGISTRY.register(Counter(
+    "llm_route_fallbacks_total", "Calls moved to another model of their route, by reason (timeout, rate_limit, circuit_open, invalid_json, ...).",
+    ["call_site", "reason"]
+))
+LLM_RETRIES = REGISTRY.register(Counter(
+    "llm_retries_total", "Retried model requests by failure reason.", ["call_site", "reason"]
+))
+LLM_BREAKER_TRANSITIONS = REGISTRY.register(Counter(
+    "llm_breaker_transitions_total", "Circuit breaker state changes by model and new state.", ["model", "state"]
+))
+LLM_HEDGES = REGISTRY.register(Counter(
+    "llm_hedges_total", "Hedged requests: duplicates sent, and duplicates that answered first.", ["call_site", "result"]
+))
+
+# Agent runs
+AGENT_STAGE_DURATION = REGISTRY.register(Histogram(
+    "agent_stage_duration_seconds", "Wall time of agent stages (plan, execute, evaluate).", ["stage"]
+))
+AGENT_SUBTASK_DURATION = REGISTRY.register(Histogram(
+    "agent_subtask_duration_seconds", "Wall time of individual subtasks.", ["status"]
+))
+AGENT_SUBTASK_OUTPUT_BYTES = REGISTRY.register(Histogram(
+    "agent_subtask_output_bytes", "Size of the text form of subtask outputs.", [], buckets=SIZE_BUCKETS
+))
+AGENT_SUBTASKS = REGISTRY.register(Counter(
+    "agent_subtasks_total", "Subtasks by status (ok, error, reused).", ["status"]
+))
+AGENT_SUBTASK_VALIDATIONS = REGISTRY.register(Counter(
+    "agent_subtask_validations_total", "Static checks of planned subtasks by result (ok, repaired, invalid).", ["result"]
+))
+AGENT_SUBTASK_LIMITS = REGISTRY.register(Counter(
+    "agent_subtask_limits_total", "Subtasks stopped by a limit, by kind (wall_clock, cpu, memory, run_deadline).", ["kind"]
+))
+SANDBOX_QUEUE_WAIT = REGISTRY.register(Histogram(
+    "sandbox_queue_wait_seconds", "Time subtasks waited for a free sandbox worker, not charged to their limits."
+))
+SUBTASK_CODE_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "subtask_code_cache_lookups_total", "Compiled subtask code lookups by result (hit, miss).", ["result"]
+))
+ARTIFACTS_SPILLED = REGISTRY.register(Counter(
+    "artifacts_spilled_total", "Tool outputs written to the artifact store by kind (text, bytes, pickle).", ["kind"]
+))
+ARTIFACT_SPILLED_BYTES = REGISTRY.register(Counter(
+    "artifact_spilled_bytes_total", "Bytes of tool outputs written to the artifact store.", []
+))
+AGENT_BATCH_TASKS = REGISTRY.register(Counter(
+    "agent_batch_tasks_total", "Tasks of batch requests by disposition (run, joined, deduplicated, failed).", ["disposition"]
+))
+TOOL_SELECTIONS = REGISTRY.register(Counter(
+    "tool_selections_total", "Tool selection and parameter extraction decisions by call site and path (cache, local, model_narrowed, model).", ["call_site", "path"]
+))
+AGENT_ITERATIONS = REGISTRY.register(Histogram(
+    "agent_iterations", "Iterations needed per agent run.", [], buckets=COUNT_BUCKETS
+))
+AGENT_EVALUATIONS = REGISTRY.register(Counter(
+    "agent_evaluations_total", "Evaluation verdicts.", ["verdict", "evaluator"]
+))
+AGENT_RUNS = REGISTRY.register(Counter(
+    "agent_runs_total", "Agent runs by outcome (satisfactory, max_iterations, deadline, error).", ["outcome"]
+))
+
+# Plan cache
+PLAN_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "plan_cache_lookups_total",
+    "Plan cache lookups by result (exact, templated, rebound, miss, rebind_failed).", ["result"]
+))
+PLAN_CACHE_REMOVALS = REGISTRY.register(Counter(
+    "plan_cache_removals_total", "Cached plans dropped by reason (capacity, expired, invalidated).", ["reason"]
+))
+
+# Verified tool library
+VERIFIED_TOOLS = REGISTRY.register(Counter(
+    "verified_tools_total", "Tools recorded in the verified tool library (registered, reverified).", ["event"]
+))
+VERIFIED_TOOL_REFERENCES = REGISTRY.register(Counter(
+    "verified_tool_references_total", "Plan subtasks that referenced a verified tool, by result (resolved, unresolved).", ["result"]
+))
+
+
+def observe_llm_call(model: str, call_site: str, outcome: str, seconds: float, usage=None):
+    LLM_CALLS.inc(model=model, call_site=call_site, outcome=outcome)
+    LLM_CALL_DURATION.observe(seconds, model=model, call_site=call_site, outcome=outcome)
+    if usage is not None:
+        LLM_PROMPT_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, model=model, call_site=call_site)
+        LLM_COMPLETION_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, model=model, call_site=call_site)
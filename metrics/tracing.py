@@ -0,0 +1,340 @@
+"""
+Per-run span tracing. An agent run records a tree of timed spans (planning, parsing,
+subtasks, tool calls, model calls, evaluation) with attributes such as tokens, bytes
+and errors. When the run ends its trace is kept in memory and written as an OTLP/JSON
+file named after the request id, so one slow request can be examined after the fact.
+Spans recorded in sandbox workers are shipped back with the job response and adopted
+into the run's trace, like forwarded metrics.
+"""
+import contextvars
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_DIR = os.getenv("TRACE_DIR") or os.path.join(tempfile.gettempdir(), "code-agent-traces")
+# Trace files older than this many seconds are deleted
+TRACE_MAX_AGE = int(os.getenv("TRACE_MAX_AGE", 7 * 86400))
+# Finished traces also kept in memory, the most recent first
+TRACE_MEMORY_TRACES = int(os.getenv("TRACE_MEMORY_TRACES", 100))
+# Spans recorded per trace at most; a runaway loop of model calls cannot grow a trace without bound
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", 2000))
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "code-agent")
+
+SWEEP_INTERVAL = 60
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def valid_request_id(request_id) -> bool:
+    """Request ids name trace files: letters, digits, '_', '.' and '-' only."""
+    return isinstance(request_id, str) and bool(_REQUEST_ID_PATTERN.match(request_id)) and request_id not in (".", "..")
+
+
+class Trace:
+    def __init__(self, request_id: Optional[str], trace_id: Optional[str] = None):
+        self.request_id = request_id
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.spans = []  # Finished spans, as dicts
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def add(self, span: Dict):
+        with self._lock:
+            if len(self.spans) < TRACE_MAX_SPANS:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: Trace, parent_id: Optional[str], name: str, attributes: Dict):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {}
+        self.error = None
+        self.set(**attributes)
+
+    def set(self, **attributes):
+        """Add attributes; None values are left out."""
+        self.attributes.update((key, value) for key, value in attributes.items() if value is not None)
+
+    def record_error(self, error):
+        """Mark the span failed, with an exception or an error message."""
+        self.error = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        self.trace.add({
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "attributes": self.attributes,
+            "error": self.error
+        })
+
+
+class _NoopSpan:
+    """What span() gives outside a traced run: every operation does nothing."""
+
+    span_id = None
+
+    def set(self, **attributes):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _RemoteParent:
+    """Stands in a sandbox worker for the span of the agent process that sent the job."""
+
+    def __init__(self, trace: Trace, span_id: str):
+        self.trace = trace
+        self.span_id = span_id
+
+    def set(self, **attributes):
+        pass
+
+
+# The innermost open span of the current context, or None outside a traced run
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+def start_span(name: str, **attributes):
+    """
+    Start a span under the current one without making it current, for work that does not
+    fit a with block, such as a stream consumed across generator steps. Call end() on it.
+    """
+    parent = _current.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(parent.trace, parent.span_id, name, attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Record the block as a span under the current one; an exception escaping it marks the span failed."""
+    current = start_span(name, **attributes)
+    if current is NOOP_SPAN:
+        yield current
+        return
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_error(e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+
+
+def annotate(**attributes):
+    """Add attributes to the current span, if any."""
+    current = _current.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def within(current, iterator: Iterator) -> Iterator:
+    """
+    Iterate in a context of its own where current is the open span, so spans started
+    while producing the items nest under it whichever thread pulls them.
+    """
+    context = contextvars.copy_context()
+    if current is not NOOP_SPAN:
+        context.run(_current.set, current)
+    while True:
+        try:
+            item = context.run(next, iterator)
+        except StopIteration:
+            return
+        yield item
+
+
+@contextmanager
+def trace_run(request_id: str, name: str, **attributes):
+    """
+    Trace the block as a run: its spans are collected under a root span and stored by
+    request_id when it ends. Inside a run already traced, it is an ordinary span.
+    """
+    if not TRACING_ENABLED or _current.get() is not None:
+        with span(name, **attributes) as current:
+            yield current
+        return
+    trace = Trace(request_id)
+    root = Span(trace, None, name, dict(attributes, **{"request.id": request_id}))
+    token = _current.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.record_error(e)
+        raise
+    finally:
+        _current.reset(token)
+        if trace.dropped:
+            root.set(dropped_spans=trace.dropped)
+        root.end()
+        store(trace)
+
+
+def remote_context() -> Optional[Tuple[str, str]]:
+    """(trace id, span id) of the current span, for a sandbox job to record its spans under."""
+    current = _current.get()
+    if current is None:
+        return None
+    return current.trace.trace_id, current.span_id
+
+
+@contextmanager
+def remote_trace(context: Optional[Tuple[str, str]]):
+    """In a sandbox worker: collect the job's spans under the sender's span. Yields the Trace, or None."""
+    if not context:
+        yield None
+        return
+    trace = Trace(None, trace_id=context[0])
+    token = _current.set(_RemoteParent(trace, context[1]))
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def adopt(spans: List[Dict]):
+    """Add spans recorded in another process to the current trace."""
+    current = _current.get()
+    if current is None:
+        return
+    for remote_span in spans or []:
+        current.trace.add(remote_span)
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, str):
+        return {"stringValue": value}
+    return {"stringValue": json.dumps(value, default=str)}
+
+
+def to_otlp(trace: Trace) -> Dict:
+    """The trace in the OTLP/JSON encoding of an ExportTraceServiceRequest."""
+    spans = []
+    for recorded in sorted(trace.spans, key=lambda recorded: recorded["start_ns"]):
+        otlp_span = {
+            "traceId": recorded["trace_id"],
+            "spanId": recorded["span_id"],
+            "name": recorded["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(recorded["start_ns"]),
+            "endTimeUnixNano": str(recorded["end_ns"]),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in recorded["attributes"].items()],
+            "status": {"code": 2, "message": recorded["error"]} if recorded["error"] else {"code": 1}
+        }
+        if recorded["parent_id"]:
+            otlp_span["parentSpanId"] = recorded["parent_id"]
+        spans.append(otlp_span)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [
+            {"key": "service.name", "value": {"stringValue": SERVICE_NAME}},
+            {"key": "request.id", "value": {"stringValue": trace.request_id or ""}}
+        ]},
+        "scopeSpans": [{"scope": {"name": "code_agent"}, "spans": spans}]
+    }]}
+
+
+_recent = OrderedDict()  # request id -> OTLP document
+_recent_lock = threading.Lock()
+_swept_at = [0.0]
+
+
+def store(trace: Trace):
+    """Keep a finished trace in memory and write it to TRACE_DIR/<request id>.json."""
+    if not valid_request_id(trace.request_id):
+        return
+    document = to_otlp(trace)
+    with _recent_lock:
+        _recent[trace.request_id] = document
+        _recent.move_to_end(trace.request_id)
+        while len(_recent) > TRACE_MEMORY_TRACES:
+            _recent.popitem(last=False)
+
+    path = os.path.join(TRACE_DIR, f"{trace.request_id}.json")
+    try:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as trace_file:
+            json.dump(document, trace_file, default=str)
+        os.replace(temporary_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write trace {trace.request_id} to {path}: {e}")
+    _sweep()
+
+
+def get_trace(request_id: str) -> Optional[Dict]:
+    """The OTLP document of a finished run, from memory or from the trace files of any process."""
+    if not valid_request_id(request_id):
+        return None
+    with _recent_lock:
+        document = _recent.get(request_id)
+    if document is not None:
+        return document
+    try:
+        with open(os.path.join(TRACE_DIR, f"{request_id}.json")) as trace_file:
+            return json.load(trace_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _sweep():
+    now = time.time()
+    if now - _swept_at[0] < SWEEP_INTERVAL:
+        return
+    _swept_at[0] = now
+    cutoff = now - TRACE_MAX_AGE
+    try:
+        entries = os.scandir(TRACE_DIR)
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
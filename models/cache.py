@@ -0,0 +1,155 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from storage.redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 512))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 3600))
+LLM_CACHE_REDIS_TTL = int(os.getenv("LLM_CACHE_REDIS_TTL", 86400))
+LLM_CACHE_REDIS_PREFIX = os.getenv("LLM_CACHE_REDIS_PREFIX", "llm-cache:")
+
+
+def canonicalize_messages(messages: List[Dict]) -> List[Dict]:
+    """Normalize a chat history so equivalent requests produce the same key."""
+    canonical = []
+    for message in messages or []:
+        content = message.get("content", "")
+        if isinstance(content, str):
+            content = content.replace("\r\n", "\n").strip()
+        canonical.append({
+            "role": message.get("role", ""),
+            "content": content
+        })
+    return canonical
+
+
+def make_cache_key(model: str, messages: List[Dict], params: Optional[Dict] = None) -> str:
+    payload = json.dumps(
+        {
+            "model": model,
+            "messages": canonicalize_messages(messages),
+            "params": params or {}
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Two-tier cache for model answers: an in-process LRU with TTL eviction
+    in front of a shared Redis tier. Redis failures never fail a call,
+    they only turn the lookup into a miss.
+    """
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl: float = LLM_CACHE_TTL,
+                 redis_ttl: int = LLM_CACHE_REDIS_TTL, redis_prefix: str = LLM_CACHE_REDIS_PREFIX):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.redis_ttl = redis_ttl
+        self.redis_prefix = redis_prefix
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stores": 0,
+            "evictions": 0
+        }
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["local_hits"] += 1
+                    return value
+                del self._entries[key]
+                self._stats["evictions"] += 1
+
+        value = self._redis_get(key)
+        with self._lock:
+            if value is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["redis_hits"] += 1
+        self._store_local(key, value)
+        return value
+
+    def set(self, key: str, value: str):
+        self._store_local(key, value)
+        self._redis_set(key, value)
+        with self._lock:
+            self._stats["stores"] += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+        client = get_redis_client()
+        if client is None:
+            return
+        try:
+            client.delete(self.redis_prefix + key)
+        except Exception as e:
+            logger.warning(f"LLM cache Redis delete failed: {e}")
+
+    def record_bypass(self):
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["local_entries"] = len(self._entries)
+        lookups = stats["local_hits"] + stats["redis_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["local_hits"] + stats["redis_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def _store_local(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _redis_get(self, key: str) -> Optional[str]:
+        client = get_redis_client()
+        if client is None:
+            return None
+        try:
+            value = client.get(self.redis_prefix + key)
+            return value.decode("utf-8") if value is not None else None
+        except Exception as e:
+            logger.warning(f"LLM cache Redis read failed: {e}")
+            return None
+
+    def _redis_set(self, key: str, value: str):
+        client = get_redis_client()
+        if client is None:
+            return
+        try:
+            client.set(self.redis_prefix + key, value, ex=self.redis_ttl)
+        except Exception as e:
+            logger.warning(f"LLM cache Redis write failed: {e}")
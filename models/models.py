@@ -1,8 +1,20 @@
-
 from openai import OpenAI
 import logging
 import os
+import time
 import traceback  
+from typing import Optional
+from metrics import metrics, tracing
+from models.cache import LLMCache, LLM_CACHE_ENABLED, make_cache_key
+from models.resilience import (
+    LLM_REQUEST_TIMEOUT,
+    CircuitOpenError,
+    DeadlineExceeded,
+    call_with_resilience,
+    failure_reason,
+    request_timeout
+)
+from models.routing import Route, is_valid_json, routing_policy
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,20 +28,226 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable is not set")
 
+# Point the client at any OpenAI-compatible server, e.g. the benchmark stand-in (benchmarks/fake_openai.py)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+# Retries are made by models/resilience.py, which also feeds the circuit breakers
 client = OpenAI(
-    api_key=OPENAI_API_KEY 
+    api_key=OPENAI_API_KEY,
+    base_url=OPENAI_BASE_URL,
+    timeout=LLM_REQUEST_TIMEOUT,
+    max_retries=0
 )
 
-def call_model(chat_history: str = None, model: str = "o1-mini") -> str:
+def reset_client():
+    """Create a fresh client, for server workers forked from a preloaded parent that must not share its connections."""
+    global client
+    client = OpenAI(
+        api_key=OPENAI_API_KEY,
+        base_url=OPENAI_BASE_URL,
+        timeout=LLM_REQUEST_TIMEOUT,
+        max_retries=0
+    )
+
+response_cache = LLMCache()
+
+def _prompt_chars(chat_history) -> int:
+    if isinstance(chat_history, list):
+        return sum(len(str(message.get("content", ""))) if isinstance(message, dict) else len(str(message)) for message in chat_history)
+    return len(str(chat_history or ""))
+
+def _usage_attributes(usage) -> dict:
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None)
+    }
+
+def _lookup_cache(chat_history, model: str, use_cache: bool, call_site: str, started_at: float):
+    """Return (cache_key, cached_answer); cache_key is None when the call site opted out."""
+    if not (use_cache and LLM_CACHE_ENABLED):
+        response_cache.record_bypass()
+        metrics.LLM_CACHE_LOOKUPS.inc(result="bypass")
+        return None, None
+
+    cache_key = make_cache_key(model, chat_history)
+    cached_answer = response_cache.get(cache_key)
+    if cached_answer is None:
+        metrics.LLM_CACHE_LOOKUPS.inc(result="miss")
+        return cache_key, None
+
+    logger.info(f"LLM cache hit for model '{model}' ({cache_key[:12]})")
+    metrics.LLM_CACHE_LOOKUPS.inc(result="hit")
+    metrics.observe_llm_call(model, call_site, "cache_hit", time.perf_counter() - started_at)
+    return cache_key, cached_answer
+
+
+def _complete(chat_history, model: str, call_site: str, route: Route) -> str:
+    started_at = time.perf_counter()
     try:
-        completion = client.chat.completions.create(
-            model=model, 
-            messages=chat_history
+        completion = call_with_resilience(
+            lambda: client.chat.completions.create(
+                model=model, 
+                messages=chat_history,
+                timeout=request_timeout(route.timeout)
+            ),
+            model=model,
+            call_site=call_site,
+            hedge_after=route.hedge_after
         )
 
         answer = completion.choices[0].message.content.strip()
+        metrics.observe_llm_call(model, call_site, "ok", time.perf_counter() - started_at, completion.usage)
+        tracing.annotate(model=model, **_usage_attributes(completion.usage))
         return answer
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        metrics.observe_llm_call(model, call_site, failure_reason(e), time.perf_counter() - started_at)
+        logger.error(str(e))
+        raise e
     except Exception as e:
-        logger.error(f"OpenAI API error: {str(e)}")
+        metrics.observe_llm_call(model, call_site, "error", time.perf_counter() - started_at)
+        logger.error(f"OpenAI API error from '{model}': {str(e)}")
         logger.error(traceback.format_exc())  
-        raise e
\ No newline at end of file
+        raise e
+
+
+def _complete_routed(chat_history, route: Route, call_site: str):
+    """Try the route's models in order and return (answer, model that answered); the error of the last one is raised."""
+    models = route.models
+    for attempt, model in enumerate(models):
+        try:
+            return _complete(chat_history, model, call_site, route), model
+        except Exception as e:
+            # No fallback can answer in time either
+            if attempt == len(models) - 1 or isinstance(e, DeadlineExceeded):
+                raise
+            reason = failure_reason(e)
+            metrics.LLM_ROUTE_FALLBACKS.inc(call_site=call_site, reason=reason)
+            logger.warning(f"🔁 '{model}' failed for '{call_site}' ({reason}), falling back to '{models[attempt + 1]}'")
+
+
+def call_model(chat_history: str = None, model: Optional[str] = None, use_cache: bool = True,
+               call_site: str = "elaborate", expect_json: bool = False) -> str:
+    """
+    Call the chat completion API. Identical (model, messages) requests are served
+    from the response cache unless the call site passes use_cache=False.
+    call_site labels the latency and token metrics; the agent's own calls name
+    themselves, and calls from generated subtask code default to "elaborate".
+    The models are chosen by the routing policy of the call site (models/routing.py):
+    fallbacks are tried in order on errors and timeouts, and with expect_json an
+    answer that is not valid JSON is asked again of the route's escalate_to model.
+    """
+    route = routing_policy.route(call_site, model)
+    with tracing.span(f"llm.{call_site}", call_site=call_site, model=route.model,
+                      prompt_chars=_prompt_chars(chat_history)) as llm_span:
+        started_at = time.perf_counter()
+        cache_key, cached_answer = _lookup_cache(chat_history, route.model, use_cache, call_site, started_at)
+        if cached_answer is not None:
+            llm_span.set(cache_hit=True, answer_chars=len(cached_answer))
+            return cached_answer
+
+        answer, answered_by = _complete_routed(chat_history, route, call_site)
+        if expect_json and route.escalate_to and not is_valid_json(answer):
+            metrics.LLM_ROUTE_FALLBACKS.inc(call_site=call_site, reason="invalid_json")
+            logger.warning(f"🔁 Answer for '{call_site}' is not valid JSON, escalating to '{route.escalate_to}'")
+            answered_by = route.escalate_to
+            answer = _complete(chat_history, answered_by, call_site, route)
+            llm_span.set(escalated=True)
+
+        llm_span.set(answer_chars=len(answer))
+        if cache_key:
+            # Keyed on the model that answered: a fallback's answer must not be served as the primary's
+            response_cache.set(make_cache_key(answered_by, chat_history), answer)
+        return answer
+
+
+def forget_cached_answer(chat_history, call_site: str, model: Optional[str] = None):
+    """
+    Evict the cached answers of every model of the call site's route to this chat
+    history, e.g. a plan that then failed evaluation, so the next call asks again.
+    """
+    route = routing_policy.route(call_site, model)
+    for answered_by in route.models + ([route.escalate_to] if route.escalate_to else []):
+        response_cache.delete(make_cache_key(answered_by, chat_history))
+
+
+def call_model_stream(chat_history: str = None, model: Optional[str] = None, use_cache: bool = True,
+                      call_site: str = "elaborate"):
+    """
+    Streaming variant of call_model: yields the answer as text deltas while the model
+    generates it. A cached answer is yielded in one piece; a completed stream is cached.
+    A route's fallbacks are only tried before the first delta is yielded, and answers
+    are never escalated: what was streamed cannot be taken back.
+    """
+    route = routing_policy.route(call_site, model)
+    # Not made current: the caller runs between the deltas, in its own spans
+    llm_span = tracing.start_span(f"llm.{call_site}", call_site=call_site, model=route.model,
+                                  prompt_chars=_prompt_chars(chat_history), streamed=True)
+    try:
+        yield from _stream_routed(chat_history, route, use_cache, call_site, llm_span)
+    except GeneratorExit:
+        raise
+    except BaseException as e:
+        llm_span.record_error(e)
+        raise
+    finally:
+        llm_span.end()
+
+
+def _stream_routed(chat_history, route: Route, use_cache: bool, call_site: str, llm_span):
+    """The deltas of call_model_stream, from the cache or the route's models in order."""
+    started_at = time.perf_counter()
+    cache_key, cached_answer = _lookup_cache(chat_history, route.model, use_cache, call_site, started_at)
+    if cached_answer is not None:
+        llm_span.set(cache_hit=True, answer_chars=len(cached_answer))
+        yield cached_answer
+        return
+
+    models = route.models
+    for attempt, model in enumerate(models):
+        started_at = time.perf_counter()
+        parts = []
+        try:
+            # Retried until the response starts; a stream that breaks later is not replayed
+            stream = call_with_resilience(
+                lambda: client.chat.completions.create(
+                    model=model,
+                    messages=chat_history,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=request_timeout(route.timeout)
+                ),
+                model=model,
+                call_site=call_site
+            )
+
+            usage = None
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+
+            metrics.observe_llm_call(model, call_site, "ok", time.perf_counter() - started_at, usage)
+            llm_span.set(model=model, answer_chars=sum(len(part) for part in parts), **_usage_attributes(usage))
+            if cache_key:
+                response_cache.set(make_cache_key(model, chat_history), "".join(parts).strip())
+            return
+        except Exception as e:
+            refused = isinstance(e, (CircuitOpenError, DeadlineExceeded))
+            metrics.observe_llm_call(model, call_site, failure_reason(e) if refused else "error", time.perf_counter() - started_at)
+            logger.error(f"OpenAI API streaming error from '{model}': {str(e)}")
+            if not refused:
+                logger.error(traceback.format_exc())
+            if parts or attempt == len(models) - 1 or isinstance(e, DeadlineExceeded):
+                raise e
+            reason = failure_reason(e)
+            metrics.LLM_ROUTE_FALLBACKS.inc(call_site=call_site, reason=reason)
+            logger.warning(f"🔁 '{model}' failed for '{call_site}' ({reason}), falling back to '{models[attempt + 1]}'")
+
+
+def get_cache_stats() -> dict:
+    return response_cache.stats()
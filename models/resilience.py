@@ -0,0 +1,280 @@
+import contextvars
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds before a request to the API is abandoned; routes can set their own
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", 120))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", 0.5))
+# Upper bound of a single wait, Retry-After included
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", 20))
+# Consecutive failures that open a model's circuit, and seconds before it lets a probe through
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", 5))
+LLM_BREAKER_RESET_TIMEOUT = float(os.getenv("LLM_BREAKER_RESET_TIMEOUT", 30))
+# Seconds after which a duplicate of a slow request is sent; 0 disables hedging
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", 0))
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", 32))
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+# Monotonic time by which the current request must be answered, set by deadline()
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the API while a model's circuit is open."""
+
+    def __init__(self, model: str, retry_in: float):
+        super().__init__(f"Circuit for model '{model}' is open, next probe in {retry_in:.1f}s")
+        self.model = model
+        self.retry_in = retry_in
+
+
+class DeadlineExceeded(Exception):
+    """Raised instead of calling the API, or waiting to retry, once the request's time budget is spent."""
+
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    Bound the time of everything run in this context, model calls included, to `seconds`
+    from now. Nested deadlines never extend an outer one; 0 or less adds no bound.
+    """
+    if not seconds or seconds <= 0:
+        yield
+        return
+    until = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(until if outer is None else min(outer, until))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_remaining() -> Optional[float]:
+    """Seconds left before the current deadline, None when there is none."""
+    until = _deadline.get()
+    return None if until is None else until - time.monotonic()
+
+
+def request_timeout(route_timeout: float = 0.0) -> float:
+    """Timeout of the next API request: the route's or the default, cut to what the deadline leaves."""
+    timeout = route_timeout or LLM_REQUEST_TIMEOUT
+    remaining = time_remaining()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise DeadlineExceeded("The request's deadline has passed")
+    return min(timeout, remaining)
+
+
+def is_retryable(error: Exception) -> bool:
+    """Timeouts, connection errors, rate limits and server errors; not requests the API rejected."""
+    if isinstance(error, APIConnectionError):  # APITimeoutError included
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def failure_reason(error: Exception) -> str:
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, DeadlineExceeded):
+        return "deadline"
+    if isinstance(error, APITimeoutError):
+        return "timeout"
+    if isinstance(error, APIConnectionError):
+        return "connection"
+    if isinstance(error, APIStatusError):
+        return "rate_limit" if error.status_code == 429 else f"http_{error.status_code}"
+    return "error"
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the server asked to wait, from retry-after-ms or Retry-After (seconds or HTTP date)."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, error: Exception) -> float:
+    """Retry-After when the server sent one, otherwise exponential backoff with full jitter."""
+    hinted = retry_after(error)
+    if hinted is not None:
+        return min(hinted, LLM_RETRY_MAX_DELAY)
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Per-model breaker: after `failure_threshold` consecutive retryable failures the
+    circuit opens and calls fail at once, so the route falls back instead of queueing
+    on a model that is down. After `reset_timeout` a single probe is let through; its
+    outcome closes the circuit or opens it again.
+    """
+
+    def __init__(self, model: str, failure_threshold: int = LLM_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = LLM_BREAKER_RESET_TIMEOUT):
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str):
+        if state != self.state:
+            self.state = state
+            metrics.LLM_BREAKER_TRANSITIONS.inc(model=self.model, state=state)
+            log = logger.warning if state == "open" else logger.info
+            log(f"⚡ Circuit for model '{self.model}' is now {state}")
+
+    def before_call(self):
+        """Raise CircuitOpenError unless the call may go out."""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            if self.state == "closed":
+                return
+            retry_in = self._opened_at + self.reset_timeout - time.monotonic()
+            if self.state == "open" and retry_in <= 0:
+                self._transition("half_open")
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return
+            raise CircuitOpenError(self.model, max(retry_in, 0.0))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            self._transition("closed")
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or (self.failure_threshold > 0 and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._probing = False
+                self._transition("open")
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(model: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if model not in _breakers:
+            _breakers[model] = CircuitBreaker(model)
+        return _breakers[model]
+
+
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+        return _hedge_executor
+
+
+def hedged(request: Callable, hedge_after: float, call_site: str):
+    """
+    Run the request; if it has not answered after hedge_after seconds, send a duplicate
+    and return whichever answer comes first. The slower request is left to finish on its
+    own and its answer discarded. Each runs in a copy of the caller's context, so its
+    logs still reach the agent run that made the call.
+    """
+    if not hedge_after or hedge_after <= 0:
+        return request()
+    executor = _get_hedge_executor()
+    primary = executor.submit(contextvars.copy_context().run, request)
+    done, _ = wait([primary], timeout=hedge_after)
+    if done:
+        return primary.result()
+
+    metrics.LLM_HEDGES.inc(call_site=call_site, result="sent")
+    hedge = executor.submit(contextvars.copy_context().run, request)
+    done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+    # The first to finish decides: a failure goes back to the retry loop rather than
+    # waiting on a request that is already known to be slow
+    future = primary if primary in done else hedge
+    result = future.result()
+    if future is hedge:
+        metrics.LLM_HEDGES.inc(call_site=call_site, result="won")
+    return result
+
+
+def call_with_resilience(request: Callable, model: str, call_site: str, hedge_after: float = 0.0):
+    """
+    Make a request to `model` through its circuit breaker, retrying retryable failures
+    with backoff. Errors that are not worth retrying, and CircuitOpenError, are raised
+    at once so the route can move on to its fallback. No retry is made that the deadline
+    of the request would not leave time to wait for.
+    """
+    breaker = breaker_for(model)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        remaining = time_remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"The request's deadline passed before '{model}' could be called for '{call_site}'")
+        breaker.before_call()
+        try:
+            result = hedged(request, hedge_after, call_site)
+        except Exception as e:
+            if not is_retryable(e):
+                # The API answered: the model is reachable even if it rejected this request
+                breaker.record_success()
+                raise
+            remaining = time_remaining()
+            if remaining is not None and remaining <= 0 and isinstance(e, APITimeoutError):
+                # Cut short by the request's deadline: no sign that the model is down
+                raise DeadlineExceeded(f"The request's deadline passed while waiting for '{model}' ({call_site})") from e
+            breaker.record_failure()
+            delay = backoff_delay(attempt, e)
+            if remaining is not None and remaining <= delay:
+                raise DeadlineExceeded(
+                    f"No time left before the request's deadline to retry '{model}' ({call_site}) after {failure_reason(e)}"
+                ) from e
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            reason = failure_reason(e)
+            metrics.LLM_RETRIES.inc(call_site=call_site, reason=reason)
+            logger.warning(f"⏳ '{model}' failed for '{call_site}' ({reason}), retry {attempt + 1}/{LLM_MAX_RETRIES} in {delay:.2f}s")
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import re
+from typing import Dict, List, Optional
+
+from models.resilience import LLM_HEDGE_AFTER
+
+logger = logging.getLogger(__name__)
+
+# JSON object mapping call sites to routes, e.g.
+# {"evaluate": {"model": "gpt-4o-mini", "fallbacks": ["o1-mini"], "timeout": 30, "escalate_to": "o1-mini", "hedge_after": 10}}
+MODEL_ROUTES = os.getenv("MODEL_ROUTES", "")
+# Path of a JSON file in the same format; MODEL_ROUTES entries take precedence over it
+MODEL_ROUTES_FILE = os.getenv("MODEL_ROUTES_FILE", "")
+# Seconds before a routed call gives up on a model and moves to its fallback; 0 keeps the client default
+MODEL_ROUTE_TIMEOUT = float(os.getenv("MODEL_ROUTE_TIMEOUT", 0))
+
+# Models of the agent's own call sites when nothing is configured: the historical choices
+DEFAULT_ROUTES = {
+    "plan": {"model": "o1-mini"},
+    "evaluate": {"model": "o1-mini"},
+    "replan": {"model": "o1-mini"},
+    "elaborate": {"model": "o1-mini"},
+    "tool-select": {"model": "gpt-4o"},
+    "param-extract": {"model": "gpt-4o"},
+    "repair": {"model": "gpt-4o-mini"},
+}
+
+
+class Route:
+    """
+    Models tried in order for one call site, the model a malformed JSON answer escalates
+    to, and the seconds after which a slow request is hedged with a duplicate.
+    """
+
+    def __init__(self, model: str, fallbacks: Optional[List[str]] = None, timeout: float = MODEL_ROUTE_TIMEOUT,
+                 escalate_to: Optional[str] = None, hedge_after: float = LLM_HEDGE_AFTER):
+        self.model = model
+        self.fallbacks = [fallback for fallback in fallbacks or [] if fallback != model]
+        self.timeout = timeout or None
+        self.escalate_to = escalate_to if escalate_to != model else None
+        self.hedge_after = hedge_after
+
+    @property
+    def models(self) -> List[str]:
+        return [self.model] + self.fallbacks
+
+    @classmethod
+    def from_config(cls, call_site: str, config) -> "Route":
+        if isinstance(config, str):
+            config = {"model": config}
+        if not isinstance(config, dict) or not config.get("model"):
+            raise ValueError(f"Route of call site '{call_site}' needs a model")
+        fallbacks = config.get("fallbacks", [])
+        if isinstance(fallbacks, str):
+            fallbacks = [fallbacks]
+        return cls(
+            model=config["model"],
+            fallbacks=fallbacks,
+            timeout=float(config.get("timeout", MODEL_ROUTE_TIMEOUT)),
+            escalate_to=config.get("escalate_to"),
+            hedge_after=float(config.get("hedge_after", LLM_HEDGE_AFTER))
+        )
+
+
+def _load_configured_routes() -> Dict[str, Dict]:
+    routes = {}
+    if MODEL_ROUTES_FILE:
+        try:
+            with open(MODEL_ROUTES_FILE) as routes_file:
+                routes.update(json.load(routes_file))
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read MODEL_ROUTES_FILE {MODEL_ROUTES_FILE}: {e}")
+    if MODEL_ROUTES:
+        try:
+            routes.update(json.loads(MODEL_ROUTES))
+        except ValueError as e:
+            logger.error(f"MODEL_ROUTES is not valid JSON, ignoring it: {e}")
+    return routes
+
+
+class RoutingPolicy:
+    """
+    Picks the models of a call from its call site. A route configured for the call
+    site wins over the model the caller asks for, so generated code that hard-codes
+    a model can still be rerouted; without one, the caller's model is used, and
+    callers that leave the model out get DEFAULT_ROUTES.
+    """
+
+    def __init__(self, configured: Optional[Dict] = None, defaults: Optional[Dict] = None):
+        self.defaults = {}
+        self.configured = {}
+        for call_site, config in (defaults if defaults is not None else DEFAULT_ROUTES).items():
+            self.defaults[call_site] = Route.from_config(call_site, config)
+        for call_site, config in (configured if configured is not None else _load_configured_routes()).items():
+            try:
+                self.configured[call_site] = Route.from_config(call_site, config)
+            except (TypeError, ValueError) as e:
+                logger.error(f"Ignoring the model route of '{call_site}': {e}")
+
+    def route(self, call_site: str, model: Optional[str] = None) -> Route:
+        if call_site in self.configured:
+            return self.configured[call_site]
+        if model:
+            return Route(model)
+        if call_site in self.defaults:
+            return self.defaults[call_site]
+        return self.defaults.get("elaborate") or Route("o1-mini")
+
+
+def is_valid_json(answer: str) -> bool:
+    """Whether a model answer parses as JSON after the clean-up the callers apply (code fences, Python literals)."""
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", answer.strip())
+    text = re.sub(r"\bTrue\b", "true", re.sub(r"\bFalse\b", "false", re.sub(r"\bNone\b", "null", text)))
+    try:
+        json.loads(text)
+        return True
+    except ValueError:
+        return False
+
+
+routing_policy = RoutingPolicy()
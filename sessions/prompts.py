@@ -0,0 +1,12 @@
+SESSION_SUMMARY_PROMPT = """
+You maintain the running summary of a conversation between a user and an AI assistant that solves tasks by writing and running code.
+Update the summary with the new messages below. Keep the facts a follow-up request may depend on: the user's goals and preferences, names, places, dates, numbers, files, URLs and the results the assistant produced. Drop greetings, formatting and anything superseded.
+
+Write plain text, at most {max_words} words, with no preamble.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+"""
@@ -0,0 +1,316 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from code_agent.compaction import estimate_tokens, truncate_middle
+from storage.redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# "redis", "memory", or "auto": Redis when it is reachable, otherwise in-process sessions
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "auto")
+SESSION_TTL = int(os.getenv("SESSION_TTL", 7 * 86400))
+SESSION_KEY_PREFIX = os.getenv("SESSION_KEY_PREFIX", "session:")
+# Token budget of the history handed to the agent, summary included
+SESSION_HISTORY_TOKEN_BUDGET = int(os.getenv("SESSION_HISTORY_TOKEN_BUDGET", 2000))
+# Messages always kept verbatim when older ones are folded into the summary
+SESSION_RECENT_MESSAGES = int(os.getenv("SESSION_RECENT_MESSAGES", 6))
+SESSION_SUMMARY_MODEL = os.getenv("SESSION_SUMMARY_MODEL", "gpt-4o-mini")
+SESSION_SUMMARY_MAX_WORDS = int(os.getenv("SESSION_SUMMARY_MAX_WORDS", 200))
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.:-]{1,128}$")
+
+
+class SessionStoreUnavailable(Exception):
+    """Raised when the session backend cannot be reached."""
+
+
+def valid_session_id(session_id) -> bool:
+    return isinstance(session_id, str) and bool(SESSION_ID_PATTERN.match(session_id))
+
+
+def _message_tokens(message: Dict) -> int:
+    return estimate_tokens(str(message.get("content", ""))) + 4
+
+
+def summarize(summary: str, messages: List[Dict], model: str = SESSION_SUMMARY_MODEL) -> str:
+    from models.models import call_model
+    from sessions.prompts import SESSION_SUMMARY_PROMPT
+
+    prompt = SESSION_SUMMARY_PROMPT.format(
+        max_words=SESSION_SUMMARY_MAX_WORDS,
+        summary=summary or "(empty)",
+        messages="\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    )
+    new_summary = call_model(
+        chat_history=[{"role": "user", "content": prompt}],
+        model=model,
+        call_site="session-summary"
+    )
+    # The word limit is a request, not a guarantee
+    return truncate_middle(new_summary.strip(), SESSION_SUMMARY_MAX_WORDS * 2)
+
+
+class _SessionPolicy:
+    """
+    Windowing and summarization shared by the backends. A session is an append-only
+    list of messages plus a rolling summary of the first `summarized_upto` of them;
+    only the messages after that point are ever read, so the cost of a turn does not
+    grow with the length of the conversation.
+    """
+
+    history_token_budget = SESSION_HISTORY_TOKEN_BUDGET
+    recent_messages = SESSION_RECENT_MESSAGES
+    summary_model = SESSION_SUMMARY_MODEL
+
+    def history(self, session_id: str) -> List[Dict]:
+        """The conversation as the agent should see it: summary, then the newest messages within the budget."""
+        summary, _, messages = self._read(session_id)
+        history = []
+        budget = self.history_token_budget
+        if summary:
+            history.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+            budget -= estimate_tokens(summary)
+
+        kept = []
+        for message in reversed(messages):
+            tokens = _message_tokens(message)
+            if kept and tokens > budget:
+                break
+            if not kept and tokens > budget:
+                # The newest message always goes in, cut down to what is left
+                message = dict(message, content=truncate_middle(str(message["content"]), max(budget, 100)))
+            kept.append(message)
+            budget -= tokens
+        if len(kept) < len(messages):
+            logger.info(f"Session {session_id}: {len(messages) - len(kept)} unsummarized messages left out of the window")
+        return history + kept[::-1]
+
+    def compact(self, session_id: str) -> bool:
+        """Fold everything but the newest messages into the summary once they outgrow the budget."""
+        summary, summarized_upto, messages = self._read(session_id)
+        if sum(_message_tokens(message) for message in messages) <= self.history_token_budget:
+            return False
+        folded = messages[:-self.recent_messages] if self.recent_messages else messages
+        if not folded:
+            return False
+
+        new_summary = summarize(summary, folded, self.summary_model)
+        if not self._set_summary(session_id, summarized_upto, summarized_upto + len(folded), new_summary):
+            logger.info(f"Session {session_id} was compacted concurrently, keeping the other summary")
+            return False
+        logger.info(f"Session {session_id}: folded {len(folded)} messages into the summary")
+        return True
+
+    def compact_async(self, session_id: str):
+        def run():
+            try:
+                self.compact(session_id)
+            except Exception as e:
+                # The window in history() still bounds the prompt; the next turn retries
+                logger.warning(f"Summarizing session {session_id} failed: {e}")
+
+        threading.Thread(target=run, name="session-compact", daemon=True).start()
+
+
+_READ_SCRIPT = """
+local summarized_upto = tonumber(redis.call('HGET', KEYS[2], 'summarized_upto') or '0')
+local summary = redis.call('HGET', KEYS[2], 'summary') or ''
+local messages = redis.call('LRANGE', KEYS[1], summarized_upto, -1)
+return {summary, tostring(summarized_upto), messages}
+"""
+
+_SET_SUMMARY_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'summarized_upto') or '0'
+if current ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'summarized_upto', ARGV[2], 'summary', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+
+class RedisSessionStore(_SessionPolicy):
+    """
+    Sessions in Redis: messages in a list (`<prefix><id>:messages`, appended with RPUSH)
+    and the summary in a hash (`<prefix><id>:meta`). Both expire SESSION_TTL seconds
+    after the last turn. The summary is replaced with a compare-and-set on
+    summarized_upto, so concurrent compactions cannot fold the same messages twice.
+    """
+
+    def __init__(self, client=None, prefix: str = SESSION_KEY_PREFIX, ttl: int = SESSION_TTL):
+        self._client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self._read_script = None
+        self._set_summary_script = None
+
+    @property
+    def client(self):
+        client = self._client or get_redis_client()
+        if client is None:
+            raise SessionStoreUnavailable("Redis is not reachable")
+        return client
+
+    def _keys(self, session_id: str) -> Tuple[str, str]:
+        return f"{self.prefix}{session_id}:messages", f"{self.prefix}{session_id}:meta"
+
+    def append(self, session_id: str, message: Dict) -> int:
+        messages_key, meta_key = self._keys(session_id)
+        try:
+            pipeline = self.client.pipeline()
+            pipeline.rpush(messages_key, json.dumps({"role": message["role"], "content": message["content"]}))
+            pipeline.expire(messages_key, self.ttl)
+            pipeline.expire(meta_key, self.ttl)
+            return pipeline.execute()[0]
+        except SessionStoreUnavailable:
+            raise
+        except Exception as e:
+            raise SessionStoreUnavailable(str(e))
+
+    def delete(self, session_id: str):
+        try:
+            self.client.delete(*self._keys(session_id))
+        except SessionStoreUnavailable:
+            raise
+        except Exception as e:
+            raise SessionStoreUnavailable(str(e))
+
+    def _read(self, session_id: str) -> Tuple[str, int, List[Dict]]:
+        try:
+            client = self.client
+            if self._read_script is None:
+                self._read_script = client.register_script(_READ_SCRIPT)
+            summary, summarized_upto, raw_messages = self._read_script(keys=list(self._keys(session_id)), client=client)
+        except SessionStoreUnavailable:
+            raise
+        except Exception as e:
+            raise SessionStoreUnavailable(str(e))
+        if isinstance(summary, bytes):
+            summary = summary.decode("utf-8")
+        return summary, int(summarized_upto), [json.loads(raw) for raw in raw_messages]
+
+    def _set_summary(self, session_id: str, expected_upto: int, summarized_upto: int, summary: str) -> bool:
+        try:
+            client = self.client
+            if self._set_summary_script is None:
+                self._set_summary_script = client.register_script(_SET_SUMMARY_SCRIPT)
+            _, meta_key = self._keys(session_id)
+            return bool(self._set_summary_script(
+                keys=[meta_key],
+                args=[str(expected_upto), str(summarized_upto), summary, self.ttl],
+                client=client
+            ))
+        except SessionStoreUnavailable:
+            raise
+        except Exception as e:
+            raise SessionStoreUnavailable(str(e))
+
+
+class InMemorySessionStore(_SessionPolicy):
+    """Process-local stand-in for RedisSessionStore, for development and tests."""
+
+    def __init__(self, ttl: int = SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _session(self, session_id: str) -> Dict:
+        now = time.time()
+        for stale_id in [key for key, value in self._sessions.items() if value["expires_at"] < now]:
+            del self._sessions[stale_id]
+        session = self._sessions.setdefault(session_id, {"messages": [], "summary": "", "summarized_upto": 0})
+        session["expires_at"] = now + self.ttl
+        return session
+
+    def append(self, session_id: str, message: Dict) -> int:
+        with self._lock:
+            messages = self._session(session_id)["messages"]
+            messages.append({"role": message["role"], "content": message["content"]})
+            return len(messages)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _read(self, session_id: str) -> Tuple[str, int, List[Dict]]:
+        with self._lock:
+            session = self._session(session_id)
+            return session["summary"], session["summarized_upto"], list(session["messages"][session["summarized_upto"]:])
+
+    def _set_summary(self, session_id: str, expected_upto: int, summarized_upto: int, summary: str) -> bool:
+        with self._lock:
+            session = self._session(session_id)
+            if session["summarized_upto"] != expected_upto:
+                return False
+            session["summarized_upto"] = summarized_upto
+            session["summary"] = summary
+            return True
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_session_store():
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            if SESSION_BACKEND == "memory":
+                _default_store = InMemorySessionStore()
+            elif SESSION_BACKEND == "auto" and get_redis_client() is None:
+                logger.warning("⚠️ Redis is not reachable: sessions are kept in this process only (set SESSION_BACKEND=redis to require Redis)")
+                _default_store = InMemorySessionStore()
+            else:
+                _default_store = RedisSessionStore()
+        return _default_store
+
+
+def start_turn(session_id: str, message: str) -> List[Dict]:
+    """Append the user's new message to the session and return the history to run the agent on."""
+    if not valid_session_id(session_id):
+        raise ValueError("session_id must be 1-128 letters, digits or _.:-")
+    if not isinstance(message, str) or not message.strip():
+        raise ValueError("message must be a non-empty string")
+    store = get_session_store()
+    store.append(session_id, {"role": "user", "content": message.strip()})
+    return store.history(session_id)
+
+
+def finish_turn(session_id: Optional[str], answer):
+    """Append the agent's answer to the session, then summarize old turns in the background if needed."""
+    if not session_id:
+        return
+    try:
+        store = get_session_store()
+        store.append(session_id, {"role": "assistant", "content": answer_text(answer)})
+        store.compact_async(session_id)
+    except SessionStoreUnavailable as e:
+        logger.warning(f"Could not record the answer in session {session_id}: {e}")
+
+
+def answer_text(answer) -> str:
+    """
+    The text of a turn's answer. A run that ended without one still gets an assistant
+    message, so the next turn sees what happened instead of two user messages in a row.
+    """
+    if isinstance(answer, str):
+        return plain_text(answer)
+    if answer is None:
+        return "(The task failed without an answer.)"
+    # The results of a run that reached its iteration limit
+    results = json.dumps(answer, ensure_ascii=False, default=str)
+    return f"(The task was not completed. Partial results: {truncate_middle(results, SESSION_HISTORY_TOKEN_BUDGET // 4)})"
+
+
+def plain_text(html: str) -> str:
+    """Answers are HTML for the browser; the session keeps their text, which costs fewer tokens."""
+    if "<" not in html:
+        return html
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html, "html.parser").get_text("\n", strip=True)
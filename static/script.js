@@ -16,37 +16,255 @@ document.addEventListener('DOMContentLoaded', () => {
         userInput.value = '';
 
         try {
-            const response = await fetch('/run-code-agent', {
+            const response = await fetch('/run-code-agent-stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
+                // The server keeps the conversation: only the new message is sent
                 body: JSON.stringify({
                     session_id: sessionId,
-                    session_chat_history: getChatHistory(),
+                    message: message,
                     user_id: 'user123', 
                 }),
             });
 
-            const data = await response.json();
-
-            if (response.ok) {
-                if (typeof data.assistant === 'string') {
-                    appendMessage('assistant', data.assistant);
-                } else {
-                    appendMessage('assistant', JSON.stringify(data.assistant));
-                    console.warn('assistant is not a string:', data.assistant);
-                }
-            } else {
+            if (!response.ok) {
+                const data = await response.json();
                 appendMessage('assistant', `Error: ${data.error}`);
                 console.error('Backend Error:', data.error);
+                return;
             }
+
+            const traceId = response.headers.get('X-Trace-ID');
+            const progress = createProgressPanel();
+            let answerDiv = null;
+            let answerText = '';
+
+            await readEventStream(response, (event, data) => {
+                switch (event) {
+                    case 'plan':
+                        progress.setPlan(data);
+                        break;
+                    case 'iteration':
+                        progress.addNote(`Iteration ${data.iteration}`);
+                        break;
+                    case 'subtask_started':
+                        progress.setSubtaskStatus(data.tool_name, 'running');
+                        break;
+                    case 'subtask_finished':
+                        progress.finishSubtask(data);
+                        break;
+                    case 'evaluating':
+                        progress.addNote('Evaluating results...');
+                        break;
+                    case 'evaluation':
+                        progress.addNote(data.satisfactory ? 'Evaluation: satisfactory' : 'Evaluation: not satisfactory, re-planning');
+                        break;
+                    case 'answer_token':
+                        answerText += data.text;
+                        answerDiv = renderAssistant(answerDiv, answerText);
+                        break;
+                    case 'done':
+                        if (typeof data.assistant === 'string') {
+                            answerDiv = renderAssistant(answerDiv, data.assistant);
+                        } else {
+                            answerDiv = renderAssistant(answerDiv, JSON.stringify(data.assistant));
+                            console.warn('assistant is not a string:', data.assistant);
+                        }
+                        break;
+                    case 'error':
+                        appendMessage('assistant', `Error: ${data.error}`);
+                        console.error('Backend Error:', data.error);
+                        break;
+                }
+            });
+            if (traceId) progress.addTimelineButton(traceId);
         } catch (error) {
             appendMessage('assistant', `Error: ${error.message}`);
             console.error('Fetch Error:', error);
         }
     });
 
+    async function readEventStream(response, onEvent) {
+        // Minimal Server-Sent Events reader over fetch, which (unlike EventSource) can POST
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                const dataLines = [];
+                block.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+                });
+                if (dataLines.length) {
+                    onEvent(event, JSON.parse(dataLines.join('\n')));
+                }
+            }
+        }
+    }
+
+    function createProgressPanel() {
+        const panel = document.createElement('div');
+        panel.classList.add('agent-progress');
+        const notes = document.createElement('div');
+        const list = document.createElement('ul');
+        panel.appendChild(notes);
+        panel.appendChild(list);
+        chatBox.appendChild(panel);
+        chatBox.scrollTop = chatBox.scrollHeight;
+
+        const items = {};
+
+        function subtaskItem(toolName) {
+            if (!items[toolName]) {
+                const item = document.createElement('li');
+                const label = document.createElement('span');
+                label.classList.add('subtask-label');
+                label.textContent = toolName;
+                const status = document.createElement('span');
+                status.classList.add('subtask-status');
+                item.appendChild(label);
+                item.appendChild(status);
+                list.appendChild(item);
+                items[toolName] = item;
+            }
+            return items[toolName];
+        }
+
+        return {
+            setPlan(plan) {
+                this.addNote(`Plan: ${plan.main_task}`);
+                // With a streamed plan, subtasks can already be running when the plan event arrives
+                plan.subtasks.forEach(subtask => {
+                    if (!items[subtask.tool_name]) this.setSubtaskStatus(subtask.tool_name, 'pending');
+                });
+            },
+            addNote(text) {
+                const note = document.createElement('div');
+                note.textContent = text;
+                notes.appendChild(note);
+                chatBox.scrollTop = chatBox.scrollHeight;
+            },
+            setSubtaskStatus(toolName, status) {
+                const item = subtaskItem(toolName);
+                item.className = `subtask ${status}`;
+                item.querySelector('.subtask-status').textContent = ` ${status}`;
+            },
+            finishSubtask(data) {
+                const status = data.error ? 'error' : (data.reused ? 'reused' : 'done');
+                this.setSubtaskStatus(data.tool_name, status);
+                const item = subtaskItem(data.tool_name);
+                if (data.duration != null) {
+                    item.querySelector('.subtask-status').textContent += ` (${data.duration.toFixed(1)}s)`;
+                }
+                const preview = data.error || data.output_preview;
+                if (preview) {
+                    let pre = item.querySelector('pre');
+                    if (!pre) {
+                        pre = document.createElement('pre');
+                        item.appendChild(pre);
+                    }
+                    pre.textContent = preview;
+                }
+                chatBox.scrollTop = chatBox.scrollHeight;
+            },
+            addTimelineButton(traceId) {
+                const button = document.createElement('button');
+                button.type = 'button';
+                button.classList.add('timeline-button');
+                button.textContent = 'Timeline';
+                button.addEventListener('click', async () => {
+                    button.disabled = true;
+                    try {
+                        const traceResponse = await fetch(`/traces/${encodeURIComponent(traceId)}`);
+                        if (!traceResponse.ok) throw new Error(`trace not available (${traceResponse.status})`);
+                        button.replaceWith(renderTimeline(await traceResponse.json()));
+                    } catch (error) {
+                        button.disabled = false;
+                        this.addNote(`Timeline: ${error.message}`);
+                    }
+                    chatBox.scrollTop = chatBox.scrollHeight;
+                });
+                panel.appendChild(button);
+            },
+        };
+    }
+
+    function renderTimeline(trace) {
+        // One row per span of an OTLP/JSON trace, children under their parent, bars on the run's time axis
+        const spans = trace.resourceSpans.flatMap(resource => resource.scopeSpans.flatMap(scope => scope.spans));
+        const ids = new Set(spans.map(span => span.spanId));
+        const children = {};
+        spans.forEach(span => {
+            const parent = ids.has(span.parentSpanId) ? span.parentSpanId : '';
+            (children[parent] = children[parent] || []).push(span);
+        });
+        const start = Math.min(...spans.map(span => Number(span.startTimeUnixNano)));
+        const end = Math.max(...spans.map(span => Number(span.endTimeUnixNano)));
+        const total = Math.max(end - start, 1);
+
+        const timeline = document.createElement('div');
+        timeline.classList.add('trace-timeline');
+
+        function addRows(parentId, depth) {
+            (children[parentId] || []).forEach(span => {
+                const spanStart = Number(span.startTimeUnixNano);
+                const duration = Number(span.endTimeUnixNano) - spanStart;
+                const row = document.createElement('div');
+                row.classList.add('trace-row');
+                if (span.status && span.status.code === 2) row.classList.add('failed');
+                row.title = span.attributes
+                    .map(attribute => `${attribute.key}: ${Object.values(attribute.value)[0]}`)
+                    .concat(span.status && span.status.message ? [`error: ${span.status.message}`] : [])
+                    .join('\n');
+
+                const label = document.createElement('span');
+                label.classList.add('trace-label');
+                label.style.paddingLeft = `${depth * 12}px`;
+                label.textContent = span.name;
+                const track = document.createElement('span');
+                track.classList.add('trace-track');
+                const bar = document.createElement('span');
+                bar.classList.add('trace-bar');
+                bar.style.left = `${(spanStart - start) / total * 100}%`;
+                bar.style.width = `${Math.max(duration / total * 100, 0.5)}%`;
+                track.appendChild(bar);
+                const time = document.createElement('span');
+                time.classList.add('trace-duration');
+                time.textContent = `${(duration / 1e6).toFixed(1)} ms`;
+
+                row.append(label, track, time);
+                timeline.appendChild(row);
+                addRows(span.spanId, depth + 1);
+            });
+        }
+        addRows('', 0);
+        return timeline;
+    }
+
+    function renderAssistant(msgDiv, message) {
+        if (!msgDiv) {
+            msgDiv = document.createElement('div');
+            msgDiv.classList.add('message', 'assistant');
+            chatBox.appendChild(msgDiv);
+        }
+        msgDiv.innerHTML = DOMPurify.sanitize(marked.parse(message || ''));
+        chatBox.scrollTop = chatBox.scrollHeight;
+        return msgDiv;
+    }
+
     function appendMessage(role, message) {
         const msgDiv = document.createElement('div');
         msgDiv.classList.add('message', role);
@@ -68,17 +286,6 @@ document.addEventListener('DOMContentLoaded', () => {
         chatBox.scrollTop = chatBox.scrollHeight;
     }
 
-    function getChatHistory() {
-        const messages = chatBox.querySelectorAll('.message');
-        const history = [];
-        messages.forEach(msg => {
-            const role = msg.classList.contains('user') ? 'user' : 'assistant';
-            const message = role === 'user' ? msg.textContent : msg.innerText;
-            history.push({ role, content: message });
-        });
-        return history;
-    }
-
     function generateSessionId() {
         return 'session_' + Math.random().toString(36).substr(2, 9);
     }
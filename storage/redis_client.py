@@ -0,0 +1,57 @@
+import logging
+import os
+import threading
+import time
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_DB = int(os.getenv("REDIS_DB", 0))
+
+# After a failed connection attempt we wait this long before trying again,
+# so an unreachable Redis costs one ping per interval instead of one per call.
+REDIS_RETRY_INTERVAL = float(os.getenv("REDIS_RETRY_INTERVAL", 30))
+
+_client = None
+_unavailable_until = 0.0
+_lock = threading.Lock()
+
+
+def get_redis_client():
+    """Return the shared Redis client, or None when Redis is not reachable."""
+    global _client, _unavailable_until
+
+    if _client is not None:
+        return _client
+    if time.monotonic() < _unavailable_until:
+        return None
+
+    with _lock:
+        if _client is not None:
+            return _client
+        try:
+            client = redis.Redis(
+                host=REDIS_HOST,
+                port=REDIS_PORT,
+                db=REDIS_DB,
+                socket_connect_timeout=1,
+                socket_timeout=2
+            )
+            client.ping()
+            _client = client
+            logger.info(f"Connected to Redis at {REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}")
+        except Exception as e:
+            _unavailable_until = time.monotonic() + REDIS_RETRY_INTERVAL
+            logger.warning(f"Redis not available at {REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}: {e}")
+        return _client
+
+
+def reset_redis_client():
+    """Drop the shared client so the next call reconnects (e.g. after a fork)."""
+    global _client, _unavailable_until
+    with _lock:
+        _client = None
+        _unavailable_until = 0.0
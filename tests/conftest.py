@@ -0,0 +1,72 @@
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+# models.models refuses to import without a key; no test reaches the real API
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+
+@pytest.fixture
+def sandbox_pool(monkeypatch):
+    """A small sandbox pool without preloaded libraries, used by agents in place of the process-wide one."""
+    from code_agent import code_agent
+    from code_agent.sandbox import SandboxPool
+
+    pool = SandboxPool([], size=2)
+    monkeypatch.setattr(code_agent, "get_sandbox_pool", lambda import_libraries=None: pool)
+    yield pool
+    pool.shutdown()
+
+
+def api_error(status_code: int, headers=None):
+    """The error the OpenAI client raises for an HTTP error answer; header names are lowercase."""
+    from openai import APIStatusError
+
+    response = SimpleNamespace(status_code=status_code, headers=dict(headers or {}), request=None)
+    return APIStatusError(f"Error code: {status_code}", response=response, body=None)
+
+
+class FakeClient:
+    """
+    Stand-in for the OpenAI client: each model answers from its script in order, the last
+    entry repeating. An entry is the answer text, an exception to raise, or a callable
+    returning either. Every request is recorded as (model, timeout).
+    """
+
+    def __init__(self):
+        self.scripts = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def script(self, model: str, *outcomes):
+        self.scripts[model] = list(outcomes)
+
+    def calls(self, model: str) -> int:
+        return sum(requested == model for requested, _ in self.requests)
+
+    def create(self, model, messages, timeout=None, **kwargs):
+        with self._lock:
+            self.requests.append((model, timeout))
+            script = self.scripts.get(model) or [f"answer of {model}"]
+            outcome = script.pop(0) if len(script) > 1 else script[0]
+        if callable(outcome) and not isinstance(outcome, type):
+            outcome = outcome()
+        if isinstance(outcome, BaseException):
+            raise outcome
+        message = SimpleNamespace(content=outcome)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """A FakeClient in place of the OpenAI client, with fresh circuit breakers and no response cache."""
+    from models import models, resilience
+
+    client = FakeClient()
+    monkeypatch.setattr(models, "client", client)
+    monkeypatch.setattr(models, "LLM_CACHE_ENABLED", False)
+    monkeypatch.setattr(resilience, "_breakers", {})
+    return client
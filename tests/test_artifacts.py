@@ -0,0 +1,91 @@
+import os
+import time
+
+import pytest
+
+from code_agent import artifacts
+from code_agent.artifacts import ArtifactRef, new_scope, public_results, release, resolve, spill
+from code_agent.code_agent import CodeAgent
+
+BIG_TEXT = "<html>" + "é lorem ipsum " * 10_000 + "</html>"
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    monkeypatch.setattr(artifacts, "ARTIFACT_DIR", str(tmp_path))
+    monkeypatch.setattr(artifacts, "ARTIFACT_THRESHOLD_BYTES", 1024)
+    return tmp_path
+
+
+@pytest.mark.parametrize("value, kind", [
+    (BIG_TEXT, "text"),
+    (bytes(range(256)) * 20, "bytes"),
+    ({"rows": [{"id": index, "name": f"row {index}"} for index in range(200)]}, "pickle"),
+    ([index * 1.5 for index in range(500)], "pickle"),
+])
+def test_large_value_round_trips_through_a_handle(store, value, kind):
+    ref = spill(value, "scope")
+    assert isinstance(ref, ArtifactRef)
+    assert ref.kind == kind and ref.size == os.path.getsize(ref.path)
+    assert os.path.dirname(ref.path) == os.path.join(str(store), "scope")
+    assert resolve(ref) == value
+
+
+@pytest.mark.parametrize("value", ["short", b"short", {"a": 1}, 42, None])
+def test_small_or_unsupported_value_stays_in_memory(store, value):
+    assert spill(value, "scope") is value
+    assert resolve(value) is value
+
+
+def test_disabled_store_or_no_scope_keeps_the_value(store, monkeypatch):
+    assert spill(BIG_TEXT, "") is BIG_TEXT
+    monkeypatch.setattr(artifacts, "ARTIFACT_STORE_ENABLED", False)
+    assert spill(BIG_TEXT, "scope") is BIG_TEXT
+
+
+def test_handle_text_is_a_preview(store):
+    ref = spill(BIG_TEXT, "scope")
+    assert spill(ref, "scope") is ref
+    text = str(ref)
+    assert ref.artifact_id in text and "<html>" in text
+    assert len(text) < 400
+
+
+def test_excerpt_reads_head_and_tail(store):
+    ref = spill("HEAD" + "x" * 10_000 + "TAIL", "scope")
+    excerpt = ref.excerpt(100)
+    assert excerpt.startswith("HEAD") and excerpt.endswith("TAIL")
+    assert "middle omitted" in excerpt and len(excerpt) < 200
+    assert spill({"k": "v" * 5000}, "scope").excerpt(100).startswith("<artifact")
+
+
+def test_release_deletes_the_scope_and_abandoned_ones(store, monkeypatch):
+    scope, abandoned, recent = new_scope(), f"{int(time.time()) - 7200}-dead", new_scope()
+    refs = [spill(BIG_TEXT, name) for name in (scope, abandoned, recent)]
+    monkeypatch.setattr(artifacts, "ARTIFACT_MAX_AGE", 3600)
+
+    release(scope)
+
+    assert [os.path.exists(ref.path) for ref in refs] == [False, False, True]
+
+
+def test_public_results_describe_handles(store):
+    ref = spill(BIG_TEXT, "scope")
+    assert public_results({"fetch": ref, "count": 3}) == {"fetch": repr(ref), "count": 3}
+
+
+def test_sandbox_worker_returns_a_handle_the_next_subtask_resolves(sandbox_pool):
+    agent = CodeAgent(chat_history=[], import_libraries=[])
+    agent.import_modules = []
+    fetch = {"tool_name": "fetch", "input_from_tool": "", "code": "def fetch():\n    return 'x' * 200_000\n"}
+    measure = {"tool_name": "measure", "input_from_tool": "fetch", "code": "def measure(page):\n    return len(page)\n"}
+    try:
+        fetched = agent._run_subtask_sandboxed(fetch, None)
+        assert isinstance(fetched["result"], ArtifactRef)
+        assert fetched["result"].size == 200_000
+
+        measured = agent._run_subtask_sandboxed(measure, fetched["result"])
+        assert measured["result"] == 200_000
+    finally:
+        release(agent.artifact_scope)
+    assert not os.path.exists(fetched["result"].path)
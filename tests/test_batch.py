@@ -0,0 +1,56 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from jobs.batch import SingleFlight
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=2)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def test_followers_share_the_leader_run_without_a_thread(executor):
+    flight = SingleFlight()
+    release = threading.Event()
+    runs = []
+
+    def slow():
+        runs.append("slow")
+        release.wait(5)
+        return "answer"
+
+    leader = flight.submit(executor, "same", slow)
+    followers = [flight.submit(executor, "same", slow) for _ in range(5)]
+    # The leader holds one of the two threads; followers hold none, so a distinct task still runs
+    assert flight.submit(executor, "other", lambda: "other").result(timeout=2) == ("other", False)
+
+    release.set()
+    assert leader.result(timeout=2) == ("answer", False)
+    assert [follower.result(timeout=2) for follower in followers] == [("answer", True)] * 5
+    assert runs == ["slow"]
+
+
+def test_followers_get_the_leader_exception(executor):
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def failing():
+        release.wait(5)
+        raise ValueError("boom")
+
+    leader = flight.submit(executor, "key", failing)
+    follower = flight.submit(executor, "key", failing)
+    release.set()
+    for future in (leader, follower):
+        with pytest.raises(ValueError):
+            future.result(timeout=2)
+
+
+def test_finished_run_is_not_reused(executor):
+    flight = SingleFlight()
+    assert flight.submit(executor, "key", lambda: 1).result(timeout=2) == (1, False)
+    assert flight.submit(executor, "key", lambda: 2).result(timeout=2) == (2, False)
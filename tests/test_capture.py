@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from code_agent.capture import bind_memory_logs
+from code_agent.code_agent import CodeAgent
+from code_agent.executor import execute_plan
+
+AGENTS = 8
+SUBTASKS = 3
+
+
+def _plan(marker):
+    return [
+        {
+            "tool_name": f"step_{index}",
+            "input_from_tool": f"step_{index - 1}" if index else "",
+            "code": (
+                f"def step_{index}(*args):\n"
+                f"    import time\n"
+                f"    for _ in range(10):\n"
+                f"        print('{marker}')\n"
+                f"        time.sleep(0.001)\n"
+                f"    logger.info('log {marker}')\n"
+                f"    return {{'marker': '{marker}'}}\n"
+            )
+        }
+        for index in range(SUBTASKS)
+    ]
+
+
+def _run(index, sandboxed):
+    marker = f"agent-{index}-marker"
+    agent = CodeAgent(chat_history=[], import_libraries=[])
+    agent.import_modules = []
+    run_subtask = agent._run_subtask_sandboxed if sandboxed else agent._run_subtask_inline
+    with bind_memory_logs(agent.memory_logs):
+        results = execute_plan(_plan(marker), run_subtask, agent._log_subtask)
+    return marker, agent, results
+
+
+@pytest.mark.parametrize("sandboxed", [False, True], ids=["inline", "sandbox"])
+def test_concurrent_agents_capture_only_their_own_output(sandboxed, request):
+    if sandboxed:
+        request.getfixturevalue("sandbox_pool")
+    with ThreadPoolExecutor(max_workers=AGENTS) as pool:
+        runs = list(pool.map(lambda index: _run(index, sandboxed), range(AGENTS)))
+
+    for marker, agent, results in runs:
+        printed = [record["printed_output"] for _, record in agent.iteration_records]
+        assert len(printed) == SUBTASKS
+        assert all(output.split() == [marker] * 10 for output in printed)
+        assert [line for line in agent.memory_logs if "marker" in line and marker not in line] == []
+        assert sum(f"log {marker}" in line for line in agent.memory_logs) == SUBTASKS
+        assert all(result == {"marker": marker} for result in results.values())
@@ -0,0 +1,31 @@
+import logging
+import sys
+
+from code_agent.compaction import ErrorLogEntry, compact_log_entry, log_entry
+
+FORMATTER = logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+
+def _entry(level, message, exc_info=None):
+    record = logging.LogRecord("agent", level, __file__, 1, message, None, exc_info)
+    return log_entry(record, FORMATTER.format(record))
+
+
+def test_printed_traceback_is_truncated():
+    printed = "🟡 Printed output from exec: [ERROR] retrying\nTraceback (most recent call last):\n" + "x" * 40_000
+    entry = _entry(logging.INFO, printed)
+    assert not isinstance(entry, ErrorLogEntry)
+    assert len(compact_log_entry(entry, output_budget=100)) < 1000
+
+
+def test_error_record_is_kept_in_full():
+    entry = _entry(logging.ERROR, "🔴 Error in subtask 'fetch': KeyError: 'x'\n" + "y" * 40_000)
+    assert compact_log_entry(entry, entry_budget=10) == entry
+
+
+def test_exception_record_is_kept_in_full():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        entry = _entry(logging.WARNING, "z" * 40_000, exc_info=sys.exc_info())
+    assert "ValueError: boom" in compact_log_entry(entry, entry_budget=10)
@@ -0,0 +1,164 @@
+import threading
+import time
+
+import pytest
+
+from code_agent.executor import build_dependencies, execute_plan, subtask_key
+
+
+def _subtask(tool_name, input_from_tool=""):
+    return {"tool_name": tool_name, "input_from_tool": input_from_tool, "code": f"def {tool_name}(*args): ..."}
+
+
+class _Runner:
+    """Fake run_subtask: each tool returns its name plus its input, optionally after a delay or an exception."""
+
+    def __init__(self, delays=None, failing=()):
+        self.delays = delays or {}
+        self.failing = set(failing)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, subtask, upstream_output):
+        name = subtask["tool_name"]
+        with self.lock:
+            self.calls.append((name, upstream_output))
+        time.sleep(self.delays.get(name, 0))
+        if name in self.failing:
+            raise RuntimeError(f"{name} crashed")
+        return {"has_result": True, "result": f"{name}({upstream_output})" if upstream_output != {} else name}
+
+
+def _reported():
+    reported = []
+    return reported, lambda index, subtask, record: reported.append((index, subtask["tool_name"]))
+
+
+def test_dependencies_point_to_the_latest_earlier_tool():
+    plan = [_subtask("a"), _subtask("b", "a"), _subtask("c", "later"), _subtask("a"), _subtask("d", "a")]
+    assert build_dependencies(plan) == [None, 0, None, None, 3]
+
+
+def test_a_chain_passes_each_output_downstream():
+    runner = _Runner()
+    results = execute_plan([_subtask("fetch"), _subtask("parse", "fetch"), _subtask("report", "parse")], runner, lambda *args: None)
+    assert results == {"fetch": "fetch", "parse": "parse(fetch)", "report": "report(parse(fetch))"}
+    assert [name for name, _ in runner.calls] == ["fetch", "parse", "report"]
+
+
+def test_independent_branches_run_in_parallel():
+    branches = [_subtask(f"branch_{index}") for index in range(4)]
+    runner = _Runner(delays={subtask["tool_name"]: 0.2 for subtask in branches})
+    started_at = time.monotonic()
+    results = execute_plan(branches, runner, lambda *args: None, max_workers=4)
+    assert time.monotonic() - started_at < 0.6
+    assert sorted(results) == [subtask["tool_name"] for subtask in branches]
+
+
+def test_completions_are_reported_in_plan_order():
+    runner = _Runner(delays={"slow": 0.2})
+    reported, on_complete = _reported()
+    execute_plan([_subtask("slow"), _subtask("fast"), _subtask("after_fast", "fast")], runner, on_complete)
+    # fast and after_fast finish first, but are reported after slow
+    assert reported == [(0, "slow"), (1, "fast"), (2, "after_fast")]
+
+
+def test_a_second_iteration_reuses_unchanged_subtasks():
+    memo = {}
+    plan = [_subtask("fetch"), _subtask("parse", "fetch"), _subtask("other")]
+    execute_plan(plan, _Runner(), lambda *args: None, memo=memo)
+    assert len(memo) == 3
+
+    # only parse changes: fetch and other are memo hits, parse is a miss
+    runner = _Runner()
+    records = {}
+    revised = [plan[0], dict(plan[1], code="def parse(*args): return 1"), plan[2]]
+    results = execute_plan(revised, runner, lambda index, subtask, record: records.update({subtask["tool_name"]: record}), memo=memo)
+    assert [name for name, _ in runner.calls] == ["parse"]
+    assert {name for name, record in records.items() if record.get("reused")} == {"fetch", "other"}
+    assert results["parse"] == "parse(fetch)"
+    assert len(memo) == 4
+
+
+def test_an_error_stops_dependents_and_new_work():
+    runner = _Runner(delays={"independent": 0.1}, failing={"fetch"})
+    reported, on_complete = _reported()
+    with pytest.raises(RuntimeError, match="fetch crashed"):
+        execute_plan([_subtask("fetch"), _subtask("parse", "fetch"), _subtask("independent"),
+                      _subtask("summary", "independent")], runner, on_complete)
+    called = {name for name, _ in runner.calls}
+    assert "parse" not in called
+    # Work already running finishes, but nothing new starts after the error
+    assert "summary" not in called
+    assert reported == []
+
+
+def test_a_streamed_plan_starts_subtasks_as_they_arrive():
+    arrived = {}
+    runner = _Runner()
+
+    def stream():
+        for subtask in (_subtask("fetch"), _subtask("parse", "fetch"), _subtask("other")):
+            arrived[subtask["tool_name"]] = time.monotonic()
+            yield subtask
+            time.sleep(0.1)
+
+    started = {}
+
+    def run(subtask, upstream_output):
+        started[subtask["tool_name"]] = time.monotonic()
+        return runner(subtask, upstream_output)
+
+    results = execute_plan(stream(), run, lambda *args: None)
+    assert results == {"fetch": "fetch", "parse": "parse(fetch)", "other": "other"}
+    # fetch ran while the rest of the plan was still being generated
+    assert started["fetch"] < arrived["parse"]
+
+
+def test_a_broken_plan_stream_raises_after_running_work_finishes():
+    runner = _Runner(delays={"fetch": 0.1})
+
+    def stream():
+        yield _subtask("fetch")
+        raise ValueError("stream broke")
+
+    reported, on_complete = _reported()
+    with pytest.raises(ValueError, match="stream broke"):
+        execute_plan(stream(), runner, on_complete)
+    assert reported == [(0, "fetch")]
+
+
+def test_subtask_key_follows_code_arguments_and_upstream():
+    key = subtask_key(_subtask("parse", "fetch"), "upstream")
+    assert subtask_key(_subtask("parse", "fetch"), "upstream") == key
+    assert subtask_key(dict(_subtask("parse", "fetch"), code="def parse(): return 1"), "upstream") != key
+    assert subtask_key(dict(_subtask("parse", "fetch"), arguments={"limit": 1}), "upstream") != key
+    assert subtask_key(_subtask("parse", "fetch"), "other upstream") != key
+
+
+def test_records_with_an_error_are_not_memoized():
+    class _Erroring(_Runner):
+        def __call__(self, subtask, upstream_output):
+            record = super().__call__(subtask, upstream_output)
+            if subtask["tool_name"] == "fetch":
+                record["error"] = "fetch timed out"
+            return record
+
+    memo = {}
+    plan = [_subtask("fetch"), _subtask("parse", "fetch"), _subtask("other")]
+    execute_plan(plan, _Erroring(), lambda *args: None, memo=memo)
+    # fetch failed, so parse read an output that may change on the retry: only other is kept
+    assert len(memo) == 1
+
+    runner = _Runner()
+    execute_plan(plan, runner, lambda *args: None, memo=memo)
+    assert sorted(name for name, _ in runner.calls) == ["fetch", "parse"]
+    assert len(memo) == 3
+
+
+def test_without_a_memo_every_subtask_runs_each_time():
+    plan = [_subtask("fetch"), _subtask("parse", "fetch")]
+    runner = _Runner()
+    execute_plan(plan, runner, lambda *args: None)
+    execute_plan(plan, runner, lambda *args: None)
+    assert [name for name, _ in runner.calls] == ["fetch", "parse", "fetch", "parse"]
@@ -0,0 +1,164 @@
+import sys
+import time
+import types
+import uuid
+
+import pytest
+
+from jobs.job_queue import InMemoryJobQueue, RedisJobQueue
+from jobs.worker import run_job
+from storage.redis_client import REDIS_DB, REDIS_HOST, REDIS_PORT
+
+
+def _redis_queue(client, max_attempts):
+    prefix = f"test-agent-jobs:{uuid.uuid4().hex}:"
+    job_queue = RedisJobQueue(client=client, prefix=prefix, max_attempts=max_attempts)
+    yield job_queue
+    keys = list(client.scan_iter(match=prefix + "*"))
+    if keys:
+        client.delete(*keys)
+
+
+@pytest.fixture(scope="session")
+def redis_client():
+    """A local Redis, or None when there is none; probed once per session."""
+    import redis
+    client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, socket_connect_timeout=0.5)
+    try:
+        client.ping()
+    except redis.RedisError:
+        return None
+    return client
+
+
+@pytest.fixture(params=["memory", "fakeredis", "redis"])
+def make_queue(request, redis_client):
+    """Factory of empty queues for each backend: in-process, Redis emulated in-process, a local Redis."""
+    cleanups = []
+
+    def make(max_attempts=3):
+        if request.param == "memory":
+            return InMemoryJobQueue(max_attempts=max_attempts)
+        if request.param == "fakeredis":
+            fakeredis = pytest.importorskip("fakeredis")
+            pytest.importorskip("lupa")  # Lua scripting for the claim and requeue scripts
+            client = fakeredis.FakeRedis()
+        else:
+            if redis_client is None:
+                pytest.skip(f"Redis is not reachable at {REDIS_HOST}:{REDIS_PORT}")
+            client = redis_client
+        generator = _redis_queue(client, max_attempts)
+        cleanups.append(generator)
+        return next(generator)
+
+    yield make
+    for generator in cleanups:
+        next(generator, None)
+
+
+def test_submit_claim_complete(make_queue):
+    job_queue = make_queue()
+    job_id = job_queue.submit({"message": "hello"})
+    assert job_queue.get(job_id)["status"] == "queued"
+    assert job_queue.queued_count() == 1
+
+    job = job_queue.claim("worker-1")
+    assert job["id"] == job_id
+    assert job["status"] == "running"
+    assert job["attempts"] == 1
+    assert job["payload"] == {"message": "hello"}
+    assert job_queue.claim("worker-2") is None
+
+    job_queue.complete(job_id, {"assistant": "hi"})
+    finished = job_queue.get(job_id)
+    assert finished["status"] == "done"
+    assert finished["result"] == {"assistant": "hi"}
+    assert job_queue.requeue_expired() == 0
+
+
+def test_higher_priority_is_claimed_first(make_queue):
+    job_queue = make_queue()
+    low = job_queue.submit({"n": 1})
+    high = job_queue.submit({"n": 2}, priority=5)
+    assert job_queue.claim("worker")["id"] == high
+    assert job_queue.claim("worker")["id"] == low
+
+
+def test_crashed_worker_job_is_redelivered(make_queue):
+    job_queue = make_queue()
+    job_id = job_queue.submit({"message": "hello"})
+    job_queue.claim("crashed-worker", visibility_timeout=0.05)
+    time.sleep(0.1)
+
+    assert job_queue.requeue_expired() == 1
+    assert job_queue.get(job_id)["status"] == "queued"
+    job = job_queue.claim("worker-2")
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+
+
+def test_heartbeat_keeps_job_invisible(make_queue):
+    job_queue = make_queue()
+    job_id = job_queue.submit({})
+    job_queue.claim("worker", visibility_timeout=0.05)
+    job_queue.heartbeat(job_id, visibility_timeout=60)
+    time.sleep(0.1)
+    assert job_queue.requeue_expired() == 0
+    assert job_queue.get(job_id)["status"] == "running"
+
+
+def test_retries_exhausted_marks_job_failed(make_queue):
+    job_queue = make_queue(max_attempts=2)
+    job_id = job_queue.submit({})
+    for _ in range(2):
+        assert job_queue.claim("crashing-worker", visibility_timeout=0.05)["id"] == job_id
+        time.sleep(0.1)
+        job_queue.requeue_expired()
+
+    job = job_queue.get(job_id)
+    assert job["status"] == "failed"
+    assert "abandoned" in job["error"]
+    assert job_queue.claim("worker") is None
+
+
+class _FakeAgent:
+    answer = "the answer"
+    error = None
+
+    def __init__(self, chat_history, import_libraries, request_id=None):
+        self.chat_history = chat_history
+
+    def run_agent(self):
+        if self.error:
+            raise self.error
+        return self.answer
+
+
+@pytest.fixture
+def fake_agent(monkeypatch):
+    module = types.ModuleType("code_agent.code_agent")
+    module.CodeAgent = _FakeAgent
+    monkeypatch.setitem(sys.modules, "code_agent.code_agent", module)
+    monkeypatch.setattr(_FakeAgent, "error", None)
+    return _FakeAgent
+
+
+def test_worker_stores_result(make_queue, fake_agent):
+    job_queue = make_queue()
+    job_id = job_queue.submit({"session_chat_history": [{"role": "user", "content": "hi"}]})
+    run_job(job_queue, job_queue.claim("worker"), "worker")
+
+    job = job_queue.get(job_id)
+    assert job["status"] == "done"
+    assert job["result"] == {"assistant": "the answer"}
+
+
+def test_worker_records_failure(make_queue, fake_agent):
+    fake_agent.error = RuntimeError("boom")
+    job_queue = make_queue()
+    job_id = job_queue.submit({})
+    run_job(job_queue, job_queue.claim("worker"), "worker")
+
+    job = job_queue.get(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "boom"
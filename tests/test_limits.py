@@ -0,0 +1,100 @@
+import time
+
+import pytest
+
+from code_agent import code_agent
+from code_agent.code_agent import CodeAgent
+from code_agent.limits import SubtaskLimitExceeded, limit_fields, thread_limits
+
+SPIN = (
+    "def spin():\n"
+    "    print('started')\n"
+    "    while True:\n"
+    "        try:\n"
+    "            pass\n"
+    "        except Exception:\n"
+    "            pass\n"
+)
+
+
+def _limit(record):
+    return record["limit_exceeded"]["kind"], record["limit_exceeded"]["stopped"]
+
+
+def test_limit_fields_describe_the_limit():
+    fields = limit_fields(SubtaskLimitExceeded("memory", 512), stopped="killed")
+    assert fields["error"] == "SubtaskLimitExceeded: subtask exceeded its memory limit of 512 MB"
+    assert fields["limit_exceeded"] == {"kind": "memory", "limit": 512, "stopped": "killed"}
+
+
+def test_sandbox_wall_clock_limit_keeps_the_output_so_far(sandbox_pool):
+    response = sandbox_pool.run(SPIN, "spin", call_with_input=False, timeout=0.5)
+    assert _limit(response) == ("wall_clock", "interrupted")
+    assert response["printed_output"] == "started\n"
+
+
+def test_sandbox_cpu_limit(sandbox_pool):
+    response = sandbox_pool.run(SPIN, "spin", call_with_input=False, timeout=30, cpu_limit=1)
+    assert _limit(response) == ("cpu", "interrupted")
+
+
+def test_sandbox_memory_limit(sandbox_pool):
+    hog = "def hog():\n    return len(bytearray(64 * 1024 ** 3))\n"
+    response = sandbox_pool.run(hog, "hog", call_with_input=False)
+    assert _limit(response) == ("memory", "interrupted")
+    # The worker survives its MemoryError
+    assert sandbox_pool.run("def one():\n    return 1\n", "one", call_with_input=False)["result"] == 1
+
+
+def test_sandbox_worker_that_ignores_its_deadline_is_killed(sandbox_pool, monkeypatch):
+    monkeypatch.setattr("code_agent.sandbox.SUBTASK_KILL_GRACE", 0.5)
+    deaf = (
+        "def deaf():\n"
+        "    import signal, time\n"
+        "    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})\n"
+        "    time.sleep(30)\n"
+    )
+    started_at = time.monotonic()
+    response = sandbox_pool.run(deaf, "deaf", call_with_input=False, timeout=0.5)
+    assert _limit(response) == ("wall_clock", "killed")
+    assert time.monotonic() - started_at < 5
+
+
+def test_thread_limits_interrupt_python_code():
+    started_at = time.monotonic()
+    with pytest.raises(SubtaskLimitExceeded, match="wall-clock limit of 0.2s"):
+        with thread_limits(0.2):
+            while True:
+                try:
+                    pass
+                except Exception:
+                    pass
+    assert time.monotonic() - started_at < 2
+
+
+def test_thread_limits_do_not_fire_after_the_block():
+    with thread_limits(0.1):
+        pass
+    time.sleep(0.3)
+
+
+@pytest.fixture
+def agent():
+    agent = CodeAgent(chat_history=[], import_libraries=[])
+    agent.import_modules = []
+    return agent
+
+
+def test_inline_timeout_interrupts_the_subtask(agent):
+    record = agent._run_subtask_inline_bounded({"tool_name": "spin", "input_from_tool": "", "code": SPIN}, None, 0.3)
+    assert _limit(record) == ("wall_clock", "interrupted")
+    assert record["printed_output"] == "started\n"
+
+
+def test_inline_subtask_blocked_outside_python_is_abandoned(agent, monkeypatch):
+    monkeypatch.setattr(code_agent, "SUBTASK_KILL_GRACE", 0.2)
+    blocked = {"tool_name": "blocked", "input_from_tool": "", "code": "def blocked():\n    import time\n    time.sleep(3)\n"}
+    started_at = time.monotonic()
+    record = agent._run_subtask_inline_bounded(blocked, None, 0.3)
+    assert _limit(record) == ("wall_clock", "abandoned")
+    assert time.monotonic() - started_at < 2
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from models import models
+from models.cache import LLMCache, make_cache_key
+from models.routing import Route
+
+HISTORY = [{"role": "user", "content": "plan this"}]
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = LLMCache()
+    monkeypatch.setattr(models, "response_cache", cache)
+    monkeypatch.setattr("models.cache.get_redis_client", lambda: None)
+    return cache
+
+
+@pytest.fixture
+def route(monkeypatch):
+    route = Route("primary", fallbacks=["fallback"], escalate_to="strong")
+    monkeypatch.setattr(models.routing_policy, "route", lambda call_site, model=None: route)
+    return route
+
+
+def test_fallback_answer_is_keyed_on_the_fallback_model(cache, route, monkeypatch):
+    def complete(chat_history, model, call_site, route):
+        if model == "primary":
+            raise RuntimeError("down")
+        return f"answer of {model}"
+
+    monkeypatch.setattr(models, "_complete", complete)
+    assert models.call_model(HISTORY, call_site="plan") == "answer of fallback"
+
+    assert cache.get(make_cache_key("primary", HISTORY)) is None
+    assert cache.get(make_cache_key("fallback", HISTORY)) == "answer of fallback"
+
+
+def test_escalated_answer_is_keyed_on_the_escalation_model(cache, route, monkeypatch):
+    monkeypatch.setattr(models, "_complete", lambda chat_history, model, call_site, route: "{}" if model == "strong" else "not json")
+    assert models.call_model(HISTORY, call_site="plan", expect_json=True) == "{}"
+
+    assert cache.get(make_cache_key("primary", HISTORY)) is None
+    assert cache.get(make_cache_key("strong", HISTORY)) == "{}"
+
+
+def test_forgotten_answer_is_asked_again(cache, route, monkeypatch):
+    calls = []
+    monkeypatch.setattr(models, "_complete", lambda chat_history, model, call_site, route: calls.append(model) or "{}")
+    models.call_model(HISTORY, call_site="plan")
+    models.call_model(HISTORY, call_site="plan")
+    assert calls == ["primary"]
+
+    models.forget_cached_answer(HISTORY, call_site="plan")
+    models.call_model(HISTORY, call_site="plan")
+    assert calls == ["primary", "primary"]
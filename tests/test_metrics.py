@@ -0,0 +1,67 @@
+import multiprocessing
+
+import pytest
+
+from metrics import metrics
+
+REQUESTS = metrics.REGISTRY.register(metrics.Counter(
+    "test_multiprocess_requests_total", "Requests counted by the multiprocess test.", ["worker"]
+))
+LATENCY = metrics.REGISTRY.register(metrics.Histogram(
+    "test_multiprocess_latency_seconds", "Latency observed by the multiprocess test.", buckets=(1, 10)
+))
+
+
+@pytest.fixture
+def multiproc_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(metrics, "METRICS_MULTIPROC_DIR", str(tmp_path))
+    monkeypatch.setattr(metrics, "METRICS_FLUSH_INTERVAL", 3600)
+    monkeypatch.setattr(metrics, "_flusher_pid", None)
+    REQUESTS.clear()
+    LATENCY.clear()
+    return tmp_path
+
+
+def _child(name):
+    REQUESTS.inc(worker=name)
+    LATENCY.observe(5)
+    metrics.flush()
+
+
+def test_render_sums_every_process(multiproc_dir):
+    REQUESTS.inc(worker="parent")
+    LATENCY.observe(0.5)
+    context = multiprocessing.get_context("fork")
+    for name in ("a", "a", "b"):
+        # Each child inherits the parent's values, which must not be counted twice
+        process = context.Process(target=_child, args=(name,))
+        process.start()
+        process.join(10)
+        assert process.exitcode == 0
+
+    rendered = metrics.render_metrics()
+
+    assert 'test_multiprocess_requests_total{worker="parent"} 1' in rendered
+    assert 'test_multiprocess_requests_total{worker="a"} 2' in rendered
+    assert 'test_multiprocess_requests_total{worker="b"} 1' in rendered
+    assert 'test_multiprocess_latency_seconds_bucket{le="1"} 1' in rendered
+    assert 'test_multiprocess_latency_seconds_bucket{le="10"} 4' in rendered
+    assert "test_multiprocess_latency_seconds_count 4" in rendered
+    assert len(list(multiproc_dir.glob("*.json"))) == 4
+
+
+def test_exited_process_counts_survive_until_the_host_restarts(multiproc_dir):
+    process = multiprocessing.get_context("fork").Process(target=_child, args=("gone",))
+    process.start()
+    process.join(10)
+    assert 'test_multiprocess_requests_total{worker="gone"} 1' in metrics.render_metrics()
+
+    metrics.clear_multiprocess_dir()
+    assert 'worker="gone"' not in metrics.render_metrics()
+
+
+def test_forwarding_process_writes_no_file(multiproc_dir, monkeypatch):
+    monkeypatch.setattr(metrics, "_forwarded", [])
+    REQUESTS.inc(worker="sandbox")
+    metrics.flush()
+    assert not list(multiproc_dir.glob("*.json"))
@@ -0,0 +1,83 @@
+import pytest
+
+from code_agent import plan_cache as plan_cache_module
+from code_agent.plan_cache import PlanCache, find_slots, template_plan
+
+
+def _plan(task: str):
+    return {
+        "main_task": task,
+        "subtasks": [
+            {"tool_name": "fetch", "input_from_tool": "", "code": f"def fetch():\n    return query({task!r})\n"},
+            {"tool_name": "report", "input_from_tool": "fetch", "code": "def report(data):\n    return str(data)\n"},
+        ]
+    }
+
+
+@pytest.mark.parametrize("old_task, new_task", [
+    ("distance from Rome to Paris", "distance from Paris to Berlin"),
+    ("10 apples and 20 pears", "20 apples and 10 pears"),
+])
+def test_overlapping_slots_are_substituted_once(old_task, new_task):
+    slots = find_slots(old_task, new_task)
+    assert slots is not None
+
+    rebound = template_plan(_plan(old_task), slots)
+
+    assert rebound["main_task"] == new_task
+    assert rebound["subtasks"][0]["code"] == f"def fetch():\n    return query({new_task!r})\n"
+
+
+def test_conflicting_slots_are_refused():
+    plan = _plan("compare Rome with rome")
+    assert template_plan(plan, [("Rome", "Paris"), ("rome", "Berlin")]) is None
+
+
+def test_slot_missing_from_root_code_is_refused():
+    assert template_plan(_plan("distance from Rome to Paris"), [("Madrid", "Lisbon")]) is None
+
+
+@pytest.fixture
+def redis(monkeypatch, request):
+    """None for a process-local cache, or an in-process fake Redis shared by the caches of a test."""
+    client = None
+    if getattr(request, "param", "local") == "fakeredis":
+        fakeredis = pytest.importorskip("fakeredis")
+        client = fakeredis.FakeRedis()
+    monkeypatch.setattr(plan_cache_module, "get_redis_client", lambda: client)
+    return client
+
+
+def test_catalogs_keep_their_own_entries(redis):
+    cache = PlanCache(rebind_model=None)
+    cache.store("weather in Rome", _plan("weather in Rome"), "catalog-a")
+    cache.store("weather in Rome", _plan("weather in Rome") | {"main_task": "with other libraries"}, "catalog-b")
+
+    for _ in range(3):
+        # Alternating catalogs must not flush each other's plans
+        assert cache.lookup("weather in Paris", "catalog-a").plan["main_task"] == "weather in Paris"
+        assert cache.lookup("weather in Rome", "catalog-b").plan["main_task"] == "with other libraries"
+    assert cache.lookup("weather in Rome", "catalog-c") is None
+    assert cache.stats()["entries"] == 2
+
+
+def test_invalidation_only_affects_its_catalog(redis):
+    cache = PlanCache(rebind_model=None)
+    for catalog in ("catalog-a", "catalog-b"):
+        cache.store("weather in Rome", _plan("weather in Rome"), catalog)
+    match = cache.lookup("weather in Rome", "catalog-a")
+
+    cache.invalidate(match.entry_id, "catalog-a")
+
+    assert cache.lookup("weather in Rome", "catalog-a") is None
+    assert cache.lookup("weather in Rome", "catalog-b") is not None
+
+
+@pytest.mark.parametrize("redis", ["fakeredis"], indirect=True)
+def test_plans_are_shared_per_catalog_through_redis(redis):
+    PlanCache(rebind_model=None).store("weather in Rome", _plan("weather in Rome"), "catalog-a")
+    other_process = PlanCache(rebind_model=None)
+
+    assert other_process.lookup("weather in Rome", "catalog-a") is not None
+    assert other_process.lookup("weather in Rome", "catalog-b") is None
+    assert sorted(redis.keys()) == [b"plan-cache:catalog-a"]
@@ -0,0 +1,94 @@
+import pytest
+
+from code_agent import code_agent as code_agent_module
+from code_agent.code_agent import CodeAgent
+from code_agent.pre_evaluator import final_outputs, pre_evaluate
+
+
+def _subtask(tool_name, input_from_tool=""):
+    return {"tool_name": tool_name, "input_from_tool": input_from_tool, "code": f"def {tool_name}():\n    pass\n"}
+
+
+def _ok(result, printed_output=""):
+    return {"has_result": True, "result": result, "printed_output": printed_output}
+
+
+@pytest.mark.parametrize("record, expected", [
+    ({"has_result": False, "result": None, "error": "KeyError: 'x'", "traceback": "Traceback\nKeyError: 'x'"}, "raised KeyError"),
+    ({"has_result": False, "result": None, "missing_function": True}, "does not define a function named 'fetch'"),
+    ({"has_result": False, "result": None, "printed_output": "nothing to do"}, "produced no result, after printing: nothing to do"),
+    (_ok(""), "empty result"),
+    (_ok({}), "empty result"),
+    (_ok({"error": "quota exceeded"}), "returned an error: quota exceeded"),
+])
+def test_certain_failures_fail(record, expected):
+    pre_evaluation = pre_evaluate([(_subtask("fetch"), record)])
+    assert pre_evaluation.verdict == "fail"
+    assert expected in pre_evaluation.summary()
+
+
+def test_clean_run_passes():
+    records = [(_subtask("fetch"), _ok([1, 2])), (_subtask("report", "fetch"), _ok("two items"))]
+    assert pre_evaluate(records).verdict == "pass"
+
+
+@pytest.mark.parametrize("record", [
+    _ok(None),  # a step that only acts, e.g. sends a message
+    _ok("sent", printed_output="retrying after error 503"),
+])
+def test_doubtful_output_is_left_to_the_model(record):
+    pre_evaluation = pre_evaluate([(_subtask("notify"), record)])
+    assert pre_evaluation.verdict == "uncertain"
+    assert pre_evaluation.findings == []
+
+
+def test_final_outputs_are_the_unconsumed_results():
+    records = [
+        (_subtask("fetch"), _ok("raw data")),
+        (_subtask("summarize", "fetch"), _ok("summary")),
+        (_subtask("weather"), _ok("x" * 100_000)),
+    ]
+    outputs = final_outputs(records)
+    assert list(outputs) == ["summarize", "weather"]
+    assert outputs["summarize"] == "summary"
+    assert len(outputs["weather"]) < 10_000
+
+
+@pytest.fixture
+def agent():
+    agent = CodeAgent(chat_history=[{"role": "user", "content": "send the report"}], import_libraries=[])
+    agent.json_plan = {"subtasks": [_subtask("fetch")]}
+    return agent
+
+
+def test_failure_replans_without_the_evaluation_call(agent, monkeypatch):
+    replans = []
+    monkeypatch.setattr(code_agent_module, "replan", lambda prompt, plan, failures: replans.append(failures) or {"subtasks": []})
+    agent.iteration_records = [(_subtask("fetch"), _ok(""))]
+
+    evaluation = agent._pre_evaluate("prompt", can_replan=True)
+
+    assert evaluation["satisfactory"] is False
+    assert evaluation["new_json_plan"] == {"subtasks": []}
+    assert "empty result" in replans[0]
+
+
+def test_failure_on_the_last_iteration_does_not_replan(agent, monkeypatch):
+    monkeypatch.setattr(code_agent_module, "replan", lambda *args: pytest.fail("replanned on the last iteration"))
+    agent.iteration_records = [(_subtask("fetch"), _ok(""))]
+    evaluation = agent._pre_evaluate("prompt", can_replan=False)
+    assert evaluation["satisfactory"] is False and "new_json_plan" not in evaluation
+
+
+def test_failed_replan_falls_back_to_the_evaluation_call(agent, monkeypatch):
+    def failing(*args):
+        raise ValueError("not JSON")
+
+    monkeypatch.setattr(code_agent_module, "replan", failing)
+    agent.iteration_records = [(_subtask("fetch"), _ok(""))]
+    assert agent._pre_evaluate("prompt", can_replan=True) is None
+
+
+def test_none_result_goes_to_the_evaluation_call(agent):
+    agent.iteration_records = [(_subtask("notify"), _ok(None))]
+    assert agent._pre_evaluate("prompt", can_replan=True) is None
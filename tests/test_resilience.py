@@ -0,0 +1,216 @@
+import email.utils
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from openai import APIConnectionError
+
+from conftest import api_error
+from models import models, resilience
+from models.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+    call_with_resilience,
+    deadline,
+    hedged,
+    request_timeout,
+    time_remaining
+)
+from models.routing import Route
+
+HISTORY = [{"role": "user", "content": "plan this"}]
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff waits, recorded instead of slept."""
+    sleeps = []
+    monkeypatch.setattr(resilience, "time", SimpleNamespace(monotonic=time.monotonic, time=time.time, sleep=sleeps.append))
+    monkeypatch.setattr(resilience, "_breakers", {})
+    return sleeps
+
+
+def _requests(*outcomes):
+    """A request callable answering with outcomes in order; raised when they are exceptions."""
+    outcomes = list(outcomes)
+    calls = []
+
+    def request():
+        calls.append(len(calls))
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    request.calls = calls
+    return request
+
+
+def test_retryable_failures_are_retried(sleeps):
+    request = _requests(api_error(500), APIConnectionError(request=None), "ok")
+    assert call_with_resilience(request, "m", "plan") == "ok"
+    assert len(request.calls) == 3
+    assert len(sleeps) == 2
+
+
+@pytest.mark.parametrize("headers, delay", [
+    ({"retry-after": "3"}, 3),
+    ({"retry-after-ms": "1500"}, 1.5),
+    ({"retry-after": "999"}, resilience.LLM_RETRY_MAX_DELAY),
+])
+def test_retry_after_is_honored(sleeps, headers, delay):
+    request = _requests(api_error(429, headers), "ok")
+    assert call_with_resilience(request, "m", "plan") == "ok"
+    assert sleeps == [delay]
+
+
+def test_retry_after_as_an_http_date():
+    headers = {"retry-after": email.utils.formatdate(time.time() + 10, usegmt=True)}
+    assert 8 < resilience.retry_after(api_error(429, headers)) <= 10
+
+
+def test_backoff_without_a_hint_is_exponential_with_jitter(sleeps, monkeypatch):
+    monkeypatch.setattr(resilience.random, "uniform", lambda low, high: high)
+    request = _requests(*[api_error(503)] * 4)
+    with pytest.raises(Exception, match="Error code: 503"):
+        call_with_resilience(request, "m", "plan")
+    # Three retries, then the fourth failure is raised
+    base = resilience.LLM_RETRY_BASE_DELAY
+    assert sleeps == [base, base * 2, base * 4]
+    assert len(request.calls) == resilience.LLM_MAX_RETRIES + 1
+
+
+def test_rejected_requests_are_not_retried(sleeps):
+    request = _requests(api_error(400), "ok")
+    with pytest.raises(Exception, match="Error code: 400"):
+        call_with_resilience(request, "m", "plan")
+    assert len(request.calls) == 1
+    assert sleeps == []
+    assert resilience.breaker_for("m").state == "closed"
+
+
+def test_breaker_opens_then_lets_one_probe_through():
+    breaker = CircuitBreaker("m", failure_threshold=2, reset_timeout=0.1)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError, match="Circuit for model 'm' is open"):
+        breaker.before_call()
+
+    time.sleep(0.15)
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    # Only one probe at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+def test_a_failed_probe_opens_the_circuit_again():
+    breaker = CircuitBreaker("m", failure_threshold=2, reset_timeout=0.1)
+    breaker.record_failure()
+    breaker.record_failure()
+    time.sleep(0.15)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_an_open_circuit_stops_the_retries(sleeps):
+    resilience._breakers["m"] = CircuitBreaker("m", failure_threshold=2, reset_timeout=60)
+    request = _requests(*[api_error(500)] * 4)
+    with pytest.raises(CircuitOpenError):
+        call_with_resilience(request, "m", "plan")
+    assert len(request.calls) == 2
+
+
+def test_a_route_skips_a_model_whose_circuit_is_open(fake_llm, monkeypatch):
+    route = Route("primary", fallbacks=["fallback"])
+    monkeypatch.setattr(models.routing_policy, "route", lambda call_site, model=None: route)
+    breaker = resilience.breaker_for("primary")
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert models.call_model(HISTORY, call_site="plan") == "answer of fallback"
+    assert fake_llm.calls("primary") == 0
+
+
+def test_a_slow_request_is_hedged_and_the_first_answer_wins():
+    answered = threading.Event()
+    calls = []
+
+    def request():
+        calls.append(None)
+        if len(calls) == 1:
+            answered.wait(2)
+            return "slow"
+        return "fast"
+
+    started_at = time.monotonic()
+    try:
+        assert hedged(request, 0.05, "plan") == "fast"
+    finally:
+        answered.set()
+    assert time.monotonic() - started_at < 1
+    assert len(calls) == 2
+
+
+def test_a_fast_request_is_not_hedged():
+    request = _requests("ok", "duplicate")
+    assert hedged(request, 1, "plan") == "ok"
+    assert len(request.calls) == 1
+
+
+def test_hedged_requests_share_the_callers_deadline(fake_llm, monkeypatch):
+    route = Route("primary", timeout=60, hedge_after=0.05)
+    monkeypatch.setattr(models.routing_policy, "route", lambda call_site, model=None: route)
+    fake_llm.script("primary", lambda: time.sleep(0.5) or "slow", "fast")
+    with deadline(5):
+        assert models.call_model(HISTORY, call_site="plan") == "fast"
+    assert len(fake_llm.requests) == 2
+    assert all(timeout <= 5 for _, timeout in fake_llm.requests)
+
+
+def test_nested_deadlines_never_extend_the_outer_one():
+    assert time_remaining() is None
+    with deadline(1):
+        with deadline(10):
+            assert time_remaining() <= 1
+        with deadline(0):
+            assert time_remaining() <= 1
+    assert time_remaining() is None
+
+
+def test_request_timeout_is_cut_to_the_deadline():
+    assert request_timeout(30) == 30
+    assert request_timeout() == resilience.LLM_REQUEST_TIMEOUT
+    with deadline(2):
+        assert request_timeout(30) <= 2
+    with deadline(0.01):
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceeded):
+            request_timeout(30)
+
+
+def test_no_retry_the_deadline_leaves_no_time_for(sleeps):
+    request = _requests(api_error(429, {"retry-after": "5"}), "ok")
+    with deadline(1):
+        with pytest.raises(DeadlineExceeded, match="No time left"):
+            call_with_resilience(request, "m", "plan")
+    assert len(request.calls) == 1
+    assert sleeps == []
+
+
+def test_a_spent_deadline_makes_no_request(sleeps):
+    request = _requests("ok")
+    with deadline(0.01):
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceeded):
+            call_with_resilience(request, "m", "plan")
+    assert request.calls == []
@@ -0,0 +1,113 @@
+import json
+import time
+
+import pytest
+from openai import APITimeoutError
+
+from conftest import api_error
+from models import models, resilience
+from models.resilience import DeadlineExceeded, deadline
+from models.routing import DEFAULT_ROUTES, Route, RoutingPolicy, _load_configured_routes, is_valid_json
+
+HISTORY = [{"role": "user", "content": "plan this"}]
+
+
+@pytest.fixture
+def route(monkeypatch):
+    route = Route("primary", fallbacks=["fallback"], escalate_to="strong", timeout=7)
+    monkeypatch.setattr(models.routing_policy, "route", lambda call_site, model=None: route)
+    # One attempt per model, so fallbacks are reached without backoff sleeps
+    monkeypatch.setattr(resilience, "LLM_MAX_RETRIES", 0)
+    return route
+
+
+def test_route_from_config():
+    route = Route.from_config("plan", {"model": "small", "fallbacks": "big", "timeout": 5, "escalate_to": "big", "hedge_after": 2})
+    assert route.models == ["small", "big"]
+    assert (route.timeout, route.escalate_to, route.hedge_after) == (5, "big", 2)
+    assert Route.from_config("plan", "small").models == ["small"]
+
+
+def test_route_drops_itself_from_fallbacks_and_escalation():
+    route = Route("small", fallbacks=["small", "big"], escalate_to="small")
+    assert route.models == ["small", "big"]
+    assert route.escalate_to is None
+
+
+@pytest.mark.parametrize("config", [{}, {"fallbacks": ["big"]}, 3])
+def test_route_needs_a_model(config):
+    with pytest.raises(ValueError, match="needs a model"):
+        Route.from_config("plan", config)
+
+
+def test_policy_prefers_configured_then_caller_then_default_routes():
+    policy = RoutingPolicy(configured={"plan": {"model": "configured"}, "broken": {"fallbacks": []}})
+    assert policy.route("plan", "gpt-4o").model == "configured"
+    assert policy.route("evaluate", "gpt-4o").model == "gpt-4o"
+    assert policy.route("tool-select").model == DEFAULT_ROUTES["tool-select"]["model"]
+    assert policy.route("somewhere-else").model == DEFAULT_ROUTES["elaborate"]["model"]
+    # An invalid configured route is ignored, not fatal
+    assert "broken" not in policy.configured
+
+
+def test_env_routes_override_the_routes_file(tmp_path, monkeypatch):
+    routes_file = tmp_path / "routes.json"
+    routes_file.write_text(json.dumps({"plan": "from-file", "evaluate": "from-file"}))
+    monkeypatch.setattr("models.routing.MODEL_ROUTES_FILE", str(routes_file))
+    monkeypatch.setattr("models.routing.MODEL_ROUTES", json.dumps({"plan": "from-env"}))
+    assert _load_configured_routes() == {"plan": "from-env", "evaluate": "from-file"}
+
+    monkeypatch.setattr("models.routing.MODEL_ROUTES", "{not json")
+    assert _load_configured_routes() == {"plan": "from-file", "evaluate": "from-file"}
+
+
+@pytest.mark.parametrize("answer, valid", [
+    ('{"a": 1}', True),
+    ('```json\n{"done": True, "value": None}\n```', True),
+    ("[1, 2]", True),
+    ("Here is the plan: {", False),
+    ("", False),
+])
+def test_is_valid_json(answer, valid):
+    assert is_valid_json(answer) is valid
+
+
+def test_route_timeout_is_the_request_timeout(fake_llm, route):
+    assert models.call_model(HISTORY, call_site="plan") == "answer of primary"
+    assert fake_llm.requests == [("primary", 7)]
+
+
+@pytest.mark.parametrize("error", [api_error(500), api_error(400), APITimeoutError(request=None)])
+def test_a_failing_model_falls_back(fake_llm, route, error):
+    fake_llm.script("primary", error)
+    assert models.call_model(HISTORY, call_site="plan") == "answer of fallback"
+    assert [model for model, _ in fake_llm.requests] == ["primary", "fallback"]
+
+
+def test_the_last_models_error_is_raised(fake_llm, route):
+    fake_llm.script("primary", api_error(500))
+    fake_llm.script("fallback", api_error(503))
+    with pytest.raises(Exception, match="Error code: 503"):
+        models.call_model(HISTORY, call_site="plan")
+
+
+def test_a_spent_deadline_does_not_fall_back(fake_llm, route):
+    with deadline(0.01):
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceeded):
+            models.call_model(HISTORY, call_site="plan")
+    assert fake_llm.requests == []
+
+
+def test_invalid_json_escalates_when_json_is_expected(fake_llm, route):
+    fake_llm.script("primary", "Sure! Here is the plan")
+    fake_llm.script("strong", '{"subtasks": []}')
+    assert models.call_model(HISTORY, call_site="plan", expect_json=True) == '{"subtasks": []}'
+    assert [model for model, _ in fake_llm.requests] == ["primary", "strong"]
+
+
+def test_no_escalation_for_valid_json_or_text_answers(fake_llm, route):
+    fake_llm.script("primary", '{"subtasks": []}', "Sure!")
+    assert models.call_model(HISTORY, call_site="plan", expect_json=True) == '{"subtasks": []}'
+    assert models.call_model(HISTORY, call_site="plan") == "Sure!"
+    assert fake_llm.calls("strong") == 0
@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+from code_agent import sandbox
+from code_agent.code_agent import CodeAgent
+from code_agent.sandbox import SandboxError, SandboxPool
+
+PID = "def pid():\n    import os\n    return os.getpid()\n"
+
+
+def _pid(pool):
+    return pool.run(PID, "pid", call_with_input=False)["result"]
+
+
+def _wait_for_idle(pool, count, timeout=30):
+    give_up_at = time.monotonic() + timeout
+    while pool._idle.qsize() < count:
+        assert time.monotonic() < give_up_at, "sandbox workers did not become idle"
+        time.sleep(0.05)
+
+
+def test_a_crashed_worker_becomes_a_failed_subtask(sandbox_pool):
+    agent = CodeAgent(chat_history=[], import_libraries=[])
+    agent.import_modules = []
+    crash = {"tool_name": "crash", "input_from_tool": "", "code": "def crash():\n    import os\n    os._exit(3)\n"}
+    record = agent._run_subtask_sandboxed(crash, None)
+    assert record["has_result"] is False
+    assert record["error"].startswith("SandboxError:")
+    assert "exit code 3" in record["error"]
+
+    # The dead worker is replaced and the pool keeps serving
+    _wait_for_idle(sandbox_pool, 2)
+    fine = {"tool_name": "fine", "input_from_tool": "", "code": "def fine():\n    return 1\n"}
+    assert agent._run_subtask_sandboxed(fine, None)["result"] == 1
+
+
+def test_a_worker_is_recycled_after_max_jobs():
+    pool = SandboxPool([], size=1, max_jobs=2)
+    try:
+        first = _pid(pool)
+        assert _pid(pool) == first
+        # The replacement starts in the background while the old worker keeps serving
+        _wait_for_idle(pool, 2)
+        replacement = _pid(pool)
+        assert replacement != first
+        assert _pid(pool) == replacement
+    finally:
+        pool.shutdown()
+
+
+@pytest.fixture
+def failing_spawns(monkeypatch):
+    class _BrokenWorker:
+        def __init__(self, *args, **kwargs):
+            raise OSError("no processes left")
+
+    monkeypatch.setattr(sandbox, "_Worker", _BrokenWorker)
+    monkeypatch.setattr(sandbox, "SANDBOX_SPAWN_ATTEMPTS", 2)
+
+
+def test_a_slot_whose_worker_cannot_start_fails_its_jobs(failing_spawns):
+    pool = SandboxPool([], size=1)
+    try:
+        with pytest.raises(SandboxError, match="failed to start 2 times: no processes left"):
+            pool.run(PID, "pid", call_with_input=False)
+    finally:
+        pool.shutdown()
+
+
+def test_a_shut_down_pool_refuses_jobs():
+    pool = SandboxPool([], size=1)
+    pool.shutdown()
+    with pytest.raises(SandboxError, match="shut down"):
+        pool.run(PID, "pid", call_with_input=False)
@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+
+from sessions import session_store
+from sessions.session_store import InMemorySessionStore, RedisSessionStore, finish_turn, start_turn
+
+
+@pytest.fixture(params=["memory", "fakeredis"])
+def store(request, monkeypatch):
+    if request.param == "memory":
+        store = InMemorySessionStore()
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")  # Lua scripting for the read and compare-and-set scripts
+        store = RedisSessionStore(client=fakeredis.FakeRedis(), prefix="test-session:")
+    store.history_token_budget = 100
+    store.recent_messages = 2
+    summaries = []
+
+    def summarize(summary, messages, model):
+        summaries.append([message["content"] for message in messages])
+        return f"{summary} + {len(messages)} messages".strip(" +")
+
+    monkeypatch.setattr(session_store, "summarize", summarize)
+    store.summaries = summaries
+    return store
+
+
+def _turns(store, count, words=5):
+    for index in range(count):
+        store.append("s1", {"role": "user", "content": f"question {index} " + "word " * words})
+        store.append("s1", {"role": "assistant", "content": f"answer {index} " + "word " * words})
+
+
+def test_history_returns_the_messages_in_order(store):
+    _turns(store, 2)
+    history = store.history("s1")
+    assert [message["content"].split()[:2] for message in history] == [
+        ["question", "0"], ["answer", "0"], ["question", "1"], ["answer", "1"]
+    ]
+    assert store.history("other") == []
+
+
+def test_history_keeps_the_newest_messages_within_the_budget(store):
+    _turns(store, 5, words=20)  # about 30 tokens per message against a budget of 100
+    history = store.history("s1")
+    assert 1 < len(history) < 10
+    assert history[-1]["content"].startswith("answer 4")
+    assert sum(session_store._message_tokens(message) for message in history) <= store.history_token_budget
+
+
+def test_an_oversized_newest_message_is_cut_down(store):
+    store.append("s1", {"role": "user", "content": "x" * 5000})
+    (message,) = store.history("s1")
+    assert len(message["content"]) < 1000 and "omitted" in message["content"]
+
+
+def test_compaction_folds_all_but_the_recent_messages(store):
+    _turns(store, 5, words=20)
+    assert store.compact("s1") is True
+    assert len(store.summaries[0]) == 8
+
+    history = store.history("s1")
+    assert history[0]["role"] == "system" and "8 messages" in history[0]["content"]
+    assert [message["content"].split()[:2] for message in history[1:]] == [["question", "4"], ["answer", "4"]]
+    assert store.compact("s1") is False  # Within the budget now
+
+
+def test_concurrent_compaction_keeps_one_summary(store, monkeypatch):
+    _turns(store, 5, words=20)
+    first_inside = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def slow_summarize(summary, messages, model):
+        if not first_inside.is_set():
+            first_inside.set()
+            release.wait(5)
+            return "first summary"
+        return "second summary"
+
+    monkeypatch.setattr(session_store, "summarize", slow_summarize)
+    first = threading.Thread(target=lambda: results.append(store.compact("s1")))
+    first.start()
+    first_inside.wait(5)
+    # Compare-and-set on summarized_upto: whoever folds first wins, the other gives up
+    results.append(store.compact("s1"))
+    release.set()
+    first.join(5)
+
+    assert sorted(results) == [False, True]
+    assert store.history("s1")[0]["content"].endswith("second summary")
+
+
+def test_stale_summary_is_refused(store):
+    _turns(store, 1)
+    assert store._set_summary("s1", 0, 2, "summary") is True
+    assert store._set_summary("s1", 0, 2, "another") is False
+
+
+@pytest.fixture
+def default_store(monkeypatch):
+    monkeypatch.setattr(session_store, "_default_store", None)
+    monkeypatch.setattr(session_store, "SESSION_BACKEND", "auto")
+
+
+def test_auto_backend_falls_back_to_memory(default_store, monkeypatch):
+    monkeypatch.setattr(session_store, "get_redis_client", lambda: None)
+    assert isinstance(session_store.get_session_store(), InMemorySessionStore)
+
+
+def test_auto_backend_uses_reachable_redis(default_store, monkeypatch):
+    monkeypatch.setattr(session_store, "get_redis_client", lambda: object())
+    assert isinstance(session_store.get_session_store(), RedisSessionStore)
+
+
+def test_memory_backend_ignores_redis(default_store, monkeypatch):
+    monkeypatch.setattr(session_store, "SESSION_BACKEND", "memory")
+    monkeypatch.setattr(session_store, "get_redis_client", lambda: object())
+    assert isinstance(session_store.get_session_store(), InMemorySessionStore)
+
+
+@pytest.mark.parametrize("answer, expected", [
+    ("<p>It is <b>sunny</b></p>", "It is\nsunny"),
+    ({"fetch": {"temperature": 21}}, '(The task was not completed. Partial results: {"fetch": {"temperature": 21}})'),
+    (None, "(The task failed without an answer.)"),
+])
+def test_every_turn_gets_an_assistant_message(store, monkeypatch, answer, expected):
+    monkeypatch.setattr(session_store, "_default_store", store)
+    start_turn("s1", "weather in Rome?")
+    finish_turn("s1", answer)
+    history = store.history("s1")
+    assert [message["role"] for message in history] == ["user", "assistant"]
+    assert history[1]["content"] == expected
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from code_agent.utils import StreamingArrayExtractor
+
+
+SUBTASKS = [
+    {"tool_name": "fetch", "input_from_tool": "", "code": "def fetch():\n    return {\"a\": [1, 2]}"},
+    {"tool_name": "parse", "input_from_tool": "fetch", "code": "def parse(x):\n    return x['a']"},
+]
+PLAN = json.dumps({"subtasks": SUBTASKS, "notes": "done"})
+
+
+def _feed(extractor, chunks):
+    return [(index, element) for index, chunk in enumerate(chunks) for element in extractor.feed(chunk)]
+
+
+@pytest.mark.parametrize("size", [1, 3, 17, len(PLAN)])
+def test_elements_arrive_whatever_the_chunk_size(size):
+    extractor = StreamingArrayExtractor("subtasks")
+    emitted = _feed(extractor, [PLAN[start:start + size] for start in range(0, len(PLAN), size)])
+    assert [element for _, element in emitted] == SUBTASKS
+    assert extractor.done and not extractor.failed
+    assert extractor.count == 2
+
+
+def test_each_element_is_emitted_by_the_chunk_that_closes_it():
+    first = json.dumps(SUBTASKS[0])
+    first_end = PLAN.index(first) + len(first)
+    extractor = StreamingArrayExtractor("subtasks")
+    assert extractor.feed(PLAN[:first_end - 1]) == []
+    assert extractor.feed(PLAN[first_end - 1:first_end]) == [SUBTASKS[0]]
+    assert not extractor.done
+
+
+def test_braces_and_the_key_inside_strings_are_ignored():
+    plan = json.dumps({
+        "thought": "split into \"subtasks\": [{ then }] \\",
+        "subtasks": [{"tool_name": "fetch", "code": "print('}]{[')"}],
+    })
+    extractor = StreamingArrayExtractor("subtasks")
+    assert [element for _, element in _feed(extractor, list(plan))] == [{"tool_name": "fetch", "code": "print('}]{[')"}]
+
+
+def test_only_the_top_level_field_counts():
+    plan = json.dumps({
+        "meta": {"subtasks": [{"tool_name": "nested"}]},
+        "examples": [{"tool_name": "example"}],
+        "subtasks": [{"tool_name": "real"}],
+    })
+    extractor = StreamingArrayExtractor("subtasks")
+    assert [element for _, element in _feed(extractor, [plan])] == [{"tool_name": "real"}]
+
+
+def test_nothing_is_read_after_the_array_closes():
+    extractor = StreamingArrayExtractor("subtasks")
+    extractor.feed('{"subtasks": [], ')
+    assert extractor.done
+    assert extractor.feed('"subtasks": [{"tool_name": "late"}]}') == []
+
+
+def test_an_unparseable_element_sets_failed_and_stops():
+    extractor = StreamingArrayExtractor("subtasks")
+    elements = extractor.feed('{"subtasks": [{"tool_name": fetch}, {"tool_name": "parse"}]}')
+    assert elements == []
+    assert extractor.failed and not extractor.done
@@ -0,0 +1,134 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from tools import tool_index, tools
+from tools.tool_index import SelectionCache, ToolIndex, narrow_tools
+
+TOOLS = [
+    {"tool_name": "get_weather", "description": "Current weather forecast for a city",
+     "params": [{"param_name": "city", "param_description": "City name"}]},
+    {"tool_name": "send_email", "description": "Send an email message to a recipient",
+     "params": [{"param_name": "recipient"}, {"param_name": "body"}]},
+    {"tool_name": "translate_text", "description": "Translate text into another language",
+     "params": [{"param_name": "language", "enums": ["english", "italian"]}]},
+    {"tool_name": "stock_price", "description": "Latest stock market quote of a ticker", "params": []},
+    {"tool_name": "list_invoices", "description": "List the invoices of the current customer", "params": []},
+    {"tool_name": "book_meeting", "description": "Book a meeting room in the calendar", "params": []},
+    {"tool_name": "reset_password", "description": "Reset the account password", "params": []},
+    {"tool_name": "track_parcel", "description": "Track the delivery of a parcel shipment", "params": []},
+]
+
+
+def _history(text):
+    return [{"role": "user", "content": text}]
+
+
+def test_index_ranks_the_matching_tool_first():
+    scores = ToolIndex(TOOLS).scores("what is the weather forecast in Rome")
+    assert int(scores.argmax()) == 0
+    assert not ToolIndex(TOOLS).scores("zzz qqq").any()
+
+
+def test_narrowing_keeps_the_top_k_in_list_order(monkeypatch):
+    monkeypatch.setattr(tool_index, "TOOL_SELECT_TOP_K", 3)
+    candidates, _ = narrow_tools(_history("send the invoices list by email"), TOOLS)
+    names = [tool["tool_name"] for tool in candidates]
+    assert len(names) == 3
+    assert {"send_email", "list_invoices"} <= set(names)
+    assert names == [tool["tool_name"] for tool in TOOLS if tool["tool_name"] in names]
+
+
+def test_no_shared_term_keeps_the_whole_list(monkeypatch):
+    monkeypatch.setattr(tool_index, "TOOL_SELECT_TOP_K", 3)
+    assert narrow_tools(_history("hello there"), TOOLS) == (TOOLS, None)
+
+
+def test_clear_match_is_confident():
+    _, confident = narrow_tools(_history("track my parcel delivery"), TOOLS)
+    assert confident["tool_name"] == "track_parcel"
+
+
+def test_close_runner_up_is_not_confident():
+    twins = TOOLS + [{"tool_name": "track_parcel_return", "description": "Track the delivery of a returned parcel", "params": []}]
+    _, confident = narrow_tools(_history("track my parcel delivery"), twins)
+    assert confident is None
+
+
+def test_weak_match_is_not_confident(monkeypatch):
+    monkeypatch.setattr(tool_index, "TOOL_SELECT_CONFIDENCE", 0.99)
+    _, confident = narrow_tools(_history("track my parcel delivery"), TOOLS)
+    assert confident is None
+
+
+def test_cache_key_ignores_case_and_spacing_but_not_tool_state():
+    cache = SelectionCache()
+    key = cache.key("tool-select", _history("Track my  parcel"), TOOLS, "tool_selection", None, None)
+    assert cache.key("tool-select", _history("track my parcel "), TOOLS, "tool_selection", None, None) == key
+    changed = [
+        cache.key("tool-select", _history("Track my parcel"), TOOLS[:-1], "tool_selection", None, None),
+        cache.key("tool-select", _history("Track my parcel"), TOOLS, "waiting_user_params", None, None),
+        cache.key("tool-select", _history("Track my parcel"), TOOLS, "tool_selection", "track_parcel", None),
+        cache.key("tool-select", _history("Track my parcel"), TOOLS, "tool_selection", None, [{"param_name": "id"}]),
+        cache.key("param-extract", _history("Track my parcel"), TOOLS, "tool_selection", None, None),
+    ]
+    assert key not in changed and len(set(changed)) == len(changed)
+
+
+def test_cached_response_is_a_copy():
+    cache = SelectionCache()
+    cache.set("key", {"selected_tool": "get_weather", "active_tool_params": [{"param_name": "city"}]})
+    cache.get("key")["active_tool_params"][0]["param_value"] = "Rome"
+    assert "param_value" not in cache.get("key")["active_tool_params"][0]
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    monkeypatch.setattr(tools, "selection_cache", SelectionCache())
+    calls = []
+    answer = {"value": {"selected_tool": "get_weather", "completed": False,
+                        "active_tool_params": [{"param_name": "city", "param_value": None}],
+                        "ask_user_param": "Which city?"}}
+
+    def call_model(chat_history, call_site, expect_json):
+        calls.append(call_site)
+        value = answer["value"]
+        return value if isinstance(value, str) else json.dumps(value)
+
+    monkeypatch.setattr(tools, "call_model", call_model)
+    return SimpleNamespace(data=SimpleNamespace(state="tool_selection", active_tool=None, active_tool_params=None),
+                           calls=calls, answer=answer)
+
+
+def test_confident_tool_without_parameters_skips_the_model(agent):
+    response = tools.select_tool(agent, _history("track my parcel delivery"), TOOLS, None)
+    assert response == {"completed": True, "selected_tool": "track_parcel"}
+    assert agent.calls == []
+    assert agent.data.active_tool == "track_parcel"
+
+
+def test_confident_tool_with_parameters_asks_the_model(agent):
+    response = tools.select_tool(agent, _history("weather forecast city weather"), TOOLS, None)
+    assert agent.calls == ["tool-select"]
+    assert response["selected_tool"] == "get_weather"
+    assert agent.data.state == "waiting_user_params"
+    assert agent.data.answer_message == "Which city?"
+
+
+def test_repeated_request_in_the_same_state_is_cached(agent):
+    tools.select_tool(agent, _history("weather forecast please"), TOOLS, None)
+    agent.data.state, agent.data.active_tool = "tool_selection", None
+    tools.select_tool(agent, _history("Weather  forecast please"), TOOLS, None)
+    assert agent.calls == ["tool-select"]
+
+    # Another active tool is another state: the cached decision does not apply
+    agent.data.state, agent.data.active_tool = "tool_selection", "send_email"
+    tools.select_tool(agent, _history("Weather forecast please"), TOOLS, None)
+    assert agent.calls == ["tool-select", "tool-select"]
+
+
+def test_unreadable_answer_leaves_the_state(agent):
+    agent.answer["value"] = "not json"
+    assert tools.select_tool(agent, _history("weather forecast please"), TOOLS, None) is None
+    assert agent.data.state == "tool_selection" and agent.data.active_tool is None
@@ -0,0 +1,157 @@
+import time
+
+import pytest
+
+from code_agent import tool_library as tool_library_module
+from code_agent.code_agent import CodeAgent
+from code_agent.tool_library import ToolLibrary, describe_tools, resolve_reference, tool_id
+
+SEARCH = {
+    "tool_name": "search_web",
+    "input_from_tool": "",
+    "description": "Search the web for a query and return the top results",
+    "imports": ["requests"],
+    "code": "def search_web(query='weather in Rome', limit=3):\n    return [f'{query} #{rank}' for rank in range(limit)]\n",
+}
+SUMMARIZE = {
+    "tool_name": "summarize",
+    "input_from_tool": "search_web",
+    "description": "Summarize a list of search results in one line",
+    "code": "def summarize(results):\n    return '; '.join(results)\n",
+}
+CATALOG = [{"lib_names": ["requests"]}]
+
+
+@pytest.fixture
+def redis(monkeypatch, request):
+    """None for a process-local library, or an in-process fake Redis shared by the libraries of a test."""
+    client = None
+    if getattr(request, "param", "local") == "fakeredis":
+        fakeredis = pytest.importorskip("fakeredis")
+        client = fakeredis.FakeRedis()
+    monkeypatch.setattr(tool_library_module, "get_redis_client", lambda: client)
+    return client
+
+
+@pytest.fixture
+def library(redis, monkeypatch):
+    library = ToolLibrary(sync_interval=0)
+    monkeypatch.setattr(tool_library_module, "tool_library", library)
+    return library
+
+
+def test_register_records_the_signature_and_counts_verifications(library):
+    entry_id = library.register(SEARCH)
+    assert entry_id == tool_id("search_web", SEARCH["code"])
+    entry = library.get(entry_id)
+    assert entry["signature"] == "search_web(query='weather in Rome', limit=3)"
+    assert (entry["takes_input"], entry["imports"], entry["verified"]) == (False, ["requests"], 1)
+
+    assert library.register(dict(SEARCH)) == entry_id
+    assert library.get(entry_id)["verified"] == 2
+
+
+@pytest.mark.parametrize("subtask", [
+    {"tool_name": "search_web", "code": "def other():\n    pass\n"},
+    {"tool_name": "search_web", "code": "def search_web(:\n"},
+    {"tool_name": "search_web"},
+])
+def test_subtasks_without_their_function_are_not_registered(library, subtask):
+    assert library.register(subtask) is None
+    assert library.sources() == []
+
+
+def test_get_by_name_falls_back_to_the_latest_version(library):
+    library.register(SEARCH)
+    newer = dict(SEARCH, code=SEARCH["code"].replace("limit=3", "limit=5"))
+    newer_id = library.register(newer)
+    assert library.get("search_web#00000000", "search_web")["id"] == newer_id
+    assert library.get("search_web#00000000") is None
+
+
+def test_the_least_recently_used_tool_is_evicted(redis):
+    library = ToolLibrary(max_entries=2, sync_interval=0)
+    search_id = library.register(SEARCH)
+    summarize_id = library.register(SUMMARIZE)
+    library.get(search_id)
+    library.register(dict(SUMMARIZE, tool_name="shorten", code="def shorten(results):\n    return results[:1]\n"))
+    assert library.get(search_id) is not None
+    assert library.get(summarize_id) is None
+
+
+def test_offer_ranks_matching_tools_the_catalog_can_run(library):
+    library.register(SEARCH)
+    library.register(SUMMARIZE)
+    offered = library.offer("search the web for the weather in Paris", CATALOG)
+    assert [entry["name"] for entry in offered][0] == "search_web"
+    # search_web imports requests, which this catalog does not provide
+    assert [entry["name"] for entry in library.offer("search the web and summarize the results", [])] == ["summarize"]
+    assert library.offer("translate a poem into Latin", CATALOG) == []
+
+
+def test_offer_shows_one_version_per_name(library):
+    library.register(SEARCH)
+    newer_id = library.register(dict(SEARCH, code=SEARCH["code"].replace("limit=3", "limit=5")))
+    assert [entry["id"] for entry in library.offer("search the web", CATALOG)] == [newer_id]
+
+
+def test_expired_tools_are_not_offered(library):
+    library.ttl = 60
+    entry_id = library.register(SEARCH)
+    library._entries[entry_id]["verified_at"] = time.time() - 120
+    assert library.offer("search the web", CATALOG) == []
+    assert library.get(entry_id) is None
+
+
+def test_describe_tools_shows_ids_signatures_and_inputs(library):
+    library.register(SEARCH)
+    library.register(SUMMARIZE)
+    description = describe_tools(library.offer("search the web and summarize the results", CATALOG))
+    assert f"- {tool_id('search_web', SEARCH['code'])}: search_web(query='weather in Rome', limit=3) (first tool, no input)" in description
+    assert "summarize(results) (takes the previous tool's output)" in description
+
+
+def test_a_later_plan_runs_a_referenced_tool(library):
+    entry_id = library.register(SEARCH)
+    reference = {"tool_name": "search_web", "input_from_tool": "", "verified_tool": entry_id, "arguments": {"query": "Paris", "limit": 2}}
+    resolved = resolve_reference(reference)
+    assert resolved["code"] == SEARCH["code"]
+    assert resolved["imports"] == ["requests"]
+
+    agent = CodeAgent(chat_history=[], import_libraries=[])
+    agent.import_modules = []
+    record = agent._run_subtask_inline(resolved, None)
+    assert record["result"] == ["Paris #0", "Paris #1"]
+
+
+def test_a_reference_planned_under_another_name_is_renamed(library):
+    entry_id = library.register(SEARCH)
+    agent = CodeAgent(chat_history=[], import_libraries=[])
+    agent.json_plan = {}
+    plan = [
+        {"tool_name": "find", "input_from_tool": "", "verified_tool": entry_id},
+        {"tool_name": "digest", "input_from_tool": "find", "code": "def digest(results):\n    return results\n"},
+    ]
+    resolved = list(agent._resolved(plan))
+    assert resolved[0]["tool_name"] == "search_web"
+    assert resolved[0]["arguments"] == {}
+    assert resolved[1]["input_from_tool"] == "search_web"
+
+
+def test_an_unknown_reference_gets_code_that_explains(library):
+    resolved = resolve_reference({"tool_name": "search_web", "verified_tool": "search_web#deadbeef"})
+    with pytest.raises(LookupError, match="search_web#deadbeef is not in the library"):
+        exec(resolved["code"], {})
+
+
+def test_a_subtask_with_code_is_left_alone(library):
+    subtask = dict(SUMMARIZE, verified_tool="summarize#deadbeef")
+    assert resolve_reference(subtask) is subtask
+
+
+@pytest.mark.parametrize("redis", ["fakeredis"], indirect=True)
+def test_tools_are_shared_through_redis(redis):
+    entry_id = ToolLibrary(sync_interval=0).register(SEARCH)
+    other = ToolLibrary(sync_interval=0)
+    assert other.get(entry_id)["code"] == SEARCH["code"]
+    assert other.sources() == [SEARCH["code"]]
@@ -0,0 +1,101 @@
+import pytest
+
+from code_agent.validation import PlanValidator, _CodeCache, compile_subtask
+
+
+def _subtask(tool_name, code, input_from_tool="", arguments=None):
+    subtask = {"tool_name": tool_name, "input_from_tool": input_from_tool, "code": code}
+    if arguments is not None:
+        subtask["arguments"] = arguments
+    return subtask
+
+
+def _validator(*earlier_tools):
+    validator = PlanValidator()
+    for tool_name in earlier_tools:
+        validator.add({"tool_name": tool_name})
+    return validator
+
+
+def test_a_valid_subtask_has_no_problems():
+    code = (
+        "import json\n"
+        "def parse(page, limit=3):\n"
+        "    rows = [json.loads(line) for line in page.splitlines()]\n"
+        "    logger.info(len(rows))\n"
+        "    return rows[:limit]\n"
+    )
+    assert _validator("fetch").problems(_subtask("parse", code, "fetch")) == []
+
+
+@pytest.mark.parametrize("subtask, problem", [
+    (_subtask("", "def f():\n    pass\n"), "the subtask has no tool_name"),
+    (_subtask("parse", ""), "the subtask has no code"),
+    (_subtask("parse", "def parse(x):\n    return x\n", "later"),
+     "input_from_tool 'later' is not the tool_name of an earlier subtask"),
+    (_subtask("parse", "def parse(:\n"), "SyntaxError at line 1"),
+    (_subtask("parse", "def other():\n    pass\n"), "the code does not define a top-level function named 'parse'"),
+    (_subtask("parse", "def parse():\n    return rows\n"), "names used but never defined or imported: rows"),
+    (_subtask("parse", "def parse(page):\n    return page\n"), "is called without arguments but requires 1"),
+    (_subtask("parse", "def parse():\n    return 1\n", "fetch"), "takes no parameter"),
+    (_subtask("parse", "def parse(page, limit):\n    return page\n", "fetch"), "is called with one argument but requires 2"),
+    (_subtask("parse", "def parse(*, limit):\n    return limit\n"), "required keyword-only parameters ['limit']"),
+    (_subtask("parse", "def parse(limit=1):\n    return limit\n", arguments={"size": 2}), "has no parameters ['size']"),
+    (_subtask("parse", "def parse(limit=1):\n    return limit\n", arguments=[2]), "arguments must be a JSON object"),
+])
+def test_problems(subtask, problem):
+    problems = _validator("fetch").problems(subtask)
+    assert any(problem in found for found in problems), problems
+
+
+def test_arguments_fill_required_parameters():
+    code = "def parse(page, limit):\n    return page[:limit]\n"
+    assert _validator("fetch").problems(_subtask("parse", code, "fetch", arguments={"limit": 2})) == []
+
+
+def test_names_bound_in_any_scope_are_known():
+    code = (
+        "def parse():\n"
+        "    try:\n"
+        "        from os import path as p\n"
+        "    except ImportError as error:\n"
+        "        raise error\n"
+        "    total = sum(value for value in range(3))\n"
+        "    return p, total\n"
+    )
+    assert PlanValidator().problems(_subtask("parse", code)) == []
+
+
+def test_a_star_import_skips_the_undefined_names_check():
+    code = "from math import *\ndef area(r=1):\n    return pi * r ** 2\n"
+    assert PlanValidator().problems(_subtask("area", code)) == []
+
+
+def test_added_subtasks_can_be_read_by_later_ones():
+    validator = PlanValidator()
+    read = _subtask("parse", "def parse(page):\n    return page\n", "fetch")
+    assert validator.problems(read) != []
+    validator.add(_subtask("fetch", "def fetch():\n    return ''\n"))
+    assert validator.problems(read) == []
+
+
+def test_compile_subtask_reuses_the_compiled_code():
+    source = "def cached():\n    return 1\n"
+    assert compile_subtask(source) is compile_subtask(source)
+    assert compile_subtask(source) is not compile_subtask(source + "\n")
+
+
+def test_code_cache_evicts_the_least_recently_used():
+    cache = _CodeCache(max_entries=2)
+    first = cache.compile("a = 1")
+    second = cache.compile("b = 2")
+    assert cache.compile("a = 1") is first
+    cache.compile("c = 3")
+    assert cache.compile("a = 1") is first
+    assert cache.compile("b = 2") is not second
+
+
+def test_compiled_code_keeps_the_exec_filename():
+    namespace = {}
+    exec(compile_subtask("def where():\n    import inspect\n    return inspect.stack()[0].filename\n"), namespace)
+    assert namespace["where"]() == "<string>"
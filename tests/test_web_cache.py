@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from tools import web
+from tools.web import WebFetcher, extract_main_text
+
+
+def _write(directory, name, size, age):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as cache_file:
+        cache_file.write(b"x" * size)
+    written_at = time.time() - age
+    os.utime(path, (written_at, written_at))
+    return path
+
+
+def test_sweep_removes_expired_then_oldest_files(tmp_path):
+    fetcher = WebFetcher(cache_dir=str(tmp_path), max_age=3600, max_mb=2500 / (1024 * 1024))
+    expired = _write(tmp_path, "expired.json", 100, age=7200)
+    oldest = _write(tmp_path, "oldest.json", 1000, age=300)
+    older = _write(tmp_path, "older.json", 1000, age=200)
+    newest = _write(tmp_path, "newest.json", 1000, age=100)
+
+    fetcher._sweep(force=True)
+
+    assert not os.path.exists(expired)
+    assert not os.path.exists(oldest)
+    assert os.path.exists(older) and os.path.exists(newest)
+
+
+def test_get_fetcher_creates_one_fetcher(monkeypatch, tmp_path):
+    monkeypatch.setattr(web, "_default_fetcher", None)
+    created = []
+    original_init = WebFetcher.__init__
+
+    def slow_init(self, *args, **kwargs):
+        created.append(self)
+        time.sleep(0.05)
+        original_init(self, str(tmp_path))
+
+    monkeypatch.setattr(WebFetcher, "__init__", slow_init)
+    fetchers = []
+    threads = [threading.Thread(target=lambda: fetchers.append(web.get_fetcher())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert all(fetcher is fetchers[0] for fetcher in fetchers)
+
+
+PAGE = """<html><head><title>Rome</title><script>var tracking = 1;</script></head><body>
+<nav>Home | About</nav><header>Site header</header>
+<article>{body}</article>
+<footer>Copyright footer</footer></body></html>"""
+
+
+class _Site:
+    """Pages served by the local stand-in server, and the requests it received."""
+
+    def __init__(self):
+        self.pages = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def serve(self, path, body, status=200, headers=None, delay=0.0):
+        self.pages[path] = (status, body, headers or {}, delay)
+
+    def hits(self, path):
+        with self.lock:
+            return [headers for requested, headers in self.requests if requested == path]
+
+
+@pytest.fixture
+def site():
+    site = _Site()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with site.lock:
+                site.requests.append((self.path, dict(self.headers)))
+            status, body, headers, delay = site.pages.get(self.path, (404, "", {}, 0.0))
+            time.sleep(delay)
+            etag = headers.get("ETag")
+            if etag and self.headers.get("If-None-Match") == etag:
+                status, body = 304, ""
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            payload = body.encode("utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    site.url = f"http://127.0.0.1:{server.server_address[1]}"
+    site.server = server
+    yield site
+    server.shutdown()
+    server.server_close()
+
+
+def test_fresh_entry_is_served_without_a_request(site, tmp_path):
+    site.serve("/rome", PAGE.format(body="The capital of Italy. " * 20))
+    fetcher = WebFetcher(cache_dir=str(tmp_path), ttl=3600)
+
+    first = fetcher.fetch(site.url + "/rome")
+    second = fetcher.fetch(site.url + "/rome")
+
+    assert first["from_cache"] is False and first["title"] == "Rome"
+    assert second["from_cache"] is True and second["text"] == first["text"]
+    assert len(site.hits("/rome")) == 1
+
+
+def test_stale_entry_is_revalidated_with_a_304(site, tmp_path):
+    headers = {"ETag": '"v1"', "Last-Modified": "Wed, 01 Jan 2025 00:00:00 GMT"}
+    site.serve("/rome", PAGE.format(body="The capital of Italy. " * 20), headers=headers)
+    fetcher = WebFetcher(cache_dir=str(tmp_path), ttl=0)
+
+    first = fetcher.fetch(site.url + "/rome")
+    revalidated = fetcher.fetch(site.url + "/rome")
+
+    conditional = site.hits("/rome")[1]
+    assert conditional["If-None-Match"] == '"v1"'
+    assert conditional["If-Modified-Since"] == headers["Last-Modified"]
+    assert revalidated["from_cache"] is True
+    assert revalidated["text"] == first["text"]
+
+
+def test_stale_copy_is_served_when_the_site_fails(site, tmp_path):
+    site.serve("/rome", PAGE.format(body="The capital of Italy. " * 20))
+    fetcher = WebFetcher(cache_dir=str(tmp_path), ttl=0)
+    first = fetcher.fetch(site.url + "/rome")
+
+    site.serve("/rome", "unavailable", status=503)
+    on_error = fetcher.fetch(site.url + "/rome")
+    site.server.shutdown()
+    site.server.server_close()
+    on_down = fetcher.fetch(site.url + "/rome", timeout=1)
+
+    for page in (on_error, on_down):
+        assert page["from_cache"] is True
+        assert page["error"] is None
+        assert page["text"] == first["text"]
+
+
+def test_failure_without_a_cached_copy_is_reported(site, tmp_path):
+    site.serve("/missing", "gone", status=500)
+    page = WebFetcher(cache_dir=str(tmp_path)).fetch(site.url + "/missing")
+    assert page["status"] is None and page["text"] == ""
+    assert "500" in page["error"]
+
+
+def test_extract_main_text_drops_boilerplate():
+    extracted = extract_main_text(PAGE.format(body="The capital of Italy. " * 20))
+    assert extracted["title"] == "Rome"
+    assert "The capital of Italy." in extracted["text"]
+    for boilerplate in ("tracking", "Home | About", "Site header", "Copyright footer"):
+        assert boilerplate not in extracted["text"]
+
+
+def test_concurrent_fetches_keep_the_input_order(site, tmp_path):
+    paths = [f"/page-{index}" for index in range(6)]
+    for index, path in enumerate(paths):
+        # The first pages answer last
+        site.serve(path, f"<html><title>{path}</title><body>{path}</body></html>", delay=0.05 * (len(paths) - index))
+    fetcher = WebFetcher(cache_dir=str(tmp_path), max_workers=6)
+
+    started_at = time.monotonic()
+    pages = fetcher.fetch_many([site.url + path for path in paths])
+
+    assert [page["title"] for page in pages] == paths
+    assert time.monotonic() - started_at < 0.05 * sum(range(1, len(paths) + 1))
+
+
+def test_fetch_pages_uses_the_shared_fetcher(site, tmp_path, monkeypatch):
+    monkeypatch.setattr(web, "_default_fetcher", WebFetcher(cache_dir=str(tmp_path)))
+    site.serve("/rome", PAGE.format(body="The capital of Italy. " * 20))
+    pages = web.fetch_pages([site.url + "/rome", site.url + "/rome"], max_chars=10)
+    assert [page["title"] for page in pages] == ["Rome", "Rome"]
+    assert all("truncated" in page["text"] for page in pages)
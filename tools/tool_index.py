@@ -0,0 +1,238 @@
+import copy
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOOL_SELECT_PREFILTER_ENABLED = os.getenv("TOOL_SELECT_PREFILTER_ENABLED", "true").lower() == "true"
+# Tools shown to the model after pre-filtering; shorter lists are sent whole
+TOOL_SELECT_TOP_K = int(os.getenv("TOOL_SELECT_TOP_K", 8))
+# Similarity (0-1) the best tool must reach, and its lead over the runner-up, to count as a confident match
+TOOL_SELECT_CONFIDENCE = float(os.getenv("TOOL_SELECT_CONFIDENCE", 0.6))
+TOOL_SELECT_MARGIN = float(os.getenv("TOOL_SELECT_MARGIN", 0.25))
+TOOL_SELECT_CACHE_ENABLED = os.getenv("TOOL_SELECT_CACHE_ENABLED", "true").lower() == "true"
+TOOL_SELECT_CACHE_TTL = float(os.getenv("TOOL_SELECT_CACHE_TTL", 600))
+TOOL_SELECT_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_SELECT_CACHE_MAX_ENTRIES", 1024))
+# Trailing chat messages a cached decision is keyed on, besides the tool state
+TOOL_SELECT_CACHE_TAIL = int(os.getenv("TOOL_SELECT_CACHE_TAIL", 2))
+
+# Terms are cut to this many characters: a crude stemmer that also works for Italian
+STEM_CHARS = 6
+STOPWORDS = {
+    "the", "and", "for", "with", "from", "that", "this", "what", "which", "please", "can", "you", "want",
+    "need", "would", "like", "about", "into", "have", "has", "are", "was", "will", "not", "all", "any",
+    "il", "lo", "la", "gli", "le", "un", "una", "di", "da", "in", "con", "su", "per", "tra", "fra",
+    "che", "come", "del", "della", "dei", "delle", "nel", "nella", "al", "alla", "mi", "ti", "vorrei",
+    "puoi", "voglio", "sono", "non", "e", "o", "a", "i", "is", "of", "to", "me", "my", "an", "on", "it",
+}
+
+
+def _field(item: Dict, *names, default=None):
+    for name in names:
+        if item.get(name) not in (None, ""):
+            return item[name]
+    return default
+
+
+def tool_name(tool: Dict) -> Optional[str]:
+    return _field(tool, "tool_name", "name", "selected_tool")
+
+
+def tool_params(tool: Dict) -> List:
+    params = _field(tool, "params", "parameters", "tool_params", "active_tool_params", default=[])
+    return params if isinstance(params, list) else []
+
+
+def terms(text: str) -> List[str]:
+    # Split snake_case and camelCase too, so tool names match the words of a request
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text)
+    return [
+        word[:STEM_CHARS] for word in re.split(r"[\W_]+", text.lower())
+        if len(word) > 1 and word not in STOPWORDS
+    ]
+
+
+def _tool_terms(tool: Dict) -> List[str]:
+    name = tool_name(tool) or ""
+    description = _field(tool, "description", "tool_description", default="")
+    found = terms(name) * 2 + terms(str(description))  # The name counts double
+    for param in tool_params(tool):
+        if isinstance(param, dict):
+            found += terms(" ".join(str(param.get(key) or "") for key in ("param_name", "name", "param_description", "description")))
+            found += terms(" ".join(str(value) for value in param.get("enums") or []))
+        else:
+            found += terms(str(param))
+    return found
+
+
+class ToolIndex:
+    """
+    TF-IDF vectors of a tool list's names, descriptions and parameter schemas in one
+    NumPy matrix, so ranking every tool against a request is one matrix-vector product.
+    """
+
+    def __init__(self, tools: List[Dict]):
+        self.tools = tools
+        documents = [Counter(_tool_terms(tool)) for tool in tools]
+        self.vocabulary = {}
+        for document in documents:
+            for term in document:
+                self.vocabulary.setdefault(term, len(self.vocabulary))
+        document_frequency = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for document in documents:
+            for term in document:
+                document_frequency[self.vocabulary[term]] += 1
+        self.idf = np.log((1 + len(tools)) / (1 + document_frequency)) + 1.0
+
+        self.matrix = np.zeros((len(tools), len(self.vocabulary)), dtype=np.float32)
+        for row, document in enumerate(documents):
+            for term, count in document.items():
+                self.matrix[row, self.vocabulary[term]] = 1.0 + math.log(count)
+        self.matrix *= self.idf
+        norms = np.linalg.norm(self.matrix, axis=1, keepdims=True)
+        self.matrix /= np.where(norms == 0, 1.0, norms)
+
+    def scores(self, query: str) -> np.ndarray:
+        """Cosine similarity of the query to each tool, in tool list order."""
+        vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for term, count in Counter(terms(query)).items():
+            column = self.vocabulary.get(term)
+            if column is not None:
+                vector[column] = 1.0 + math.log(count)
+        vector *= self.idf
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return np.zeros(len(self.tools), dtype=np.float32)
+        return self.matrix @ (vector / norm)
+
+
+def _fingerprint(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+class _LRU:
+    def __init__(self, max_entries: int, ttl: float = 0.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if self.ttl and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_indexes = _LRU(max_entries=16)
+
+
+def get_index(tool_list: List[Dict]) -> Tuple[ToolIndex, str]:
+    """The index of a tool list, built once per distinct list; also returns the list's fingerprint."""
+    fingerprint = _fingerprint(tool_list)
+    index = _indexes.get(fingerprint)
+    if index is None:
+        index = ToolIndex(tool_list)
+        _indexes.set(fingerprint, index)
+    return index, fingerprint
+
+
+def chat_tail(session_chat_history, messages: int) -> str:
+    """The last messages of a conversation, normalized: case and spacing do not change a decision."""
+    if isinstance(session_chat_history, list):
+        tail = [
+            f"{message.get('role', '')}: {message.get('content', '')}" if isinstance(message, dict) else str(message)
+            for message in session_chat_history[-messages:]
+        ]
+        text = "\n".join(tail)
+    else:
+        text = str(session_chat_history)[-2000:]
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def last_user_text(session_chat_history) -> str:
+    if isinstance(session_chat_history, list):
+        for message in reversed(session_chat_history):
+            if isinstance(message, dict) and message.get("role") == "user":
+                return str(message.get("content", ""))
+        return ""
+    return str(session_chat_history)[-2000:]
+
+
+def narrow_tools(session_chat_history, tool_list: List[Dict]) -> Tuple[List[Dict], Optional[Dict]]:
+    """
+    Return (candidates, confident): the top TOOL_SELECT_TOP_K tools for the last user
+    request, in their original order, and the best tool when it clears
+    TOOL_SELECT_CONFIDENCE and leads the runner-up by TOOL_SELECT_MARGIN. When the request shares no term with
+    any tool, the whole list is returned: lexical similarity found nothing to go on.
+    """
+    if not TOOL_SELECT_PREFILTER_ENABLED or not isinstance(tool_list, list) or not tool_list \
+            or not all(isinstance(tool, dict) for tool in tool_list):
+        return tool_list, None
+    index, _ = get_index(tool_list)
+    scores = index.scores(last_user_text(session_chat_history))
+    if not scores.any():
+        return tool_list, None
+
+    ranked = np.argsort(-scores)
+    best = float(scores[ranked[0]])
+    runner_up = float(scores[ranked[1]]) if len(ranked) > 1 else 0.0
+    confident_tool = None
+    if best >= TOOL_SELECT_CONFIDENCE and best - runner_up >= TOOL_SELECT_MARGIN:
+        confident_tool = tool_list[int(ranked[0])]
+    if len(tool_list) <= TOOL_SELECT_TOP_K:
+        return tool_list, confident_tool
+    return [tool_list[int(position)] for position in sorted(ranked[:TOOL_SELECT_TOP_K])], confident_tool
+
+
+class SelectionCache:
+    """
+    Tool selection and parameter extraction results keyed by the normalized chat tail
+    and the tool state (state, active tool and its parameters, tool list), so a
+    repeated request in the same state is answered without a model call.
+    """
+
+    def __init__(self, max_entries: int = TOOL_SELECT_CACHE_MAX_ENTRIES, ttl: float = TOOL_SELECT_CACHE_TTL):
+        self._entries = _LRU(max_entries, ttl)
+
+    def key(self, call_site: str, session_chat_history, tool_list, state, active_tool, active_tool_params) -> str:
+        tools = get_index(tool_list)[1] if isinstance(tool_list, list) else _fingerprint(tool_list)
+        return _fingerprint([
+            call_site, chat_tail(session_chat_history, TOOL_SELECT_CACHE_TAIL), tools, state, active_tool, active_tool_params
+        ])
+
+    def get(self, key: str) -> Optional[Dict]:
+        if not TOOL_SELECT_CACHE_ENABLED:
+            return None
+        response = self._entries.get(key)
+        return copy.deepcopy(response) if response is not None else None
+
+    def set(self, key: str, response: Dict):
+        if TOOL_SELECT_CACHE_ENABLED:
+            self._entries.set(key, copy.deepcopy(response))
+
+
+selection_cache = SelectionCache()
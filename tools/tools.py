@@ -2,8 +2,10 @@ import logging
 from typing import List, Dict, Optional
 import json
 import re  # Import per le espressioni regolari
+from metrics import metrics
 from models.models import call_model
 from tools.prompts import TOOL_SELECTION_PROMPT, PARAMS_EXTRACTION_PROMPT
+from tools.tool_index import narrow_tools, selection_cache, tool_name, tool_params
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,30 +19,55 @@ def sanitize_gpt_response(response_str: str) -> str:
     response_str = re.sub(r'```$', '', response_str, flags=re.MULTILINE)
     return response_str.strip()
 
-def select_tool(self, session_chat_history, tool_list, active_tool_params):
-
-    if self.data.state != 'waiting_user_params':
+def _decide(session_chat_history, tool_list, active_tool_params, call_site: str) -> Optional[Dict]:
+    if call_site == "tool-select":
+        # Only the tools that lexically match the request go into the prompt
+        candidates, confident_tool = narrow_tools(session_chat_history, tool_list)
+        if confident_tool is not None and not tool_params(confident_tool) and not active_tool_params:
+            # A single clear match with nothing to extract: the model has nothing to decide
+            metrics.TOOL_SELECTIONS.inc(call_site=call_site, path="local")
+            return {"completed": True, "selected_tool": tool_name(confident_tool)}
+        narrowed = isinstance(tool_list, list) and len(candidates) < len(tool_list)
+        metrics.TOOL_SELECTIONS.inc(call_site=call_site, path="model_narrowed" if narrowed else "model")
         GENERATED_PROMPT = TOOL_SELECTION_PROMPT.format(
             session_chat_history=session_chat_history,
-            tool_list=tool_list,
+            tool_list=candidates,
             active_tool_params=active_tool_params
         )
     else:
+        metrics.TOOL_SELECTIONS.inc(call_site=call_site, path="model")
         GENERATED_PROMPT = PARAMS_EXTRACTION_PROMPT.format(
             session_chat_history=session_chat_history,
             active_tool_params=active_tool_params
         )
 
-    response_str = call_model(chat_history=[{"role": "user", "content": GENERATED_PROMPT}], model="gpt-4o")
+    response_str = call_model(chat_history=[{"role": "user", "content": GENERATED_PROMPT}], call_site=call_site, expect_json=True)
     sanitized_response = sanitize_gpt_response(response_str)
-
     try:
-        response = json.loads(sanitized_response)
-        if self.data.state != 'waiting_user_params':
-            self.data.active_tool = response.get('selected_tool')
+        return json.loads(sanitized_response)
     except json.JSONDecodeError as e:
         logger.error(f"Errore nel parsing della risposta JSON: {e}")
-        response = None
+        return None
+
+def select_tool(self, session_chat_history, tool_list, active_tool_params):
+
+    call_site = "tool-select" if self.data.state != 'waiting_user_params' else "param-extract"
+    cache_key = selection_cache.key(
+        call_site, session_chat_history, tool_list if call_site == "tool-select" else None,
+        self.data.state, getattr(self.data, 'active_tool', None), active_tool_params
+    )
+    response = selection_cache.get(cache_key)
+    if response is not None:
+        metrics.TOOL_SELECTIONS.inc(call_site=call_site, path="cache")
+    else:
+        response = _decide(session_chat_history, tool_list, active_tool_params, call_site)
+        if response is None:
+            # An unreadable answer leaves the tool state as it was
+            return None
+        selection_cache.set(cache_key, response)
+
+    if self.data.state != 'waiting_user_params':
+        self.data.active_tool = response.get('selected_tool')
 
     if response.get('active_tool_params') is None:
         self.data.active_tool = response.get('selected_tool')
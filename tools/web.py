@@ -0,0 +1,224 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+WEB_CACHE_DIR = os.getenv("WEB_CACHE_DIR", os.path.join(tempfile.gettempdir(), "autocode-web-cache"))
+WEB_CACHE_TTL = float(os.getenv("WEB_CACHE_TTL", 3600))
+# Cache files older than this many seconds are deleted, then the oldest ones until the cache fits in WEB_CACHE_MAX_MB
+WEB_CACHE_MAX_AGE = float(os.getenv("WEB_CACHE_MAX_AGE", 7 * 86400))
+WEB_CACHE_MAX_MB = float(os.getenv("WEB_CACHE_MAX_MB", 256))
+WEB_FETCH_MAX_WORKERS = int(os.getenv("WEB_FETCH_MAX_WORKERS", 8))
+WEB_FETCH_TIMEOUT = float(os.getenv("WEB_FETCH_TIMEOUT", 10))
+WEB_FETCH_MAX_CHARS = int(os.getenv("WEB_FETCH_MAX_CHARS", 20000))
+WEB_FETCH_USER_AGENT = os.getenv(
+    "WEB_FETCH_USER_AGENT",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+)
+
+SWEEP_INTERVAL = 60
+
+# Elements that never hold the main content of a page
+BOILERPLATE_TAGS = ["script", "style", "noscript", "template", "svg", "iframe", "nav", "header", "footer", "aside", "form"]
+
+
+def extract_main_text(html: str) -> Dict:
+    """Return the title and readable main text of an HTML page, without markup and boilerplate."""
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.title.get_text(strip=True) if soup.title else ""
+    for element in soup(BOILERPLATE_TAGS):
+        element.decompose()
+
+    # Prefer the element that declares itself as the main content, if it has substance
+    root = None
+    for candidate in (soup.find("article"), soup.find("main"), soup.find(attrs={"role": "main"})):
+        if candidate is not None and len(candidate.get_text(strip=True)) > 200:
+            root = candidate
+            break
+    if root is None:
+        root = soup.body or soup
+
+    text = root.get_text("\n", strip=True)
+    text = re.sub(r"[ \t]+", " ", text)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return {"title": title, "text": text}
+
+
+class WebFetcher:
+    """
+    Fetches pages concurrently over a pooled keep-alive session and keeps the extracted
+    text in an on-disk cache. Fresh entries (younger than ttl) are served without a
+    request; stale ones are revalidated with If-None-Match / If-Modified-Since, so an
+    unchanged page costs a 304 instead of a full download and re-parse. Files older than
+    max_age are swept, then the least recently written ones above max_mb.
+    """
+
+    def __init__(self, cache_dir: str = WEB_CACHE_DIR, ttl: float = WEB_CACHE_TTL,
+                 max_workers: int = WEB_FETCH_MAX_WORKERS, session: Optional[requests.Session] = None,
+                 max_age: float = WEB_CACHE_MAX_AGE, max_mb: float = WEB_CACHE_MAX_MB):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.max_age = max_age
+        self.max_bytes = max_mb * 1024 * 1024
+        self._swept_at = 0.0
+        self._sweep_lock = threading.Lock()
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({"User-Agent": WEB_FETCH_USER_AGENT})
+        self.session = session
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def _load(self, url: str) -> Optional[Dict]:
+        try:
+            with open(self._cache_path(url), encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, url: str, entry: Dict):
+        path = self._cache_path(url)
+        try:
+            # Write then rename so concurrent readers never see a partial file
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as cache_file:
+                json.dump(entry, cache_file)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write web cache entry for {url}: {e}")
+        self._sweep()
+
+    def _sweep(self, force: bool = False):
+        now = time.time()
+        with self._sweep_lock:
+            if not force and now - self._swept_at < SWEEP_INTERVAL:
+                return
+            self._swept_at = now
+            try:
+                entries = list(os.scandir(self.cache_dir))
+            except OSError:
+                return
+            files = []
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+            files.sort()
+            total = sum(size for _, size, _ in files)
+            removed = 0
+            cutoff = now - self.max_age
+            for mtime, size, path in files:
+                if mtime >= cutoff and total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+        if removed:
+            logger.info(f"🧹 Removed {removed} web cache files, {total / (1024 * 1024):.1f} MB left")
+
+    def fetch(self, url: str, max_chars: int = WEB_FETCH_MAX_CHARS, timeout: float = WEB_FETCH_TIMEOUT) -> Dict:
+        """Fetch one page and return url, title, text (capped at max_chars), status, from_cache and error."""
+        cached = self._load(url)
+        if cached and time.time() - cached["fetched_at"] < self.ttl:
+            return self._page(cached, max_chars, from_cache=True)
+
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        try:
+            response = self.session.get(url, headers=headers, timeout=timeout)
+            if response.status_code == 304 and cached:
+                cached["fetched_at"] = time.time()
+                self._store(url, cached)
+                return self._page(cached, max_chars, from_cache=True)
+            response.raise_for_status()
+
+            extracted = extract_main_text(response.text)
+            entry = {
+                "url": url,
+                "status": response.status_code,
+                "title": extracted["title"],
+                "text": extracted["text"],
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "fetched_at": time.time()
+            }
+            self._store(url, entry)
+            return self._page(entry, max_chars, from_cache=False)
+        except Exception as e:
+            if cached:
+                # A stale copy beats no copy when the site is down
+                logger.warning(f"Fetching {url} failed ({e}), serving stale cached copy")
+                return self._page(cached, max_chars, from_cache=True)
+            return {"url": url, "title": "", "text": "", "status": None, "from_cache": False, "error": str(e)}
+
+    def fetch_many(self, urls: List[str], max_chars: int = WEB_FETCH_MAX_CHARS,
+                   timeout: float = WEB_FETCH_TIMEOUT) -> List[Dict]:
+        """Fetch urls concurrently; the pages come back in the order of urls."""
+        if not urls:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls)), thread_name_prefix="web-fetch") as pool:
+            return list(pool.map(lambda url: self.fetch(url, max_chars, timeout), urls))
+
+    @staticmethod
+    def _page(entry: Dict, max_chars: int, from_cache: bool) -> Dict:
+        text = entry.get("text", "")
+        if len(text) > max_chars:
+            text = text[:max_chars] + f"\n[... truncated, {len(entry['text']):,} chars in total]"
+        return {
+            "url": entry["url"],
+            "title": entry.get("title", ""),
+            "text": text,
+            "status": entry.get("status"),
+            "from_cache": from_cache,
+            "error": None
+        }
+
+
+_default_fetcher = None
+_default_fetcher_lock = threading.Lock()
+
+
+def get_fetcher() -> WebFetcher:
+    global _default_fetcher
+    if _default_fetcher is None:
+        with _default_fetcher_lock:
+            if _default_fetcher is None:
+                _default_fetcher = WebFetcher()
+    return _default_fetcher
+
+
+def fetch_pages(urls: List[str], max_chars: int = WEB_FETCH_MAX_CHARS, timeout: float = WEB_FETCH_TIMEOUT) -> List[Dict]:
+    """
+    Fetch pages concurrently and return their main text. Each page is a dict with url,
+    title, text, status, from_cache and error (None unless the fetch failed).
+    """
+    return get_fetcher().fetch_many(urls, max_chars=max_chars, timeout=timeout)